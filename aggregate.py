@@ -0,0 +1,130 @@
+import math
+import os
+import numpy as np
+import pandas as pd
+
+'''
+Zoom dependent aggregation of the county layer of the map.
+
+CountyGrid bins every county PID into square lat/lon cells once per data version, at every
+power of two cell size from MAX_CELL_DEG down. level_for_zoom picks the cell size that is
+about CELL_PX pixels on screen at the map zoom, and cluster_counties collapses the counties
+of one date that share a cell into a single marker with summed confirmed/deaths. Cells holding
+a single county keep the county's own row, and from MAX_ZOOM on nothing is aggregated, so
+clicking through to a PID works once zoomed in.
+'''
+
+CELL_PX = 40
+MAX_CELL_DEG = 16
+MAX_ZOOM = float(os.environ.get('COVID_AGGREGATE_MAX_ZOOM', 7))
+MIN_LEVEL = math.floor(math.log2(CELL_PX * 360 / 512 / 2 ** MAX_ZOOM))
+
+
+def level_for_zoom(zoom):
+    '''
+    Cell size exponent (cells are 2**level degrees) for a mapbox zoom, or None for full
+    detail. A mapbox world is 512 * 2**zoom pixels wide.
+    '''
+    if isinstance(zoom, (list, tuple)):
+        zoom = zoom[0]
+    if zoom is None or zoom >= MAX_ZOOM:
+        return None
+    target = CELL_PX * 360 / 512 / 2 ** max(zoom, 0)
+    return int(min(max(math.ceil(math.log2(target)), MIN_LEVEL + 1), math.log2(MAX_CELL_DEG)))
+
+
+class CountyGrid:
+    def __init__(self, master_all):
+        counties = master_all.loc[master_all['granularity'] == 'county', ['PID', 'lat', 'lon']]
+        counties = counties.drop_duplicates('PID')
+        self.pids = counties['PID'].to_numpy()
+        lat = counties['lat'].to_numpy(dtype=float)
+        lon = counties['lon'].to_numpy(dtype=float)
+        # level -> (cell of each PID in self.pids, cell centroid lat, cell centroid lon)
+        self.levels = {}
+        for level in range(MIN_LEVEL + 1, int(math.log2(MAX_CELL_DEG)) + 1):
+            size = 2.0 ** level
+            rows = np.floor((lat + 90) / size).astype(np.int64)
+            cols = np.floor((lon + 180) / size).astype(np.int64)
+            cells, codes = np.unique(rows * 100000 + cols, return_inverse=True)
+            counts = np.bincount(codes, minlength=len(cells))
+            centroid_lat = np.bincount(codes, weights=lat, minlength=len(cells)) / counts
+            centroid_lon = np.bincount(codes, weights=lon, minlength=len(cells)) / counts
+            self.levels[level] = (pd.Series(codes, index=self.pids), centroid_lat, centroid_lon)
+
+    def __len__(self):
+        return len(self.pids)
+
+
+def _label(text):
+    return text.split('<br>')[0]
+
+
+def cluster_counties(plotting_df, grid, level):
+    '''
+    Replace the county rows of one date's map rows with one row per occupied cell of
+    `level`. Clusters carry summed confirmed/deaths, relative values over the summed
+    population of the counties that have one (0 when none does), a PID of None and, when
+    the rows have labels, their name as label.
+    '''
+    if level is None or level not in grid.levels:
+        return plotting_df
+    is_county = (plotting_df['granularity'] == 'county').to_numpy()
+    counties = plotting_df[is_county & (plotting_df['CSize'] > 0).to_numpy()]
+    if counties.empty:
+        return plotting_df
+    codes, centroid_lat, centroid_lon = grid.levels[level]
+    cell = codes.reindex(counties['PID'].to_numpy()).to_numpy()
+    known = ~np.isnan(cell)
+    counties = counties[known]
+    cell = cell[known].astype(np.int64)
+
+    sizes = np.bincount(cell)
+    single = sizes[cell] == 1
+    grouped = counties[~single]
+    cell = cell[~single]
+    confirmed = grouped['confirmed'].to_numpy(dtype=float)
+    deaths = grouped['deaths'].to_numpy(dtype=float)
+    per_capita = grouped['per_capita_confirmed'].to_numpy(dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        population = np.where(per_capita > 0, confirmed / per_capita, np.nan)
+    has_population = ~np.isnan(population)
+
+    frame = pd.DataFrame({
+        'cell': cell,
+        'confirmed': confirmed,
+        'deaths': deaths,
+        'CSize': grouped['CSize'].to_numpy(dtype=float),
+        'population': np.where(has_population, population, 0),
+        'confirmed_known': np.where(has_population, confirmed, 0),
+        'deaths_known': np.where(has_population, deaths, 0),
+        'label': grouped['Text_Confirmed'].map(_label).to_numpy()})
+    largest = frame.sort_values('confirmed', kind='mergesort').drop_duplicates('cell', keep='last')
+    by_cell = frame.drop(columns='label').groupby('cell')
+    sums = by_cell.sum()
+    sums['count'] = by_cell.size()
+    sums['label'] = largest.set_index('cell')['label']
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        per_capita_confirmed = (sums['confirmed_known'] / sums['population']).fillna(0)
+        per_capita_deaths = (sums['deaths_known'] / sums['population']).fillna(0)
+    names = sums['count'].astype(str) + ' counties around ' + sums['label']
+    clusters = pd.DataFrame({
+        'PID': None,
+        'granularity': 'county',
+        'lat': centroid_lat[sums.index],
+        'lon': centroid_lon[sums.index],
+        'confirmed': sums['confirmed'].to_numpy(),
+        'deaths': sums['deaths'].to_numpy(),
+        'CSize': sums['CSize'].to_numpy(),
+        'per_capita_confirmed': per_capita_confirmed.to_numpy(),
+        'per_capita_deaths': per_capita_deaths.to_numpy(),
+        'Text_Confirmed': (names + '<br>Total Cases: ' +
+                           sums['confirmed'].map('{:,.0f}'.format)).to_numpy(),
+        'Text_Deaths': (names + '<br>Total Deaths: ' +
+                        sums['deaths'].map('{:,.0f}'.format)).to_numpy()})
+    if 'label' in plotting_df.columns:
+        clusters['label'] = names.to_numpy()
+    rest = plotting_df[~is_county]
+    columns = list(clusters.columns)
+    return pd.concat([rest[columns], counties[single][columns], clusters], ignore_index=True)
@@ -0,0 +1,177 @@
+import json
+import base64
+import numpy as np
+import flask
+from plotly import graph_objs as go
+from dash.dependencies import Input, Output, State, ClientsideFunction
+import callbacks
+import snapshot
+
+'''
+Opt-in clientside map animation.
+
+Once per data version and view (granularities, metric, relative) the browser downloads every
+date of the map from an immutable, versioned url: lat/lon/PID and hover labels once per
+location, then one base64 array per date with the marker values plus that date's
+sizeref/cmin/cmid/cmax. assets/map_animation.js swaps the marker arrays locally when the
+slider moves or the play button is running, so render_map is not called for slider ticks.
+Built payloads are kept in callbacks.FRAMES_CACHE until their version is evicted.
+'''
+
+FRAMES_URL = '/_map-frames/<version>/<view>.json'
+LOCATIONS = {'country', 'state', 'province', 'county'}
+METRICS = ('confirmed', 'deaths')
+
+
+def view_key(locations_values, metrics_values, relative_check):
+    '''The part of the url naming the view, e.g. country-county_confirmed_relative'''
+    metrics = [m for m in METRICS if metrics_values and m in metrics_values]
+    return '{}_{}_{}'.format('-'.join(sorted(set(locations_values or []))) or 'none',
+                             '-'.join(metrics) or 'none',
+                             'relative' if relative_check else 'total')
+
+
+def parse_view(view):
+    '''The inputs of view_key back, ValueError unless view is exactly what view_key makes of them'''
+    parts = view.split('_')
+    if len(parts) != 3 or parts[2] not in ('relative', 'total'):
+        raise ValueError('Unknown map view {!r}'.format(view))
+    locations = [] if parts[0] == 'none' else parts[0].split('-')
+    metrics = [] if parts[1] == 'none' else parts[1].split('-')
+    relative = ['relative'] if parts[2] == 'relative' else []
+    if not LOCATIONS.issuperset(locations) or not set(METRICS).issuperset(metrics) or \
+            view_key(locations, metrics, relative) != view:
+        raise ValueError('Unknown map view {!r}'.format(view))
+    return locations, metrics, relative
+
+
+def _encode(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode('ascii')
+
+
+def _colorscale(name):
+    # plotly.js only knows some scales by name, so ship the expanded one
+    return [list(step) for step in go.Scattermapbox(marker=dict(colorscale=name)).marker.colorscale]
+
+
+def build_payload(data, locations_values, metrics_values, relative_check):
+    '''
+    Group every date's cached map traces by trace name, line them up on the union of PIDs
+    the view ever shows and encode one array per date. Points a date does not draw are NaN.
+    Values go as float64 so the hover counts and "1 in N" rates come out exactly as
+    render_map's. In absolute mode size and color are the same values, and in relative
+    mode size is color clipped at `clip`, so one array per date carries both.
+    '''
+    n_dates = len(data.date_mapper)
+    # Not stored in MAP_CACHE, where they would push out the slider's entries
+    per_date = [callbacks.get_map_traces(data, i, locations_values, metrics_values, relative_check, store=False)
+                for i in range(n_dates)]
+    traces = []
+    names = []
+    for date_traces in per_date:
+        for trace in date_traces:
+            if 'marker' in trace and trace['name'] not in names:
+                names.append(trace['name'])
+    for name in names:
+        positions = {}
+        pids = []
+        lat = []
+        lon = []
+        labels = []
+        for date_traces in per_date:
+            for trace in date_traces:
+                if trace.get('name') != name:
+                    continue
+                for i, pid in enumerate(trace['customdata']):
+                    if pid not in positions:
+                        positions[pid] = len(pids)
+                        pids.append(pid)
+                        lat.append(trace['lat'][i])
+                        lon.append(trace['lon'][i])
+                        labels.append(trace['text'][i].split(':')[0])
+        relative = name.startswith('Relative')
+        frames = []
+        for date_traces in per_date:
+            values = np.full(len(pids), np.nan)
+            frame = {'values': None}
+            for trace in date_traces:
+                if trace.get('name') != name:
+                    continue
+                index = [positions[pid] for pid in trace['customdata']]
+                values[index] = np.asarray(trace['marker']['color'], dtype=float)
+                for key in ('sizeref', 'cmin', 'cmid', 'cmax'):
+                    frame[key] = float(trace['marker'][key])
+            frame['values'] = _encode(values, '<f8')
+            frames.append(frame)
+        traces.append({
+            'name': name,
+            'hover': 'relative' if relative else 'total',
+            'clip': (0.01 if 'Cases' in name else 0.003) if relative else None,
+            'colorscale': _colorscale('YlOrBr' if 'Cases' in name else 'Reds'),
+            'pid': [int(p) for p in pids],
+            'lat': _encode(lat, '<f4'),
+            'lon': _encode(lon, '<f4'),
+            'labels': labels,
+            'frames': frames})
+    return {'version': data.version,
+            'dates': list(data.date_mapper['Date'].dt.strftime('%Y-%m-%d')),
+            'traces': traces}
+
+
+def serve_frames(version, view):
+    data = snapshot.get(version)
+    if data is None or version != data.version:
+        # Evicted versions are gone; the page falls back to server rendered maps
+        flask.abort(404)
+    try:
+        view_values = parse_view(view)
+    except ValueError:
+        flask.abort(404)
+    key = (version, view)
+    body = callbacks.FRAMES_CACHE.get(key)
+    if body is None:
+        body = json.dumps(build_payload(data, *view_values))
+        callbacks.FRAMES_CACHE.put(key, body)
+    response = flask.Response(body, mimetype='application/json')
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
+
+
+def register(app):
+    app.server.add_url_rule(FRAMES_URL, 'map_frames', serve_frames)
+
+    @app.callback(Output('map-frames-url', 'data'),
+                  [Input('animate-check', 'value'),
+                   Input('check-locations', 'value'),
+                   Input('check-metrics', 'value'),
+                   Input('relative_rate_check', 'value')],
+                  [State('data-version', 'data')])
+    def frames_url(animate, locations_values, metrics_values, relative_check, version=None):
+        if not animate:
+            return None
+        locations_values = list(locations_values or [])
+        if 'province' in locations_values:
+            locations_values.append('state')
+        return FRAMES_URL.replace('<version>', str(snapshot.get(version).version)).replace(
+            '<view>', view_key(locations_values, metrics_values, relative_check))
+
+    app.clientside_callback(
+        ClientsideFunction('map_animation', 'render'),
+        Output('map', 'figure'),
+        [Input('map-base', 'data'),
+         Input('date_slider', 'value'),
+         Input('map-frames-url', 'data')])
+
+    app.clientside_callback(
+        ClientsideFunction('map_animation', 'toggle_play'),
+        [Output('play-interval', 'disabled'),
+         Output('play-button', 'children')],
+        [Input('play-button', 'n_clicks'),
+         Input('animate-check', 'value')])
+
+    app.clientside_callback(
+        ClientsideFunction('map_animation', 'step'),
+        Output('date_slider', 'value'),
+        [Input('play-interval', 'n_intervals')],
+        [State('date_slider', 'value'),
+         State('date_slider', 'max')])
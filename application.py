@@ -1,18 +1,31 @@
+# First, so startup.BOOT times the imports below
+import startup
 import ast
-from urllib.parse import urlparse, parse_qs, urlencode
+import json
+from urllib.parse import urlparse, parse_qs, parse_qsl, urlencode
 import dash
+import flask
+import plotly.utils
 from dash.dependencies import Input, Output, State
 import dash_html_components as html
 import dash_core_components as dcc
 import callbacks
+import refresher
+import animation
+import datastore
+import metrics
+import profiler
+import parallel
+import snapshot
 import warnings
 import pandas as pd
 # /
 # to generate the tinyurl:
 
-# Cancel copy warnings of pandas
+# Cancel copy warnings of pandas (pandas.errors has them from 1.5 on)
 warnings.filterwarnings(
-    "ignore", category=pd.core.common.SettingWithCopyWarning)
+    "ignore", category=getattr(pd.errors, 'SettingWithCopyWarning', None) or pd.core.common.SettingWithCopyWarning)
+startup.BOOT.mark('imports')
 
 
 def get_meta():
@@ -54,10 +67,13 @@ app.index_string = open('assets/customIndex.html').read()
 
 # Serve layout in a function so we can update it dynamically
 # Must go after the app is initialized
+# The data itself is kept fresh by a background refresher, so a page load
+# only reads whatever snapshot is current
+data_refresher = refresher.DataRefresher(refresher.get_source())
 
 
 def serve_layout():
-    callbacks.serve_data(serve_local=False)
+    data_refresher.start(background=startup.BACKGROUND)
     return html.Div([
         dcc.Location(id='url', refresh=False),
         html.Div(id='page-layout')])
@@ -110,6 +126,8 @@ def parse_state(url):
     if statedict:
         for key, value in statedict.items():
             statedict[key] = list(map(list, zip(value[0::2], value[1::2])))
+            if key in TEXT_STATE:
+                continue
             # go through every parsed value pv and check whether it is a list
             # or a number and cast appropriately:
             for pv in statedict[key]:
@@ -186,27 +204,27 @@ def markdown_popup():
     )
 
 
-def get_counter_cards():
+def get_counter_cards(data):
     return [html.Div(id='cases-card',
                      className='card tooltip',
-                     children=callbacks.get_total_cases()),
+                     children=callbacks.get_total_cases(data)),
 
             html.Div(id='deaths-card',
                      className='card tooltip',
-                     children=callbacks.get_total_deaths()),
+                     children=callbacks.get_total_deaths(data)),
 
             html.Div(id='mortality-card',
                      className='card tooltip',
-                     children=callbacks.get_mortality_rate()),
+                     children=callbacks.get_mortality_rate(data)),
             html.Div(id='growth-card',
                      className='card tooltip',
-                     children=callbacks.get_growth_rate()),
+                     children=callbacks.get_growth_rate(data)),
             html.Div(id='relative-card-confirm',
                      className='card tooltip',
-                     children=callbacks.get_relative_card())]
+                     children=callbacks.get_relative_card(data))]
 
 
-def layout_header(params):
+def layout_header(params, data):
     header = html.Div(
         id="header",
         className='container',
@@ -225,7 +243,7 @@ def layout_header(params):
                             html.Div(id='slide', children=html.A('Learn More'))])])]),
             html.Div(
                 id='counters-container',
-                children=get_counter_cards(),
+                children=get_counter_cards(data),
             )
         ])
     return header
@@ -296,7 +314,9 @@ def get_table_tabs_container(params):
     )
 
 
-def layout_app(params):
+def layout_app(params, data):
+    # Only the top and the selected locations, the dropdown searches for the rest
+    selected = dict(params.get('dropdown_container', [])).get('value', list(callbacks.get_default_dropdown(data)))
     return html.Div(id='app-container', className='app-container', children=[
         html.Div(id='left-container', className='left-container', children=[
             html.Div(id='slider-container', className='container',
@@ -304,11 +324,11 @@ def layout_app(params):
                        html.H4('Slide to Change Date'),
                        apply_value_from_querystring(params)(dcc.Slider)(
                            id='date_slider',
-                           min=callbacks.get_min_date(),
-                           max=callbacks.get_max_date(),
+                           min=callbacks.get_min_date(data),
+                           max=callbacks.get_max_date(data),
                            step=1,
-                           value=callbacks.get_max_date()-14,
-                           marks=callbacks.get_date_marks()
+                           value=callbacks.get_max_date(data)-14,
+                           marks=callbacks.get_date_marks(data)
                        )]),
 
             html.Div(id='map-container', className='container', children=[
@@ -318,7 +338,16 @@ def layout_app(params):
                     id='relative_rate_check',
                     options=[{'label': 'Show Relative Rate', 'value': 'relative'}],
                     value=['relative']
-                )
+                ),
+                html.Div(id='animate-controls', children=[
+                    dcc.Checklist(
+                        id='animate-check',
+                        options=[{'label': 'Animate', 'value': 'animate'}],
+                        value=[]),
+                    html.Button('Play', id='play-button', className='button', n_clicks=0),
+                    dcc.Interval(id='play-interval', interval=400, disabled=True)]),
+                dcc.Store(id='map-base'),
+                dcc.Store(id='map-frames-url')
             ])]),
         html.Div(id='right-container', className='container', children=[
             html.H4('Select For Comparisons'),
@@ -326,8 +355,8 @@ def layout_app(params):
                      children=[
                          apply_value_from_querystring(params)(dcc.Dropdown)(
                              id='dropdown_container',
-                             options=callbacks.get_dropdown_options(),
-                             value=callbacks.get_default_dropdown(),
+                             options=data.search.search(None, selected),
+                             value=callbacks.get_default_dropdown(data),
                              multi=True,
                              style={'position': 'relative',
                                     'zIndex': '3'},
@@ -361,12 +390,15 @@ def layout_app(params):
     ])
 
 
-def build_layout(params):
+def build_layout(params, data):
     # Every time we serve the layout, we remake the Data:
     # callbacks.serve_data()
     return html.Div(id='root-container', children=[
-        layout_header(params),
-        layout_app(params),
+        # The data version the page was loaded with, which its callbacks resolve against
+        apply_value_from_querystring(params)(dcc.Store)(id='data-version', data=data.version),
+        html.Div(id='version-notice', className='version-notice'),
+        layout_header(params, data),
+        layout_app(params, data),
         markdown_popup(),
         # html.Button(id="tiny-url", className='button', n_clicks=0, children=[
         # html.Div(id='tiny_url_div', children=html.A('Get Link'))]),
@@ -386,13 +418,73 @@ component_ids = [
     ('deaths-confirmed', 'value'),
     ('prediction', 'value'),
     ('relative_rate_check', 'value'),
-    ('tabs-table-values', 'value')
+    ('tabs-table-values', 'value'),
+    ('data-version', 'data')
 ]
 
+# Querystring values kept as strings, a version id can look like a number
+TEXT_STATE = {'data-version'}
+
 # Turn the list of 4 (id, param) tuples into a list of
 # one component id tuple (len=4) and one parameter tuple (len=4):
 component_ids_zipped = list(zip(*component_ids))
 
+
+def layout_template(data):
+    '''
+    build_layout({}, data) as plain json, with the props each querystring component takes.
+    Built once per data version: the cards, dropdown options, date marks and readme only
+    change with the data.
+    '''
+    template = callbacks.LAYOUT_CACHE.get(data.version)
+    if template is None:
+        layout = build_layout({}, data)
+        prop_names = {c.id: set(c._prop_names) for c in layout._traverse()
+                      if getattr(c, 'id', None) in component_ids_zipped[0]}
+        tree = json.loads(json.dumps(layout, cls=plotly.utils.PlotlyJSONEncoder))
+        template = (tree, prop_names)
+        callbacks.LAYOUT_CACHE.put(data.version, template)
+    return template
+
+
+def patch_layout(node, values):
+    '''
+    node with values[id] set on the props of the components with that id. Only the
+    components on the way to a patched one are copied, the rest is shared with node.
+    '''
+    if isinstance(node, list):
+        patched = [patch_layout(child, values) for child in node]
+        return node if all(a is b for a, b in zip(patched, node)) else patched
+    if not isinstance(node, dict) or 'props' not in node:
+        return node
+    props = node['props']
+    children = patch_layout(props.get('children'), values)
+    update = values.get(props.get('id'))
+    if update is None and children is props.get('children'):
+        return node
+    props = dict(props)
+    if 'children' in props:
+        props['children'] = children
+    props.update(update or {})
+    return dict(node, props=props)
+
+
+def cached_layout(params, data):
+    '''build_layout(params, data) from the cached template, setting only the querystring values'''
+    tree, prop_names = layout_template(data)
+    values = {}
+    for component_id, param_values in params.items():
+        if component_id not in prop_names:
+            continue
+        if any(param not in prop_names[component_id] for param, _ in param_values):
+            # Let the component reject the unknown prop as it would without the cache
+            return build_layout(params, data)
+        values[component_id] = dict(param_values)
+    dropdown = values.get('dropdown_container', {})
+    if 'value' in dropdown and 'options' not in dropdown:
+        dropdown['options'] = data.search.search(None, dropdown['value'])
+    return patch_layout(tree, values) if values else tree
+
 @app.callback(Output('page-layout', 'children'),
               [Input('url', 'href')])
 def page_load(href):
@@ -402,8 +494,13 @@ def page_load(href):
     """
     if not href:
         return []
+    if startup.BACKGROUND and not data_refresher.loaded.wait(startup.READY_TIMEOUT):
+        return html.Div(className='loading-notice',
+                        children='The latest data is still loading, please refresh in a few seconds.')
     state = parse_state(href)
-    return build_layout(state)
+    # The version in the url while it is retained, else the latest and version_notice says so
+    version = dict(state.get('data-version', [])).get('data')
+    return cached_layout(state, snapshot.get(version))
 
 
 @app.callback(Output('url', 'search'),
@@ -418,8 +515,112 @@ def update_url_state(*values):
     return encode_state(component_ids_zipped, values)
 
 
+@app.callback(Output('version-notice', 'children'),
+              [Input('data-version', 'data'),
+               Input('date_slider', 'value'),
+               Input('dropdown_container', 'value'),
+               Input('tabs-values', 'value'),
+               Input('tabs-table-values', 'value')],
+              [State('url', 'search')])
+def version_notice(version, *values):
+    """
+    Once the data version of the page is evicted its callbacks use the latest data, where
+    the slider dates may have moved. Say so, with a link to the page on the latest data.
+    """
+    if version is None or version in snapshot.versions():
+        return None
+    search = [(key, value) for key, value in parse_qsl((values[-1] or '').lstrip('?')) if key != 'data-version']
+    return ['The data was updated since this page was loaded and its version is no longer kept, '
+            'so the page now shows the latest data. ',
+            html.A('Reload with the latest data', href='/?' + urlencode(search))]
+
+
+def _version():
+    data = snapshot.current()
+    return data.version if data else None
+
+
+@app.server.route('/_cache-stats')
+def cache_stats():
+    '''Entries, bytes, hit rate and evictions of the per data version caches'''
+    return flask.jsonify(version=_version(),
+                         snapshots=snapshot.stats(),
+                         map=callbacks.MAP_CACHE.stats(),
+                         layout=callbacks.LAYOUT_CACHE.stats(),
+                         outputs=callbacks.OUTPUT_CACHE.stats(),
+                         map_frames=callbacks.FRAMES_CACHE.stats())
+
+
+def _rss_mb():
+    try:
+        with open('/proc/self/status') as fh:
+            for line in fh:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+@app.server.route('/_memory-report')
+def memory_report():
+    '''
+    Bytes per column of MASTER_ALL and MASTER_PID before and after compacting, and the
+    worker RSS. A store is compacted when it is written, so its report is in the manifest.
+    '''
+    data = snapshot.get()
+    tables = data.memory_report if data else None
+    source = data_refresher.source
+    if isinstance(source, refresher.StoreSource):
+        manifest = datastore.read_manifest(source.store_dir)
+        tables = {name: table.get('report') for name, table in manifest['tables'].items()}
+    return flask.jsonify(version=data.version if data else None,
+                         rss_mb=_rss_mb(),
+                         tables=tables)
+
+
+@app.server.route('/healthz')
+def healthz():
+    '''The worker is up and serving, whether or not its data is loaded'''
+    return flask.jsonify(status='ok', uptime_s=round(startup.BOOT.elapsed(), 2), boot=startup.BOOT.as_list())
+
+
+@app.server.route('/readyz')
+def readyz():
+    '''200 once the data is loaded, 503 before, with the time spent in each startup phase'''
+    ready = data_refresher.loaded.is_set()
+    timings = data_refresher.timings
+    return flask.jsonify(ready=ready,
+                         version=_version(),
+                         ready_after_s=data_refresher.ready_after,
+                         boot=startup.BOOT.as_list(),
+                         data=timings.as_list() if timings else None,
+                         ingest=parallel.REPORT,
+                         last_error=str(data_refresher.last_error) if data_refresher.last_error else None), \
+        200 if ready else 503
+
+
+@app.server.route('/metrics')
+def prometheus_metrics():
+    '''Per callback latency and payload histograms, see metrics'''
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 callbacks.register_callbacks(app)
+animation.register(app)
+snapshot.register(app.server)
+# After every callback is registered
+metrics.instrument(app)
+profiler.register(app)
 application = app.server
+startup.BOOT.mark('app')
+print('Worker up: {}'.format(startup.BOOT))
+
+if startup.BACKGROUND:
+    # Load while already answering requests. before_request starts it again in a worker
+    # forked from a preloaded app, where the thread is gone
+    data_refresher.start(background=True)
+    application.before_request(lambda: data_refresher.start(background=True))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,152 @@
+// Clientside map animation, see animation.py for the payload format.
+// The payload for a url is fetched once and kept; urls carry the data version so they never change.
+
+var mapFrames = {};
+// mapFrames value of a url whose payload is still downloading
+var LOADING = {};
+// The last render asked for while its payload was downloading, drawn when it arrives
+var waiting = null;
+
+function decodeArray(b64, ArrayType) {
+    var raw = window.atob(b64);
+    var bytes = new Uint8Array(raw.length);
+    for (var i = 0; i < raw.length; i++) {
+        bytes[i] = raw.charCodeAt(i);
+    }
+    return new ArrayType(bytes.buffer);
+}
+
+function decodePayload(payload) {
+    payload.traces.forEach(function (trace) {
+        trace.lat = decodeArray(trace.lat, Float32Array);
+        trace.lon = decodeArray(trace.lon, Float32Array);
+        trace.frames.forEach(function (frame) {
+            frame.values = decodeArray(frame.values, Float64Array);
+        });
+    });
+    return payload;
+}
+
+function drawWaiting(url) {
+    // Dash 1.x clientside callbacks can't return a Promise, so the figure the download was
+    // started for is drawn straight into the map's plot; later slider moves go through render
+    var pending = waiting;
+    if (!pending || pending.url !== url) {
+        return;
+    }
+    waiting = null;
+    var graph = document.querySelector('#map .js-plotly-plot');
+    var figure = frameFigure(mapFrames[url], pending.base, pending.dateValue);
+    if (graph && window.Plotly && figure !== pending.base) {
+        window.Plotly.react(graph, figure.data, figure.layout);
+    }
+}
+
+function loadFrames(url) {
+    if (url in mapFrames) {
+        return mapFrames[url];
+    }
+    mapFrames[url] = LOADING;
+    var request = new XMLHttpRequest();
+    request.open('GET', url, true);
+    request.onload = function () {
+        mapFrames[url] = request.status === 200 ? decodePayload(JSON.parse(request.responseText)) : null;
+        drawWaiting(url);
+    };
+    request.onerror = function () {
+        mapFrames[url] = null;
+    };
+    request.send(null);
+    return LOADING;
+}
+
+function hoverText(trace, i, value) {
+    if (trace.hover === 'relative') {
+        var oneIn = value > 0 ? Math.trunc(1 / value) : 0;
+        return trace.labels[i] + ': 1 in ' + oneIn.toLocaleString('en-US');
+    }
+    return trace.labels[i] + ': ' + Math.trunc(value).toLocaleString('en-US');
+}
+
+function frameTrace(trace, dateValue) {
+    var frame = trace.frames[dateValue];
+    var lon = [], lat = [], pid = [], text = [], size = [], color = [];
+    for (var i = 0; i < trace.pid.length; i++) {
+        var value = frame.values[i];
+        if (isNaN(value)) {
+            continue;
+        }
+        lon.push(trace.lon[i]);
+        lat.push(trace.lat[i]);
+        pid.push(trace.pid[i]);
+        text.push(hoverText(trace, i, value));
+        color.push(value);
+        size.push(trace.clip !== null ? Math.min(value, trace.clip) : value);
+    }
+    return {
+        type: 'scattermapbox',
+        lon: lon,
+        lat: lat,
+        customdata: pid,
+        text: text,
+        hoverinfo: 'text',
+        name: trace.name,
+        mode: 'markers',
+        marker: {
+            opacity: 0.95,
+            sizemin: 2,
+            sizeref: frame.sizeref,
+            reversescale: false,
+            colorscale: trace.colorscale,
+            size: size,
+            color: color,
+            cmax: frame.cmax,
+            cmin: frame.cmin,
+            cmid: frame.cmid,
+            sizemode: 'area'
+        }
+    };
+}
+
+function frameFigure(payload, base, dateValue) {
+    if (!payload || dateValue === undefined || dateValue === null) {
+        return base;
+    }
+    var data = payload.traces.map(function (trace) {
+        return frameTrace(trace, dateValue);
+    });
+    if (data.length === 0) {
+        data = [{type: 'scattermapbox', lon: [], lat: []}];
+    }
+    // uirevision keeps the user's pan/zoom while frames are swapped
+    var layout = Object.assign({}, base.layout, {uirevision: 'animate'});
+    return {data: data, layout: layout};
+}
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    map_animation: {
+        render: function (base, dateValue, url) {
+            if (!url || !base) {
+                return base;
+            }
+            var payload = loadFrames(url);
+            if (payload === LOADING) {
+                // The server rendered map of this date until the download is done
+                waiting = {url: url, base: base, dateValue: dateValue};
+                return base;
+            }
+            waiting = null;
+            return frameFigure(payload, base, dateValue);
+        },
+        toggle_play: function (nClicks, animate) {
+            var playing = Boolean(animate && animate.length) && nClicks % 2 === 1;
+            return [!playing, playing ? 'Pause' : 'Play'];
+        },
+        step: function (nIntervals, value, max) {
+            if (value === undefined || value === null || value >= max) {
+                return 0;
+            }
+            return value + 1;
+        }
+    }
+});
@@ -0,0 +1,68 @@
+import json
+import argparse
+from benchmarks import common
+
+'''
+Per-callback latency of the comparison graphs and table with 1, 10 and 100 selected
+locations, now that they read from the PID x Date cube. The lookup rows compare pulling
+the selected series out of MASTER_ALL the old way (reset_index + filter per PID) with
+row slices of the cube.
+
+    python -m benchmarks.bench_cube --pids 3500 --days 300
+'''
+
+TABS = ['total_cases_graph', 'per_day_cases', 'exponential', 'gr']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pids', type=int, default=3500)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results as json')
+    args = parser.parse_args()
+
+    application, client = common.start_app(args.pids, args.days)
+    data = application.snapshot.current()
+    ranked = list(data.master_pid.sort_values('confirmed')[::-1].index)
+
+    results = []
+    for n in (1, 10, 100):
+        values = [int(v) for v in ranked[:n]]
+
+        def legacy_lookup():
+            for value in values:
+                master_df = data.master_all.reset_index()
+                master_df[master_df['PID'] == value].set_index('Date')
+
+        def cube_lookup():
+            for value in values:
+                data.cube.frame(value)
+
+        results.append({'callback': 'lookup (MASTER_ALL scan)', 'locations': n,
+                        'ms': common.timeit(legacy_lookup, args.repeat)})
+        results.append({'callback': 'lookup (cube)', 'locations': n,
+                        'ms': common.timeit(cube_lookup, args.repeat)})
+
+        for tab in TABS:
+            inputs = [('dropdown_container', 'value', values), ('tabs-values', 'value', tab),
+                      ('log-check', 'value', 'log'), ('deaths-confirmed', 'value', 'confirmed'),
+                      ('prediction', 'value', ['prediction'])]
+            state = [('content-readout', 'relayoutData', None)]
+            ms = common.timeit(lambda: client.call('content-readout.figure', inputs, state), args.repeat)
+            results.append({'callback': 'render_tab_content[{}]'.format(tab), 'locations': n, 'ms': ms})
+
+        inputs = [('dropdown_container', 'value', values), ('tabs-table-values', 'value', 'conf-tab')]
+        ms = common.timeit(lambda: client.call('table-div.children', inputs), args.repeat)
+        results.append({'callback': 'render_table', 'locations': n, 'ms': ms})
+
+    print('{:<40}{:>10}{:>12}'.format('callback', 'locations', 'ms'))
+    for r in results:
+        print('{:<40}{:>10}{:>12.1f}'.format(r['callback'], r['locations'], r['ms']))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
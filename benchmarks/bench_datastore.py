@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+'''
+RSS per worker and time-to-ready: gzip pickles vs the memory mapped columnar store.
+
+Starts N worker processes per mode at the same time (like gunicorn would), each loads and
+prepares the data, touches every column and reports. PSS splits shared pages between the
+processes mapping them, so it is the number to compare when the store is shared.
+
+    python -m benchmarks.bench_datastore --pids 3500 --days 300 --workers 4
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _proc_memory():
+    memory = {}
+    with open('/proc/self/status') as fh:
+        for line in fh:
+            if line.startswith('VmRSS:'):
+                memory['rss_mb'] = int(line.split()[1]) / 1024
+    try:
+        with open('/proc/self/smaps_rollup') as fh:
+            for line in fh:
+                if line.startswith('Pss:'):
+                    memory['pss_mb'] = int(line.split()[1]) / 1024
+    except OSError:
+        memory['pss_mb'] = None
+    return memory
+
+
+def worker(mode, directory):
+    start = time.perf_counter()
+    import pandas as pd
+    import callbacks
+    import datastore
+    imported = time.perf_counter()
+    base = _proc_memory()
+    if mode == 'pickle':
+        master_all = pd.read_pickle(os.path.join(directory, 'MASTER_ALL.pkl'), compression='gzip')
+        master_pid = pd.read_pickle(os.path.join(directory, 'MASTER_PID.pkl'), compression='gzip')
+        metric_cube = None
+    else:
+        master_all, master_pid, metric_cube = datastore.load(os.path.join(directory, 'store'))
+    data = callbacks.prepare_data(master_all, master_pid, metric_cube)
+    ready = time.perf_counter()
+    # Touch every numeric column and the cube so mapped pages are actually resident
+    for name in data[0].columns:
+        if data[0][name].dtype.kind in 'fiub':
+            data[0][name].to_numpy().sum()
+    for values in data[4].metrics.values():
+        values.sum()
+    result = {'mode': mode, 'import_s': imported - start, 'load_s': ready - imported}
+    result.update(_proc_memory())
+    result['data_rss_mb'] = result['rss_mb'] - base['rss_mb']
+    if result['pss_mb'] is not None:
+        result['data_pss_mb'] = result['pss_mb'] - base['pss_mb']
+    print(json.dumps(result), flush=True)
+    # Hold the memory until the parent has read everybody
+    sys.stdin.read()
+
+
+def run_mode(mode, directory, workers):
+    procs = [subprocess.Popen([sys.executable, '-m', 'benchmarks.bench_datastore', '--worker', mode, directory],
+                              cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True)
+             for _ in range(workers)]
+    results = [json.loads(p.stdout.readline()) for p in procs]
+    for p in procs:
+        p.stdin.close()
+        p.wait()
+    summary = {'mode': mode, 'workers': workers}
+    for key in ('load_s', 'rss_mb', 'pss_mb', 'data_rss_mb', 'data_pss_mb'):
+        values = [r[key] for r in results if r.get(key) is not None]
+        summary[key] = sum(values) / len(values) if values else None
+    summary['total_pss_mb'] = sum(r['pss_mb'] for r in results) if summary['pss_mb'] is not None else None
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pids', type=int, default=3500)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help='write results as json')
+    parser.add_argument('--worker', nargs=2, metavar=('MODE', 'DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(*args.worker)
+        return
+
+    sys.path.insert(0, ROOT)
+    from benchmarks import synthetic
+    import datastore
+    directory = tempfile.mkdtemp(prefix='covid-bench-')
+    master_all, master_pid = synthetic.write_pickles(directory, n_pids=args.pids, n_days=args.days)
+    datastore.ingest(master_all, master_pid, os.path.join(directory, 'store'))
+    print('{} rows x {} columns in {}'.format(len(master_all), len(master_all.columns), directory))
+    del master_all, master_pid
+
+    results = [run_mode(mode, directory, args.workers) for mode in ('pickle', 'store')]
+    print('{:<8}{:>9}{:>12}{:>12}{:>16}{:>12}{:>16}'.format(
+        'mode', 'workers', 'ready (s)', 'RSS (MB)', 'data RSS (MB)', 'PSS (MB)', 'data PSS (MB)'))
+    for r in results:
+        print('{:<8}{:>9}{:>12.3f}{:>12.1f}{:>16.1f}{:>12}{:>16}'.format(
+            r['mode'], r['workers'], r['load_s'], r['rss_mb'], r['data_rss_mb'],
+            '-' if r['pss_mb'] is None else '{:.1f}'.format(r['pss_mb']),
+            '-' if r['data_pss_mb'] is None else '{:.1f}'.format(r['data_pss_mb'])))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
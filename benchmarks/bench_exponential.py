@@ -0,0 +1,65 @@
+import json
+import argparse
+from datetime import timedelta
+from benchmarks import common
+
+'''
+The Exponential tab with 1, 10 and 50 selected locations. "loop" is the per date .loc
+loop plot_exponential used to run for each location, "engine" is MetricCube.trailing_window
+for all of them at once, and "tab" is the whole render_tab_content callback.
+
+    python -m benchmarks.bench_exponential --pids 3500 --days 300
+'''
+
+
+def legacy_series(cube, pid, backtrack=7):
+    full_report = cube.frame(pid, ['confirmed', 'deaths']).set_index('forcast', append=True)
+    plottable = full_report.join(full_report.diff(), lsuffix='_cum', rsuffix='_diff')
+    plottable = plottable.fillna(0).reset_index().set_index('Date')
+    indexes = plottable.index
+    points = []
+    for indexer in range(1, len(indexes)):
+        date = indexes[indexer]
+        x = plottable.loc[date]['confirmed_cum']
+        if indexer > backtrack:
+            y = plottable.loc[date - timedelta(days=backtrack): date].sum()['confirmed_diff']
+        else:
+            y = plottable.loc[: indexes[indexer]].sum()['confirmed_diff']
+        points.append((x, y, plottable.loc[date]['forcast']))
+    return points
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pids', type=int, default=3500)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='write results as json')
+    args = parser.parse_args()
+
+    application, client = common.start_app(args.pids, args.days)
+    data = application.snapshot.current()
+    ranked = list(data.master_pid.sort_values('confirmed')[::-1].index)
+
+    results = []
+    for n in (1, 10, 50):
+        values = [int(v) for v in ranked[:n]]
+        loop = common.timeit(lambda: [legacy_series(data.cube, v) for v in values], 1)
+        engine = common.timeit(lambda: data.cube.trailing_window(values), args.repeat)
+        inputs = [('dropdown_container', 'value', values), ('tabs-values', 'value', 'exponential'),
+                  ('log-check', 'value', 'log'), ('deaths-confirmed', 'value', 'confirmed'),
+                  ('prediction', 'value', ['prediction'])]
+        state = [('content-readout', 'relayoutData', None)]
+        tab = common.timeit(lambda: client.call('content-readout.figure', inputs, state), args.repeat)
+        results.append({'locations': n, 'loop_ms': loop, 'engine_ms': engine, 'tab_ms': tab})
+
+    print('{:>10}{:>12}{:>12}{:>12}'.format('locations', 'loop ms', 'engine ms', 'tab ms'))
+    for r in results:
+        print('{:>10}{:>12.1f}{:>12.2f}{:>12.1f}'.format(r['locations'], r['loop_ms'], r['engine_ms'], r['tab_ms']))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+'''
+Time to prepare the data with 1, 2, 4 and 8 ingest workers (COVID_INGEST_WORKERS).
+
+Writes synthetic pickles once, then every run is a fresh process that reads them and runs
+callbacks.prepare_data with that many workers, so each starts cold like datastore.py does.
+Prints the total, the time of each phase and of each sharded stage with its slowest shard.
+
+    python -m benchmarks.bench_ingest --pids 3500 --days 300 --workers 1 2 4 8
+'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(directory):
+    import pandas as pd
+    import callbacks
+    import parallel
+    master_all = pd.read_pickle(os.path.join(directory, 'MASTER_ALL.pkl'), compression='gzip')
+    master_pid = pd.read_pickle(os.path.join(directory, 'MASTER_PID.pkl'), compression='gzip')
+    start = time.perf_counter()
+    callbacks.prepare_data(master_all, master_pid, workers=parallel.WORKERS)
+    result = {'workers': parallel.WORKERS, 'prepare_s': time.perf_counter() - start}
+    result.update(parallel.REPORT)
+    print(json.dumps(result), flush=True)
+
+
+def run(directory, workers):
+    env = dict(os.environ, COVID_INGEST_WORKERS=str(workers))
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.bench_ingest', '--worker', directory],
+                         cwd=ROOT, env=env, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pids', type=int, default=3500)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--output', help='write results as json')
+    parser.add_argument('--worker', metavar='DIR', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.worker:
+        worker(args.worker)
+        return
+
+    sys.path.insert(0, ROOT)
+    from benchmarks import synthetic
+    directory = tempfile.mkdtemp(prefix='covid-bench-')
+    master_all, _ = synthetic.write_pickles(directory, n_pids=args.pids, n_days=args.days)
+    print('{} rows in {}, {} cores'.format(len(master_all), directory, os.cpu_count()))
+    del master_all
+
+    results = [run(directory, workers) for workers in args.workers]
+    serial = results[0]['prepare_s']
+    for r in results:
+        phases = ', '.join('{} {:.2f}s'.format(p['phase'], p['seconds']) for p in r['prepare'])
+        print('{:>2} workers: {:.2f}s ({:.2f}x)  {}'.format(r['workers'], r['prepare_s'], serial / r['prepare_s'], phases))
+        for stage in r['stages']:
+            print('      {:<8} {:.2f}s over {} shards, slowest {:.2f}s'.format(
+                stage['stage'], stage['seconds'], len(stage['shards']),
+                max(shard['seconds'] for shard in stage['shards'])))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+import json
+import time
+import argparse
+import spatial
+from benchmarks import common
+
+'''
+Sweeps the date slider across every date, twice: the first pass fills the map snapshot
+cache, the second is what scrubbing back and forth costs. Reports ms per slider tick
+and the cache counters, then the county view's points, bytes and server time over typical
+viewports, with and without culling to the viewport (county clustering applies to both).
+
+    python -m benchmarks.bench_map --pids 3500 --days 300
+'''
+
+VIEWS = [
+    (['country'], 'confirmed', []),
+    (['country'], 'confirmed', ['relative']),
+    (['country', 'province', 'county'], 'confirmed', []),
+    (['country', 'province', 'county'], 'deaths', ['relative']),
+]
+
+
+VIEWPORTS = [
+    ('world', 0.5, -34.2, 19.75),
+    ('continent', 3, -95, 38),
+    ('country', 4, -95, 38),
+    ('state', 6, -89, 40),
+    ('county', 8, -88, 41.8),
+]
+
+
+def map_inputs(date_value, locations, metric, relative, relayout=None):
+    return [('date_slider', 'value', date_value), ('check-locations', 'value', list(locations)),
+            ('check-metrics', 'value', metric), ('relative_rate_check', 'value', relative),
+            ('map', 'relayoutData', relayout)]
+
+
+def sweep(client, n_dates, locations, metric, relative):
+    start = time.perf_counter()
+    size = 0
+    state = [('map', 'figure', None), ('animate-check', 'value', [])]
+    for date_value in range(n_dates):
+        size += client.call('map-base.data', map_inputs(date_value, locations, metric, relative), state)[1]
+    return (time.perf_counter() - start) * 1000 / n_dates, size / n_dates
+
+
+def viewport_sweep(client, date_value, repeat=3):
+    results = []
+    state = [('map', 'figure', None), ('animate-check', 'value', [])]
+    cull = spatial.cull
+    for name, zoom, lon, lat in VIEWPORTS:
+        relayout = {'mapbox.center': {'lat': lat, 'lon': lon}, 'mapbox.zoom': zoom}
+        inputs = map_inputs(date_value, ['country', 'province', 'county'], 'confirmed', [], relayout)
+        row = {'viewport': name, 'zoom': zoom}
+        for culled in (False, True):
+            spatial.cull = cull if culled else (lambda traces, indexes, viewport: traces)
+            try:
+                client.call('map-base.data', inputs, state)
+                ms = common.timeit(lambda: client.call('map-base.data', inputs, state), repeat)
+                response, size = client.call('map-base.data', inputs, state)
+            finally:
+                spatial.cull = cull
+            suffix = 'culled' if culled else 'full'
+            row['points_' + suffix] = sum(len(trace['lat']) for trace in response['response']['map-base']['data']['data'])
+            row['bytes_' + suffix] = size
+            row['ms_' + suffix] = ms
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pids', type=int, default=3500)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--output', help='write results as json')
+    args = parser.parse_args()
+
+    application, client = common.start_app(args.pids, args.days)
+    callbacks = application.callbacks
+    n_dates = len(application.snapshot.current().date_mapper)
+
+    results = []
+    for locations, metric, relative in VIEWS:
+        cold, size = sweep(client, n_dates, locations, metric, relative)
+        warm, _ = sweep(client, n_dates, locations, metric, relative)
+        results.append({'locations': '+'.join(locations), 'metric': metric, 'relative': bool(relative),
+                        'cold_ms_per_tick': cold, 'warm_ms_per_tick': warm, 'bytes_per_tick': size})
+
+    print('{:<26}{:<11}{:<10}{:>12}{:>12}{:>14}'.format('locations', 'metric', 'relative', 'cold ms', 'warm ms', 'KB/tick'))
+    for r in results:
+        print('{:<26}{:<11}{:<10}{:>12.1f}{:>12.1f}{:>14.1f}'.format(
+            r['locations'], r['metric'], str(r['relative']), r['cold_ms_per_tick'], r['warm_ms_per_tick'],
+            r['bytes_per_tick'] / 1024))
+    viewports = viewport_sweep(client, n_dates - 1)
+    print('\n{:<11}{:>6}{:>9}{:>9}{:>11}{:>11}{:>10}{:>10}'.format(
+        'viewport', 'zoom', 'points', 'culled', 'KB', 'culled KB', 'ms', 'culled ms'))
+    for r in viewports:
+        print('{:<11}{:>6}{:>9}{:>9}{:>11.1f}{:>11.1f}{:>10.1f}{:>10.1f}'.format(
+            r['viewport'], r['zoom'], r['points_full'], r['points_culled'], r['bytes_full'] / 1024,
+            r['bytes_culled'] / 1024, r['ms_full'], r['ms_culled']))
+    stats = callbacks.MAP_CACHE.stats()
+    print('cache: {hits} hits, {misses} misses, {evictions} evictions, {size}/{maxsize} entries'.format(**stats))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'sweeps': results, 'viewports': viewports, 'cache': stats}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+from benchmarks import common
+
+'''
+Throughput of the comparison graph and table callbacks with 1 and 8 workers, each worker
+with its own in-process output cache ("memory") or all of them sharing a SQLite file.
+
+The app is started and its data loaded once, then the workers are forked from it the way
+gunicorn --preload does. Every worker sends the same number of requests drawn from a
+skewed (Zipf like) mix of selections, so a few are popular and most are rare. With
+per-process caches every worker renders the popular ones itself; with the shared cache
+only the first worker to ask does.
+
+    python -m benchmarks.bench_shared_cache --pids 3500 --days 300 --requests 200
+'''
+
+TABS = ['total_cases_graph', 'per_day_cases', 'exponential', 'gr']
+
+
+def workload(ranked, n_keys, seed=0):
+    '''n_keys distinct (callback, inputs) requests and their Zipf weights'''
+    rng = random.Random(seed)
+    requests = []
+    for _ in range(n_keys):
+        values = rng.sample(ranked[:50], rng.randint(1, 5))
+        if rng.random() < 0.2:
+            requests.append(('table-div.children', [('dropdown_container', 'value', values),
+                                                    ('tabs-table-values', 'value', 'conf-tab')], []))
+        else:
+            requests.append(('content-readout.figure',
+                             [('dropdown_container', 'value', values), ('tabs-values', 'value', rng.choice(TABS)),
+                              ('log-check', 'value', ''), ('deaths-confirmed', 'value', 'confirmed'),
+                              ('prediction', 'value', ['prediction'])],
+                             [('content-readout', 'relayoutData', None)]))
+    weights = [1 / (rank + 1) ** 1.1 for rank in range(n_keys)]
+    return requests, weights
+
+
+def worker(args):
+    requests, weights, n_requests, seed = args
+    import application
+    import callbacks
+    client = common.DashClient(application.application.test_client())
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    for output, inputs, state in rng.choices(requests, weights, k=n_requests):
+        client.call(output, inputs, state)
+    stats = callbacks.OUTPUT_CACHE.stats()
+    return time.perf_counter() - start, stats['hits'], stats['misses']
+
+
+def run(backend, n_workers, requests, weights, n_requests):
+    import callbacks
+    callbacks.OUTPUT_CACHE = backend
+    backend.clear()
+    context = multiprocessing.get_context('fork')
+    start = time.perf_counter()
+    with context.Pool(n_workers) as pool:
+        results = pool.map(worker, [(requests, weights, n_requests, seed) for seed in range(n_workers)])
+    wall = time.perf_counter() - start
+    hits = sum(r[1] for r in results)
+    misses = sum(r[2] for r in results)
+    return {'requests_per_s': n_workers * n_requests / wall,
+            'wall_s': wall,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pids', type=int, default=3500)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--keys', type=int, default=200, help='distinct selections')
+    parser.add_argument('--requests', type=int, default=200, help='requests per worker')
+    parser.add_argument('--output', help='write results as json')
+    args = parser.parse_args()
+
+    application, client = common.start_app(args.pids, args.days)
+    import sharedcache
+    ranked = [int(v) for v in application.snapshot.current().master_pid.sort_values('confirmed')[::-1].index]
+    requests, weights = workload(ranked, args.keys)
+    directory = tempfile.mkdtemp(prefix='covid-bench-cache-')
+
+    results = []
+    for n_workers in (1, 8):
+        for name in ('memory', 'sqlite'):
+            if name == 'memory':
+                backend = sharedcache.MemoryBackend()
+            else:
+                backend = sharedcache.SQLiteBackend(os.path.join(directory, 'cache.db'))
+            result = run(backend, n_workers, requests, weights, args.requests)
+            results.append(dict(result, workers=n_workers, backend=name))
+
+    print('{:>8}{:>10}{:>12}{:>10}'.format('workers', 'backend', 'requests/s', 'hit rate'))
+    for r in results:
+        print('{:>8}{:>10}{:>12.1f}{:>10.2f}'.format(r['workers'], r['backend'], r['requests_per_s'], r['hit_rate']))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
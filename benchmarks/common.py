@@ -0,0 +1,72 @@
+import os
+import sys
+import json
+import time
+import tempfile
+
+'''Helpers shared by the benchmarks: synthetic data behind the real app, and a small Dash client'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_app(n_pids=300, n_days=120):
+    '''
+    Write synthetic data as a columnar store, point the app at it and import it.
+    Must run before anything imports application, since the data source is read at import.
+    '''
+    sys.path.insert(0, ROOT)
+    os.chdir(ROOT)
+    from benchmarks import synthetic
+    import datastore
+    directory = tempfile.mkdtemp(prefix='covid-bench-')
+    master_all, master_pid = synthetic.make_frames(n_pids=n_pids, n_days=n_days)
+    datastore.ingest(master_all, master_pid, os.path.join(directory, 'store'))
+    os.environ['COVID_DATA_SOURCE'] = 'store:' + os.path.join(directory, 'store')
+    import application
+    client = DashClient(application.application.test_client())
+    # The first request builds the layout, which loads the data
+    client.get('/')
+    return application, client
+
+
+class DashClient:
+    '''Calls callbacks the way the browser does, through /_dash-update-component'''
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, path):
+        return self.client.get(path)
+
+    def call(self, output, inputs, state=(), changed=None):
+        '''
+        inputs and state are lists of (id, property, value); returns (response json, bytes).
+        `changed` is the triggering 'id.property', the first input by default.
+        '''
+        component, prop = output.rsplit('.', 1)
+        payload = {
+            'output': output,
+            'outputs': {'id': component, 'property': prop},
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+            'changedPropIds': [changed or '{}.{}'.format(inputs[0][0], inputs[0][1])],
+        }
+        response = self.client.post('/_dash-update-component', json=payload)
+        if response.status_code == 204:
+            return None, 0
+        if response.status_code != 200:
+            raise RuntimeError('{} failed with {}'.format(output, response.status_code))
+        return json.loads(response.data), len(response.data)
+
+
+def timeit(func, repeat=5, setup=None):
+    '''Median wall time of func() in milliseconds, calling setup() untimed before each run'''
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import argparse
+import tempfile
+import platform
+import subprocess
+import pandas as pd
+from benchmarks import common, synthetic
+
+'''
+Every server side step of a page view on synthetic data: loading the data (serve_data),
+parsing the url (parse_state), building the layout and the summary cards, the map, the
+four comparison tabs, the table and the location search. Callbacks are timed through /_dash-update-component
+both uncached (the output and map caches cleared before every run) and cached.
+
+Results are written as json with the scale, versions and commit, and --compare prints
+the change against an earlier run:
+
+    python -m benchmarks.suite --pids 3500 --days 300 --output before.json
+    python -m benchmarks.suite --pids 3500 --days 300 --output after.json --compare before.json
+'''
+
+TABS = ['total_cases_graph', 'per_day_cases', 'exponential', 'gr']
+
+MAP_VIEWS = [
+    ('world', ['country'], ['confirmed'], [], None),
+    ('world relative', ['country', 'province', 'county'], ['confirmed', 'deaths'], ['relative'], None),
+    ('state zoom', ['country', 'province', 'county'], ['confirmed'], [],
+     {'mapbox.center': {'lat': 40, 'lon': -89}, 'mapbox.zoom': 6}),
+]
+
+SEARCHES = ['c', 'county 1', 'united']
+
+CARDS = ['get_total_cases', 'get_total_deaths', 'get_mortality_rate', 'get_growth_rate', 'get_relative_card']
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=common.ROOT,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_serve_data(callbacks, args):
+    '''serve_data from gzip pickles and from the columnar store'''
+    results = []
+    directory = tempfile.mkdtemp(prefix='covid-bench-suite-')
+    os.makedirs(os.path.join(directory, 'Data'))
+    synthetic.write_pickles(os.path.join(directory, 'Data'), n_pids=args.pids, n_days=args.days)
+    cwd = os.getcwd()
+    os.chdir(directory)
+    try:
+        ms = common.timeit(lambda: callbacks.serve_data(serve_local=True), args.load_repeat)
+    finally:
+        os.chdir(cwd)
+    results.append({'name': 'serve_data[pickle]', 'ms': ms})
+    store = os.environ['COVID_DATA_SOURCE'][len('store:'):]
+    results.append({'name': 'serve_data[store]',
+                    'ms': common.timeit(lambda: callbacks.serve_data(store=store), args.load_repeat)})
+    return results
+
+
+def bench_layout(application, client, values, args):
+    callbacks = application.callbacks
+    data = application.snapshot.current()
+    url = 'http://localhost:8050/' + application.encode_state(application.component_ids_zipped, [
+        len(data.date_mapper) - 1, ['country', 'province'], ['confirmed'], values, 'total_cases_graph',
+        'log', 'confirmed', ['prediction'], [], 'conf-tab'])
+    results = [
+        {'name': 'parse_state', 'ms': common.timeit(lambda: application.parse_state(url), args.repeat)},
+        {'name': 'build_layout[default]', 'ms': common.timeit(lambda: application.build_layout({}, data), args.repeat)},
+        {'name': 'build_layout[url]',
+         'ms': common.timeit(lambda: application.build_layout(application.parse_state(url), data), args.repeat)},
+        {'name': 'page_load', 'ms': common.timeit(
+            lambda: client.call('page-layout.children', [('url', 'href', url)]), args.repeat)}]
+    for card in CARDS:
+        results.append({'name': 'cards[{}]'.format(card),
+                        'ms': common.timeit(lambda: getattr(callbacks, card)(data), args.repeat)})
+    return results
+
+
+def bench_callbacks(callbacks, client, values, args):
+    def clear():
+        callbacks.MAP_CACHE.clear()
+        callbacks.OUTPUT_CACHE.clear()
+
+    calls = []
+    last_date = len(callbacks.snapshot.current().date_mapper) - 1
+    for name, locations, metrics, relative, relayout in MAP_VIEWS:
+        inputs = [('date_slider', 'value', last_date), ('check-locations', 'value', locations),
+                  ('check-metrics', 'value', metrics), ('relative_rate_check', 'value', relative),
+                  ('map', 'relayoutData', relayout)]
+        state = [('map', 'figure', None), ('animate-check', 'value', [])]
+        calls.append(('render_map[{}]'.format(name), 'map-base.data', inputs, state))
+    for tab in TABS:
+        inputs = [('dropdown_container', 'value', values), ('tabs-values', 'value', tab),
+                  ('log-check', 'value', 'log'), ('deaths-confirmed', 'value', 'confirmed'),
+                  ('prediction', 'value', ['prediction'])]
+        calls.append(('render_tab_content[{}]'.format(tab), 'content-readout.figure', inputs,
+                      [('content-readout', 'relayoutData', None)]))
+    for tab in ('conf-tab', 'deaths_tab'):
+        inputs = [('dropdown_container', 'value', values), ('tabs-table-values', 'value', tab)]
+        calls.append(('render_table[{}]'.format(tab), 'table-div.children', inputs, []))
+    for query in SEARCHES:
+        inputs = [('dropdown_container', 'search_value', query), ('dropdown_container', 'value', values)]
+        calls.append(('search_locations[{}]'.format(query), 'dropdown_container.options', inputs, []))
+
+    results = []
+    for name, output, inputs, state in calls:
+        uncached = common.timeit(lambda: client.call(output, inputs, state), args.repeat, setup=clear)
+        client.call(output, inputs, state)
+        cached = common.timeit(lambda: client.call(output, inputs, state), args.repeat)
+        size = client.call(output, inputs, state)[1]
+        results.append({'name': name, 'ms': uncached, 'cached_ms': cached, 'bytes': size})
+    return results
+
+
+def compare(results, meta, baseline_path):
+    with open(baseline_path) as fh:
+        run = json.load(fh)
+    baseline = {r['name']: r for r in run['results']}
+    if any(run['meta'].get(k) != meta[k] for k in ('pids', 'days', 'locations')):
+        print('\nnote: {} ran on {pids} PIDs x {days} days with {locations} locations'.format(
+            baseline_path, **run['meta']))
+    print('\n{:<40}{:>12}{:>12}{:>10}'.format('vs ' + os.path.basename(baseline_path), 'before ms', 'after ms', 'ratio'))
+    for r in results:
+        old = baseline.get(r['name'])
+        if old is None:
+            print('{:<40}{:>12}{:>12.2f}{:>10}'.format(r['name'], '-', r['ms'], '-'))
+            continue
+        print('{:<40}{:>12.2f}{:>12.2f}{:>10.2f}'.format(r['name'], old['ms'], r['ms'],
+                                                        r['ms'] / old['ms'] if old['ms'] else float('nan')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--pids', type=int, default=3500)
+    parser.add_argument('--days', type=int, default=300)
+    parser.add_argument('--locations', type=int, default=10, help='selected in the dropdown')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--load-repeat', type=int, default=1, help='runs of serve_data')
+    parser.add_argument('--output', help='write results as json')
+    parser.add_argument('--compare', help='json of an earlier run to compare with')
+    args = parser.parse_args()
+
+    application, client = common.start_app(args.pids, args.days)
+    callbacks = application.callbacks
+    values = [int(v) for v in application.snapshot.current().master_pid.sort_values('confirmed')[::-1].index[:args.locations]]
+
+    results = bench_serve_data(callbacks, args)
+    results += bench_layout(application, client, values, args)
+    results += bench_callbacks(callbacks, client, values, args)
+
+    print('{:<40}{:>12}{:>12}{:>12}'.format('step', 'ms', 'cached ms', 'KB'))
+    for r in results:
+        cached = '{:.2f}'.format(r['cached_ms']) if 'cached_ms' in r else '-'
+        size = '{:.1f}'.format(r['bytes'] / 1024) if 'bytes' in r else '-'
+        print('{:<40}{:>12.2f}{:>12}{:>12}'.format(r['name'], r['ms'], cached, size))
+    meta = {'pids': args.pids, 'days': args.days, 'rows': len(application.snapshot.current().master_all),
+            'locations': len(values), 'repeat': args.repeat, 'commit': _git_commit(),
+            'python': platform.python_version(), 'pandas': pd.__version__,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    if args.compare:
+        compare(results, meta, args.compare)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'meta': meta, 'results': results}, fh, indent=2)
+
+
+if __name__ == '__main__':
+    main()
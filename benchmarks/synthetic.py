@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+
+'''
+Synthetic MASTER_ALL / MASTER_PID frames with the same schema as the S3 pickles,
+so the app can be measured without the bucket. Scale with n_pids x n_days.
+'''
+
+
+def make_frames(n_pids=300, n_days=120, n_forecast=14, seed=0):
+    '''
+    Returns (MASTER_ALL, MASTER_PID). PID 0 is Worldwide and PID 1 the US, the rest
+    are split roughly 1/20 countries, 1/20 states and the remainder counties like the real data.
+    Rows are sorted by Date then PID.
+    '''
+    rng = np.random.RandomState(seed)
+    n_pids = max(n_pids, 4)
+    n_dates = n_days + n_forecast
+    dates = pd.date_range('2020-01-22', periods=n_dates)
+
+    n_countries = max(1, (n_pids - 2) // 20)
+    n_states = max(1, (n_pids - 2) // 20)
+    n_counties = n_pids - 2 - n_countries - n_states
+    granularity = np.array(['country', 'country'] + ['country'] * n_countries +
+                           ['state'] * n_states + ['county'] * n_counties, dtype=object)
+    country = np.array(['worldwide', 'US'] + ['Country {}'.format(i) for i in range(n_countries)] +
+                       ['US'] * (n_states + n_counties), dtype=object)
+    location = np.array(['Worldwide', 'US'] + ['Country {}'.format(i) for i in range(n_countries)] +
+                        ['State {}, US'.format(i) for i in range(n_states)] +
+                        ['County {}, State {}, US'.format(i, i % n_states) for i in range(n_counties)],
+                        dtype=object)
+
+    # Cumulative curves: each PID starts on some day and grows logistically
+    population = rng.randint(10 ** 4, 10 ** 7, n_pids).astype(float)
+    population[0] = 7.8e9
+    population[1] = 3.3e8
+    start = rng.randint(0, max(1, n_days // 2), n_pids)
+    start[:2] = 0
+    rate = rng.uniform(0.03, 0.12, n_pids)
+    ceiling = population * rng.uniform(0.01, 0.1, n_pids)
+    t = np.arange(n_dates)[None, :] - start[:, None]
+    confirmed = np.floor(ceiling[:, None] / (1 + np.exp(-rate[:, None] * (t - 60))))
+    confirmed[t < 0] = 0
+    confirmed[1] = confirmed[2 + n_countries:].sum(axis=0) + confirmed[1] * 0.01
+    confirmed[0] = confirmed[1:2 + n_countries].sum(axis=0)
+    deaths = np.floor(confirmed * rng.uniform(0.005, 0.03, n_pids)[:, None])
+    spread = 1 + 0.02 * np.maximum(np.arange(n_dates) - n_days + 1, 0)[None, :]
+
+    lat = rng.uniform(-50, 65, n_pids)
+    lon = rng.uniform(-170, 170, n_pids)
+    lat[0], lon[0] = 0.0, 0.0
+
+    # Date-major layout like the real pickle
+    pid = np.tile(np.arange(n_pids), n_dates)
+    date_col = np.repeat(dates.values, n_pids)
+    forcast = np.repeat(np.arange(n_dates) >= n_days, n_pids)
+
+    def flat(a):
+        return a.T.reshape(-1)
+
+    conf = flat(confirmed)
+    dead = flat(deaths)
+    up = flat(confirmed * spread)
+    down = flat(confirmed / spread)
+    dup = flat(deaths * spread)
+    ddown = flat(deaths / spread)
+    pop = population[pid]
+    names = location[pid]
+
+    def text(label, values):
+        formatted = np.array(['{:,}'.format(int(v)) for v in values], dtype=object)
+        return names + '<br>' + label + ': ' + formatted
+
+    master_all = pd.DataFrame({
+        'PID': pid,
+        'Date': date_col,
+        'forcast': forcast,
+        'country': country[pid],
+        'granularity': granularity[pid],
+        'location': names,
+        'confirmed': conf,
+        'deaths': dead,
+        'confirmed_upper': up,
+        'confirmed_lower': down,
+        'deaths_upper': dup,
+        'deaths_lower': ddown,
+        'per_capita_confirmed': conf / pop,
+        'per_capita_deaths': dead / pop,
+        'lat': lat[pid],
+        'lon': lon[pid],
+        'CSize': conf,
+        'DSize': dead,
+        'Text_Confirmed': text('Total Cases', conf),
+        'Text_Deaths': text('Total Deaths', dead),
+    })
+
+    last = n_days - 1
+    master_pid = pd.DataFrame({
+        'PID': np.arange(n_pids),
+        'location': location,
+        'country': country,
+        'granularity': granularity,
+        'confirmed': confirmed[:, last],
+        'deaths': deaths[:, last],
+        'lat': lat,
+        'lon': lon,
+        'Text_Confirmed': location + '<br>Total Cases: ' + np.array(
+            ['{:,}'.format(int(v)) for v in confirmed[:, last]], dtype=object),
+    }).set_index('PID')
+    return master_all, master_pid
+
+
+def write_pickles(directory, **kwargs):
+    '''Write MASTER_ALL.pkl and MASTER_PID.pkl (gzip) the way the bucket serves them'''
+    master_all, master_pid = make_frames(**kwargs)
+    master_all.to_pickle('{}/MASTER_ALL.pkl'.format(directory), compression='gzip')
+    master_pid.to_pickle('{}/MASTER_PID.pkl'.format(directory), compression='gzip')
+    return master_all, master_pid
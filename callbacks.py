@@ -1,16 +1,33 @@
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
-import plotly.express as px
 import plotly.colors
+import plotly.utils
 import pandas as pd
 import plots
+import fetch
+import datastore
+import cube
+import summary
+import aggregate
+import spatial
+import lru
+import sharedcache
+import schema
+import labels
+import search
+import snapshot
+import parallel
+import startup
+import os
+import json
 import dash_table
 from datetime import date, timedelta
 import ast
 import datetime
 import numpy as np
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from pprint import pprint
 from urllib.parse import urlparse, parse_qs, urlencode
 
@@ -25,72 +42,149 @@ CASES_BIN = [1, 200, 1000, 50000, 10000000]
 up_triangle = "▲"
 down_tirangle = "▼"
 
-'''All the functions in the callback need access to the GLOBAL DATA served in callbacks.serveData'''
+'''
+All the functions in the callback need access to the data served in callbacks.serve_data.
+It is published as one snapshot.DataSnapshot per version: a callback takes the one of the
+page's data version (the data-version store, see application) once with snapshot.get()
+and hands it to the helpers below.
+'''
+
+S3_URLS = {
+    'all': 'https://jordanspubliccovidbucket.s3-us-east-2.amazonaws.com/covid19data/MASTER_ALL_NEW.pkl',
+    'pid': 'https://jordanspubliccovidbucket.s3-us-east-2.amazonaws.com/covid19data/MASTER_PID_NEW.pkl'}
+LOCAL_PATHS = {
+    'all': 'Data/MASTER_ALL.pkl',
+    'pid': 'Data/MASTER_PID.pkl'}
+
+# Map traces per (data version, date, granularities, metrics, relative) so scrubbing
+# the date slider back and forth only assembles figures
+MAP_CACHE = lru.LRUCache(maxsize=int(os.environ.get('COVID_MAP_CACHE_SIZE', 512)))
+
+# Map animation payloads per (data version, view) as json strings, every date of a view in
+# one (see animation), up to COVID_MAP_FRAMES_CACHE_BYTES
+FRAMES_CACHE = lru.LRUCache(maxsize=int(os.environ.get('COVID_MAP_FRAMES_CACHE_SIZE', 16)),
+                            maxbytes=int(os.environ.get('COVID_MAP_FRAMES_CACHE_BYTES', 128 * 2 ** 20)),
+                            sizeof=len)
+
+# The page layout of each retained data version as plain json (see application.layout_template)
+LAYOUT_CACHE = lru.LRUCache(maxsize=snapshot.RETAIN)
+
+# Rendered comparison graphs, tables and default view maps as serialized json, in this
+# process or shared by the workers on the machine (see sharedcache)
+OUTPUT_CACHE = sharedcache.get_backend()
+AXIS_RANGE_KEYS = ['xaxis.range[0]', 'xaxis.range[1]', 'yaxis.range[0]', 'yaxis.range[1]']
+
+
+def prepare_data(master_all, master_pid, metric_cube=None, workers=1):
+    '''
+    Compact both frames (see schema), derive the date mapper, the PID name lookup and the
+    PID x Date cube the graphs read from with its derived series (see derived) unless the
+    store came with one, and index MASTER_ALL the way the callbacks expect. The per PID
+    stages run in `workers` processes, only ever more than one outside the server (see
+    parallel)
+    '''
+    phases = startup.Phases()
+    parallel.start_report(workers)
+    master_all, master_pid, memory_report = schema.compact_frames(master_all, master_pid, workers)
+    phases.mark('compact')
+    if metric_cube is None:
+        metric_cube = cube.MetricCube(master_all)
+        phases.mark('cube')
+        metric_cube = parallel.derive(metric_cube, workers)
+        phases.mark('derived')
+    date_mapper = pd.DataFrame(master_all['Date'].unique(), columns=['Date'])
+    key_value = dict(zip(list(master_pid.index), list(
+        master_pid['location'].str.replace('US', 'United States'))))
+    key_value = pd.DataFrame(list(key_value.values()), index=key_value.keys(), columns=['name'])
+    # In place so a memory mapped frame from datastore.load is not copied
+    master_all.set_index(['Date', 'forcast'], inplace=True)
+    phases.mark('index')
+    parallel.REPORT['prepare'] = phases.as_list()
+    if parallel.enabled(workers):
+        print('Prepared data with {} workers: {}'.format(workers, phases))
+    return master_all, master_pid, date_mapper, key_value, metric_cube, memory_report
+
+
+def set_data(master_all, master_pid, date_mapper, key_value, metric_cube, memory_report=None, version=None):
+    '''Build the snapshot of this version, publish it and drop the cached output of evicted ones'''
+    data = snapshot.DataSnapshot(
+        version=version,
+        master_all=master_all,
+        master_pid=master_pid,
+        date_mapper=date_mapper,
+        key_value=key_value,
+        cube=metric_cube,
+        county_grid=aggregate.CountyGrid(master_all),
+        summary=summary.Summary(metric_cube),
+        table=summary.Table(metric_cube),
+        search=search.LocationIndex(get_dropdown_options(master_pid)),
+        memory_report=memory_report)
+    retained = set(snapshot.publish(data))
+    # Without a version the entries of an earlier load can't be told apart
+    if version is None:
+        MAP_CACHE.clear()
+        FRAMES_CACHE.clear()
+        LAYOUT_CACHE.clear()
+        OUTPUT_CACHE.clear()
+    else:
+        MAP_CACHE.retain(lambda key, _: key[0] in retained)
+        FRAMES_CACHE.retain(lambda key, _: key[0] in retained)
+        LAYOUT_CACHE.retain(lambda key, _: key in retained)
+        OUTPUT_CACHE.retain(retained)
+    return data
 
 
-def serve_data(ret=False, serve_local=False):
-    global MASTER_ALL
-    global MASTER_PID
-    global DATE_MAPPER
-    global KEY_VALUE
+def serve_data(ret=False, serve_local=False, store=None):
+    metric_cube = None
+    if store:
+        master_all, master_pid, metric_cube = datastore.load(store)
 
-    if serve_local:
-        MASTER_ALL = pd.read_pickle('Data/MASTER_ALL.pkl', compression='gzip')
-        MASTER_PID = pd.read_pickle('Data/MASTER_PID.pkl', compression='gzip')
+    elif serve_local:
+        master_all = pd.read_pickle(LOCAL_PATHS['all'], compression='gzip')
+        master_pid = pd.read_pickle(LOCAL_PATHS['pid'], compression='gzip')
 
     else:
         print('Grabbing from S3')
-        MASTER_ALL = pd.read_pickle(
-
-            'https://jordanspubliccovidbucket.s3-us-east-2.amazonaws.com/covid19data/MASTER_ALL_NEW.pkl', compression='gzip')
-        MASTER_PID = pd.read_pickle(
-            'https://jordanspubliccovidbucket.s3-us-east-2.amazonaws.com/covid19data/MASTER_PID_NEW.pkl', compression='gzip')
-        DATE_MAPPER = pd.DataFrame(MASTER_ALL['Date'].unique(), columns=['Date'])
-        KEY_VALUE = dict(zip(list(MASTER_PID.index), list(
-            MASTER_PID['location'].str.replace('US', 'United States'))))
-        KEY_VALUE = pd.DataFrame(list(KEY_VALUE.values()), index=KEY_VALUE.keys(), columns=['name'])
-        # MASTER_ALL = MASTER_ALL.set_index(['Date', 'forcast'])
-        # eventually
-
-        MASTER_ALL = MASTER_ALL.set_index(['Date', 'forcast'])
+        results = fetch.CachedFetcher().fetch_all(S3_URLS)
+        master_all = pd.read_pickle(results['all'].path, compression='gzip')
+        master_pid = pd.read_pickle(results['pid'].path, compression='gzip')
+
+    data = set_data(*prepare_data(master_all, master_pid, metric_cube))
     if ret:
-        return MASTER_ALL, MASTER_PID, DATE_MAPPER, KEY_VALUE
+        return data.master_all, data.master_pid, data.date_mapper, data.key_value, data.cube
     else:
         return
 
 
-def get_default_dropdown():
-    return KEY_VALUE[KEY_VALUE['name'].str.strip().isin(['Worldwide', 'United States'])].index
+def get_default_dropdown(data):
+    key_value = data.key_value
+    return key_value[key_value['name'].str.strip().isin(['Worldwide', 'United States'])].index
 
 
-def get_min_date():
-    return DATE_MAPPER.index[0]
+def get_min_date(data):
+    return data.date_mapper.index[0]
 
 
-def get_max_date():
-    return DATE_MAPPER.index[-1]
+def get_max_date(data):
+    return data.date_mapper.index[-1]
 
 
-def get_date_marks():
-    how_many_labels = (len(DATE_MAPPER))//10
+def get_date_marks(data):
+    date_mapper = data.date_mapper
+    how_many_labels = (len(date_mapper))//10
     marks = {k: {'label': v}
-             for k, v in list(DATE_MAPPER['Date'].dt.strftime(
+             for k, v in list(date_mapper['Date'].dt.strftime(
                  '%m/%d').to_dict().items())[::how_many_labels]}
-    if len(DATE_MAPPER)-1 not in marks.keys():
-        marks[len(DATE_MAPPER)-1] = {'label': ''}
+    if len(date_mapper)-1 not in marks.keys():
+        marks[len(date_mapper)-1] = {'label': ''}
     return marks
 
 
-def get_total_cases():
-    sub_df = MASTER_ALL.reset_index().set_index(['forcast'])
-    sub_df = sub_df[sub_df['country'] == 'worldwide']
-    sub_diff = sub_df[['confirmed', 'deaths']].diff()
-    total_confirmed = sub_diff.loc[False].sum()
-    twenty_four_confirmed = sub_diff.loc[False].iloc[-1]
-    forcast_seven_days = sub_diff.loc[True].iloc[0]  # .sum()
-    total_cases = "{:,}".format(int(total_confirmed['confirmed']))
-    change_in_cases = "{:,} ".format(int(twenty_four_confirmed['confirmed']))
-    forcast_seven = "{:,}".format(int(forcast_seven_days['confirmed']))
+def get_total_cases(data):
+    card = data.summary.worldwide
+    total_cases = "{:,}".format(int(card.total_confirmed))
+    change_in_cases = "{:,} ".format(int(card.change_confirmed))
+    forcast_seven = "{:,}".format(int(card.forecast_confirmed))
     return [html.H3('Total Cases'),
             html.P(id='total-cases', children=total_cases),
             html.Div(className='change-card', children=[
@@ -105,16 +199,11 @@ def get_total_cases():
                 ])])]
 
 
-def get_total_deaths():
-    sub_df = MASTER_ALL.reset_index().set_index(['forcast'])
-    sub_df = sub_df[sub_df['country'] == 'worldwide']
-    sub_diff = sub_df[['confirmed', 'deaths']].diff()
-    total_confirmed = sub_diff.loc[False].sum()
-    twenty_four_confirmed = sub_diff.loc[False].iloc[-1]
-    forcast_seven_days = sub_diff.loc[True].iloc[0]  # .sum()
-    total_cases = "{:,}".format(int(total_confirmed['deaths']))
-    change_in_cases = "{:,} ".format(int(twenty_four_confirmed['deaths']))
-    forcast_seven = "{:,}".format(int(forcast_seven_days['deaths']))
+def get_total_deaths(data):
+    card = data.summary.worldwide
+    total_cases = "{:,}".format(int(card.total_deaths))
+    change_in_cases = "{:,} ".format(int(card.change_deaths))
+    forcast_seven = "{:,}".format(int(card.forecast_deaths))
     return [html.H3('Total Deaths'),
             html.P(id='total-deaths', children=total_cases),
             html.Div(className='change-card', children=[
@@ -131,14 +220,11 @@ def get_total_deaths():
                 ])])]
 
 
-def get_mortality_rate():
-    sub_df = MASTER_ALL.reset_index().set_index(['forcast'])
-    sub_df = sub_df[sub_df['country'] == 'worldwide']
-    sub_df = sub_df[['confirmed', 'deaths']]
-    sub_df['mr'] = sub_df['deaths']/sub_df['confirmed'] * 100
-    mortality_rate_today = sub_df.loc[False].iloc[-1]['mr']
-    change_in_mortality_rate = round(mortality_rate_today - sub_df.loc[False].iloc[-2]['mr'], 2)
-    seven_day = round(mortality_rate_today-sub_df.loc[True].iloc[0]['mr'], 2)
+def get_mortality_rate(data):
+    card = data.summary.worldwide
+    mortality_rate_today = card.mortality_rate
+    change_in_mortality_rate = round(card.mortality_change, 2)
+    seven_day = round(card.mortality_forecast_change, 2)
     if change_in_mortality_rate > 0:
         symbol = up_triangle
         indicator = 'increase'
@@ -171,14 +257,11 @@ def get_mortality_rate():
                 ])])]
 
 
-def get_growth_rate():
-    sub_df = MASTER_ALL.reset_index().set_index(['forcast'])
-    sub_df = sub_df[sub_df['country'] == 'worldwide']
-    sub_df = sub_df[['confirmed', 'deaths']].pct_change() * 100
-    sub_df_diff = sub_df.diff()
-    todays_gf = sub_df.loc[False].iloc[-1]['confirmed']
-    change_in_gf = sub_df_diff.loc[False].iloc[-1]['confirmed']
-    change_to_tomorrow = sub_df_diff.loc[True].iloc[0]['confirmed']
+def get_growth_rate(data):
+    card = data.summary.worldwide
+    todays_gf = card.growth_rate
+    change_in_gf = card.growth_change
+    change_to_tomorrow = card.growth_forecast_change
     # print(change_to_tomorrow)
     if change_in_gf > 0:
         symbol = up_triangle
@@ -209,13 +292,11 @@ def get_growth_rate():
                 ])])]
 
 
-def get_relative_card():
-    sub_df = MASTER_ALL.reset_index().set_index(['forcast'])
-    sub_df = sub_df[sub_df['country'] == 'worldwide']
-    sub_diff = sub_df[['per_capita_confirmed', 'per_capita_deaths']].diff()
-    latest_capita = sub_df.loc[False].iloc[-1]['per_capita_confirmed']
-    yesterday = sub_df.loc[False].iloc[-2]['per_capita_confirmed']
-    seven_days = sub_df.loc[True].iloc[0]['per_capita_confirmed']
+def get_relative_card(data):
+    card = data.summary.worldwide
+    latest_capita = card.per_capita
+    yesterday = card.per_capita_yesterday
+    seven_days = card.per_capita_forecast
     latest_capita = "1 in {} ".format(int(1/latest_capita))
     yesterday = "1 in {} ".format(int(1/yesterday))
     seven_days = "1 in {} ".format(int(1/seven_days))
@@ -239,9 +320,9 @@ def get_relative_card():
                 ])])]
 
 
-def get_dropdown_options():
-    sorted_index = list(MASTER_PID.sort_values('confirmed')[:: -1].index)
-    sorted_txt = list(MASTER_PID.sort_values('confirmed')[:: -1]['Text_Confirmed'].str.split('<br>').str.get(0))
+def get_dropdown_options(master_pid):
+    sorted_index = list(master_pid.sort_values('confirmed')[:: -1].index)
+    sorted_txt = list(master_pid.sort_values('confirmed')[:: -1]['Text_Confirmed'].str.split('<br>').str.get(0))
     key_values = dict(zip(sorted_index, sorted_txt))
     options = [{'label': key_values[x].replace('US', 'United States'), 'value': x} for x in key_values]
     # print(options)
@@ -265,6 +346,8 @@ def get_dummy_graph(id_):
 
 
 def get_dummy_map():
+    # Imported here, it is the one user of plotly express and takes a quarter of startup
+    import plotly.express as px
     us_cities = pd.read_csv(
         "https://raw.githubusercontent.com/plotly/datasets/master/us-cities-top-1k.csv")
     fig = px.scatter_mapbox(us_cities, lat="lat", lon="lon", hover_name="City", hover_data=["State", "Population"],
@@ -274,6 +357,55 @@ def get_dummy_map():
     return fig
 
 
+def get_map_traces(data, date_value, locations_values, metrics_values, relative_check, level=None, viewport=None,
+                   store=True):
+    '''
+    Map traces for one slider position, from MAP_CACHE when this view was drawn before and
+    put there unless `store` is false.
+    With a `level` (see aggregate.level_for_zoom) counties are clustered on that grid, and
+    with a spatial.Viewport only the points inside it are returned.
+    '''
+    official_date = data.date_mapper.iloc[date_value]['Date']
+    locations_values = list(locations_values)
+    if 'province' in locations_values:
+        locations_values.append('state')
+    if 'county' not in locations_values:
+        level = None
+    key = (data.version, date_value, tuple(sorted(set(locations_values))),
+           tuple(m for m in ('confirmed', 'deaths') if metrics_values and m in metrics_values),
+           bool(relative_check), level)
+    entry = MAP_CACHE.get(key)
+    if entry is None:
+        plotting_df = data.master_all[data.master_all.index.get_level_values('Date') == official_date]
+        plotting_df = plotting_df[plotting_df['country'] != 'worldwide']
+        plotting_df = schema.widen(plotting_df[plotting_df['granularity'].isin(locations_values)])
+        plotting_df = labels.attach(plotting_df)
+        plotting_df = aggregate.cluster_counties(plotting_df, data.county_grid, level)
+        traces = plots.map_traces(plotting_df, metrics_values, relative_check)
+        indexes = [spatial.GridIndex(t['lat'], t['lon']) if 'marker' in t else None for t in traces]
+        entry = (traces, indexes)
+        if store:
+            MAP_CACHE.put(key, entry)
+    traces, indexes = entry
+    return spatial.cull(traces, indexes, viewport)
+
+
+def cached_output(data, name, key, build):
+    '''
+    The output of build() for callback `name` and its inputs `key`, from OUTPUT_CACHE when
+    any worker rendered it for this data version before
+    '''
+    cache_key = sharedcache.make_key(data.version, name, key)
+    cached = OUTPUT_CACHE.get(cache_key)
+    if cached is not None:
+        return json.loads(cached)
+    output = build()
+    if output is not None:
+        OUTPUT_CACHE.set(cache_key, json.dumps(output, cls=plotly.utils.PlotlyJSONEncoder).encode('utf-8'),
+                         version=data.version)
+    return output
+
+
 '''Now for the magic of the callback functions which we serve app too'''
 
 
@@ -298,24 +430,29 @@ def register_callbacks(app):
         else:
             return {"display": "none"}
 
+    # The server figure goes to map-base and a clientside callback (assets/map_animation.js)
+    # hands it to the graph, or swaps in the markers for the slider date when animating
     @app.callback(
-        Output("map", "figure"),
+        Output("map-base", "data"),
         [Input("date_slider", "value"),
          Input("check-locations", "value"),
          Input("check-metrics", "value"),
-         Input('relative_rate_check', 'value')],
+         Input('relative_rate_check', 'value'),
+         Input("map", "relayoutData")],
         [State("map", 'figure'),
-         State("map", "relayoutData")]
+         State('animate-check', 'value'),
+         State('data-version', 'data')]
     )
-    def render_map(date_value, locations_values, metrics_values, relative_check, figure, relative_layout):
+    def render_map(date_value, locations_values, metrics_values, relative_check, relative_layout, figure, animate,
+                   version=None):
+        data = snapshot.get(version)
 
         # print(relative_check)
 
-        # Date INT comes from the slider and can only return integers:
-        official_date = DATE_MAPPER.iloc[date_value]['Date']
-        # print(official_date)
-        plotting_df = MASTER_ALL.reset_index()[MASTER_ALL.reset_index()['Date'] == official_date]
-        plotting_df = plotting_df[plotting_df['country'] != 'worldwide']
+        # When animating, the browser already has every date
+        triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+        if animate and triggered == ['date_slider.value']:
+            raise PreventUpdate
 
         if relative_layout:
             if 'mapbox.center' in relative_layout.keys():
@@ -329,10 +466,34 @@ def register_callbacks(app):
             zoom = 0.5,
             center = dict(lat=19.75, lon=-34.2)
 
-        if 'province' in locations_values:
-            locations_values.append('state')
-        plotting_df = plotting_df[plotting_df['granularity'].isin(locations_values)]
-        return plots.plot_map(plotting_df, metrics_values, zoom, center, relative_check)
+        # Only the points around the visible box are sent. Panning and zooming redraw when
+        # the view leaves what was sent or the county clusters change
+        level = aggregate.level_for_zoom(zoom)
+        viewport = spatial.Viewport.from_relayout(relative_layout)
+        if viewport is not None:
+            viewport = viewport.padded()
+        if triggered == ['map.relayoutData']:
+            # e.g. {'autosize': True} on the first draw, which must not reset the view
+            if animate or not figure or not relative_layout or 'mapbox.center' not in relative_layout:
+                raise PreventUpdate
+            layout = figure.get('layout', {})
+            same_level = 'county' not in (locations_values or []) or \
+                level == aggregate.level_for_zoom(layout.get('mapbox', {}).get('zoom'))
+            drawn = spatial.Viewport.from_list((layout.get('meta') or {}).get('viewport'))
+            visible = spatial.Viewport.from_relayout(relative_layout)
+            if same_level and (visible is None or drawn is None or drawn.covers(visible)):
+                raise PreventUpdate
+
+        def build():
+            return plots.map_figure(get_map_traces(data, date_value, locations_values, metrics_values, relative_check,
+                                                   level, viewport),
+                                    zoom, center, viewport)
+
+        # Panned and zoomed views are rarely drawn twice, only the default view is cached
+        if viewport is not None:
+            return build()
+        return cached_output(data, 'map', (date_value, tuple(sorted(set(locations_values or []))),
+                                     tuple(metrics_values or []), bool(relative_check), zoom, center), build)
 
     @app.callback(Output('content-readout', 'figure'),
                   [Input('dropdown_container', 'value'),
@@ -340,8 +501,10 @@ def register_callbacks(app):
                    Input('log-check', 'value'),
                    Input('deaths-confirmed', 'value'),
                    Input('prediction', 'value')],
-                  [State('content-readout', 'relayoutData')])
-    def render_tab_content(values, tabs, log, metric, predict, graph_state):
+                  [State('content-readout', 'relayoutData'),
+                   State('data-version', 'data')])
+    def render_tab_content(values, tabs, log, metric, predict, graph_state, version=None):
+        data = snapshot.get(version)
         gs = None
         if log == 'log':
             log = True
@@ -352,50 +515,50 @@ def register_callbacks(app):
                 gs = graph_state
         else:
             gs = None
-        if tabs == 'total_cases_graph':
-            return plots.total_confirmed_graph(values, MASTER_ALL, KEY_VALUE, log, metric, predict, gs)
-        elif tabs == 'per_day_cases':
-            return plots.per_day_confirmed(values, MASTER_ALL, KEY_VALUE, log, metric, predict, gs)
-        elif tabs == 'exponential':
-            return plots.plot_exponential(values, MASTER_ALL, KEY_VALUE, log, predict, gs)
-        elif tabs == 'gr':
-            return plots.per_gr(values, MASTER_ALL, KEY_VALUE, log, metric, predict, gs)
+
+        def build():
+            if tabs == 'total_cases_graph':
+                return plots.total_confirmed_graph(values, data.cube, data.key_value, log, metric, predict, gs)
+            elif tabs == 'per_day_cases':
+                return plots.per_day_confirmed(values, data.cube, data.key_value, log, metric, predict, gs)
+            elif tabs == 'exponential':
+                return plots.plot_exponential(values, data.cube, data.key_value, log, predict, gs)
+            elif tabs == 'gr':
+                return plots.per_gr(values, data.cube, data.key_value, log, metric, predict, gs)
+            return None
+
+        # Selection order stays in the key since it picks the trace colors
+        return cached_output(data, 'tab', (tuple(values or []), tabs, log, metric, bool(predict),
+                                     tuple(gs.get(k) for k in AXIS_RANGE_KEYS) if gs else None), build)
 
     @app.callback(Output('table-div', 'children'),
                   [Input('dropdown_container', 'value'),
-                   Input('tabs-table-values', 'value')])
-    def render_table(values, tab):
+                   Input('tabs-table-values', 'value')],
+                  [State('data-version', 'data')])
+    def render_table(values, tab, version=None):
+        data = snapshot.get(version)
+        return cached_output(data, 'table', (tuple(values or []), tab), lambda: build_table(data, values, tab))
+
+    def build_table(data, values, tab):
         data_entries = []
         # print(tab, tab.strip() == 'deaths_tab')
-        last_date = MASTER_ALL.reset_index().groupby('forcast').tail(1)['Date'].iloc[0]
-        forcast_date = MASTER_ALL.reset_index().groupby('forcast').tail(1)['Date'].iloc[-1]
-        for value in values:
-            # print(value)
-            sort_me = ['Date', 'Location']
-            sub_df = MASTER_ALL.reset_index()
-            sub_df = sub_df[sub_df['PID'] == value]
-            sub_df = sub_df.set_index('Date')
+        last_date = data.table.last_date
+        sort_me = ['Date', 'Location']
+        if tab != 'deaths_tab':
+            metric = 'confirmed'
+        else:
+            metric = 'deaths'
+        for row in data.table.rows(values, metric):
             entry = {'Date': last_date.strftime('%D'),
-                     'Location': sub_df['Text_Confirmed'].str.split('<br>').str.get(0).iloc[0]}
-            if tab != 'deaths_tab':
-                metric = 'confirmed'
-            else:
-                metric = 'deaths'
-
-            confirmed = sub_df.loc[last_date, metric]
-            confirmed_24 = sub_df[metric].diff().loc[last_date]
-            confirmed_tomorrow = sub_df[metric].diff().loc[last_date+timedelta(days=1)]
-            confirmed_seven_days = sub_df[metric].diff().loc[last_date:last_date+timedelta(days=7)].sum()
-            growth_rate = sub_df[metric].pct_change().loc[last_date]
-            growth_rate_seven = sub_df[metric].pct_change().loc[last_date+timedelta(days=7)]
-            realtive_risk = int(1/sub_df.loc[last_date, 'per_capita_{}'.format(metric)])
-            entry['Confirmed'] = int(confirmed)
-            entry['New'] = "+{:,}".format(int(confirmed_24))
-            entry['+1 Day'] = "+{:,}".format(int(confirmed_tomorrow))
-            entry['+7 Days'] = "+{:,}".format(int(confirmed_seven_days))
-            entry['Relative'] = "1 in {:,}".format(realtive_risk)
+                     'Location': row['label']}
+            growth_rate = row['growth_rate']
+            entry['Confirmed'] = int(row['current'])
+            entry['New'] = "+{:,}".format(int(row['new']))
+            entry['+1 Day'] = "+{:,}".format(int(row['tomorrow']))
+            entry['+7 Days'] = "+{:,}".format(int(row['seven_days']))
+            entry['Relative'] = "1 in {:,}".format(int(1/row['per_capita']))
             entry['Growth Rate'] = "{}%".format(round(growth_rate*100, 2))
-            entry['+7 Days GR'] = "{}%".format(round(round(growth_rate_seven*100,
+            entry['+7 Days GR'] = "{}%".format(round(round(row['growth_rate_seven']*100,
                                                            2) - round(growth_rate*100, 2), 2))
 
             data_entries.append(entry)
@@ -425,16 +588,28 @@ def register_callbacks(app):
     def display_click_data(clickData, dropdown_selected, dropdown_options):
         if not clickData:
             return dropdown_selected
-        pid = clickData['points'][0]['customdata']
+        pid = clickData['points'][0].get('customdata')
+        # County clusters have no PID
+        if pid is None:
+            return dropdown_selected
         if int(pid) not in dropdown_selected:
             dropdown_selected.append(int(pid))
         return dropdown_selected
 
+    @app.callback(Output('dropdown_container', 'options'),
+                  [Input('dropdown_container', 'search_value'),
+                   Input('dropdown_container', 'value')],
+                  [State('data-version', 'data')])
+    def search_locations(search_value, values, version=None):
+        '''Locations matching what is typed, and the selected ones so they keep their labels'''
+        return snapshot.get(version).search.search(search_value, values)
+
     @app.callback(Output('map-title', 'children'),
-                  [Input('date_slider', 'value')])
-    def update_map_title(date_int):
+                  [Input('date_slider', 'value')],
+                  [State('data-version', 'data')])
+    def update_map_title(date_int, version=None):
         "Reported Infections Map"
-        official_date = DATE_MAPPER.iloc[date_int]['Date']
+        official_date = snapshot.get(version).date_mapper.iloc[date_int]['Date']
         if official_date.date() == date.today() - timedelta(days=1):
             return "Yesterday"
         if official_date.date() >= date.today():
@@ -0,0 +1,216 @@
+import os
+import copy
+import json
+import numpy as np
+import pandas as pd
+
+'''
+Dense PID x Date representation of MASTER_ALL.
+
+Each metric is one 2-D float array (row per PID, column per date), so a location's
+series is a row slice instead of a reset_index() and a scan of the whole table.
+datastore.ingest builds it once with its derived series and save()s it next to the
+columns, and load() maps it back read only, so the workers share one copy of it.
+'''
+
+METRICS = ['confirmed', 'deaths',
+           'confirmed_upper', 'confirmed_lower',
+           'deaths_upper', 'deaths_lower',
+           'per_capita_confirmed', 'per_capita_deaths']
+
+# Days of the trailing window of the week_* metrics derived adds
+WEEK = 7
+
+
+class MetricCube:
+    '''
+    pids      - PIDs in order of first appearance in MASTER_ALL, one row each
+    row       - dict PID -> row
+    dates     - DatetimeIndex, one column each
+    forcast   - bool per column, True for forecasted dates
+    forecast_col - first forecasted column, so [:forecast_col] is reported data
+    forcast_date - last reported date
+    present   - bool rows x columns, False where MASTER_ALL has no record
+    labels    - display name per row (Text_Confirmed up to the first <br>)
+    countries - country per row, 'worldwide' for the world total
+    '''
+
+    def __init__(self, master_all, metrics=METRICS):
+        if 'Date' not in master_all.columns:
+            master_all = master_all.reset_index()
+        pid_codes, pids = pd.factorize(master_all['PID'])
+        date_codes, dates = pd.factorize(master_all['Date'], sort=True)
+        self.pids = np.asarray(pids)
+        self.dates = pd.DatetimeIndex(dates, name='Date')
+        shape = (len(self.pids), len(self.dates))
+
+        self.present = np.zeros(shape, dtype=bool)
+        self.present[pid_codes, date_codes] = True
+
+        self.metrics = {}
+        for metric in metrics:
+            if metric not in master_all.columns:
+                continue
+            values = np.full(shape, np.nan)
+            values[pid_codes, date_codes] = master_all[metric].to_numpy(dtype=float)
+            self.metrics[metric] = values
+
+        forcast = np.zeros(len(self.dates), dtype=bool)
+        forcast[date_codes[master_all['forcast'].to_numpy(dtype=bool)]] = True
+        self.forcast = forcast
+
+        # PID codes count up in order of first appearance, so this is each PID's first record
+        first = np.unique(pid_codes, return_index=True)[1]
+        if 'label' in master_all.columns:
+            self.labels = np.asarray(master_all['label'].to_numpy()[first], dtype=object)
+        elif 'Text_Confirmed' in master_all.columns:
+            texts = master_all['Text_Confirmed'].to_numpy()[first]
+            self.labels = np.array([t.split('<br>')[0] for t in texts], dtype=object)
+        else:
+            self.labels = None
+        if 'country' in master_all.columns:
+            self.countries = np.asarray(master_all['country'].to_numpy()[first], dtype=object)
+        else:
+            self.countries = None
+        self._index()
+
+    def _index(self):
+        self.row = {pid: i for i, pid in enumerate(self.pids.tolist())}
+        self.dense = bool(self.present.all())
+        self.forecast_col = int(np.argmax(self.forcast)) if self.forcast.any() else len(self.forcast)
+        self.forcast_date = self.dates[self.forecast_col - 1]
+
+    def save(self, directory):
+        '''Write every array as its own .npy file under directory and the names as json'''
+        os.makedirs(directory)
+        dates = self.dates.values
+        np.save(os.path.join(directory, 'pids.npy'), self.pids)
+        np.save(os.path.join(directory, 'dates.npy'), dates.view(np.dtype(dates.dtype.str)))
+        np.save(os.path.join(directory, 'forcast.npy'), self.forcast)
+        np.save(os.path.join(directory, 'present.npy'), self.present)
+        for i, values in enumerate(self.metrics.values()):
+            np.save(os.path.join(directory, 'metric{}.npy'.format(i)), values)
+        with open(os.path.join(directory, 'cube.json'), 'w') as fh:
+            json.dump({'metrics': list(self.metrics),
+                       'labels': None if self.labels is None else list(self.labels),
+                       'countries': None if self.countries is None else list(self.countries)}, fh)
+
+    @classmethod
+    def load(cls, directory):
+        '''A cube written by save(), its metrics and present memory mapped read only'''
+        with open(os.path.join(directory, 'cube.json')) as fh:
+            names = json.load(fh)
+        metric_cube = cls.__new__(cls)
+        metric_cube.pids = np.load(os.path.join(directory, 'pids.npy'))
+        metric_cube.dates = pd.DatetimeIndex(np.load(os.path.join(directory, 'dates.npy')), name='Date')
+        metric_cube.forcast = np.load(os.path.join(directory, 'forcast.npy'))
+        metric_cube.present = np.load(os.path.join(directory, 'present.npy'), mmap_mode='r')
+        metric_cube.metrics = {metric: np.load(os.path.join(directory, 'metric{}.npy'.format(i)), mmap_mode='r')
+                               for i, metric in enumerate(names['metrics'])}
+        for name in ('labels', 'countries'):
+            values = names[name]
+            setattr(metric_cube, name, None if values is None else np.array(values, dtype=object))
+        metric_cube._index()
+        return metric_cube
+
+    def shard(self, start, stop):
+        '''Rows start:stop as a cube of their own, sharing this one's arrays'''
+        part = copy.copy(self)
+        part.pids = self.pids[start:stop]
+        part.row = {pid: i for i, pid in enumerate(part.pids.tolist())}
+        part.present = self.present[start:stop]
+        part.metrics = {metric: values[start:stop] for metric, values in self.metrics.items()}
+        if self.labels is not None:
+            part.labels = self.labels[start:stop]
+        if self.countries is not None:
+            part.countries = self.countries[start:stop]
+        return part
+
+    def __contains__(self, pid):
+        return pid in self.row
+
+    def values(self, pid, metric):
+        '''The full row for a PID, NaN where there is no record'''
+        return self.metrics[metric][self.row[pid]]
+
+    def label(self, pid):
+        return self.labels[self.row[pid]]
+
+    def frame(self, pid, metrics=None):
+        '''
+        One location as a small frame indexed by Date with a forcast column, holding only
+        the dates MASTER_ALL has for it -- the same rows MASTER_ALL[MASTER_ALL['PID'] == pid] had.
+        '''
+        row = self.row[pid]
+        metrics = metrics or list(self.metrics)
+        data = {'forcast': self.forcast}
+        for metric in metrics:
+            data[metric] = self.metrics[metric][row]
+        frame = pd.DataFrame(data, index=self.dates, columns=['forcast'] + metrics)
+        if not self.dense:
+            frame = frame[self.present[row]]
+        return frame
+
+    def trailing_window(self, pids, metric='confirmed', window=7):
+        '''
+        For the Exponential tab: per PID a frame indexed by the dates MASTER_ALL has for it,
+        with forcast, the cumulative value and its increase over the trailing `window` days
+        (the window is calendar days including the date itself, and the first `window`
+        records sum everything so far). Increases are taken between consecutive records
+        and missing values count as 0, like diff().fillna(0) over the PID's rows did.
+        All PIDs are done together.
+        '''
+        rows = [self.row[pid] for pid in pids]
+        present = self.present[rows]
+        cols = np.nonzero(present)[1]
+        counts = present.sum(axis=1)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        cumulative = self.metrics[metric][rows][present]
+        cumulative = np.where(np.isnan(cumulative), 0, cumulative)
+        # Precomputed at load for the usual window (see derived)
+        weekly = 'week_{}'.format(metric)
+        if weekly in self.metrics and window == WEEK:
+            sums = self.metrics[weekly][rows][present]
+        else:
+            sums = self.window_sums(rows, metric, window)
+
+        frames = []
+        for start, count in zip(starts, counts):
+            part = slice(start, start + count)
+            frames.append(pd.DataFrame({'forcast': self.forcast[cols[part]],
+                                        'cumulative': cumulative[part],
+                                        'window': sums[part]},
+                                       index=self.dates[cols[part]]))
+        return frames
+
+    def window_sums(self, rows, metric='confirmed', window=7):
+        '''
+        The `window` column of trailing_window for every present cell of rows, in the order
+        of self.present[rows] (row by row, by date)
+        '''
+        present = self.present[rows]
+        pid_of, cols = np.nonzero(present)
+        counts = present.sum(axis=1)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]]).astype(np.int64)
+        cumulative = self.metrics[metric][rows][present]
+        increase = np.empty_like(cumulative)
+        increase[1:] = cumulative[1:] - cumulative[:-1]
+        increase[starts[counts > 0]] = np.nan
+        increase = np.where(np.isnan(increase), 0, increase)
+
+        # First record inside each window, looked up on (PID, column) keys
+        position = np.arange(len(cols))
+        dates = self.dates.values
+        window_cols = np.searchsorted(dates, dates[cols] - np.timedelta64(window, 'D'))
+        keys = pid_of * (len(dates) + 1) + cols
+        first = np.searchsorted(keys, pid_of * (len(dates) + 1) + window_cols)
+        first = np.where(position - starts[pid_of] > window, first, starts[pid_of])
+
+        # One gathered (windows x length) block per window length, so each window is summed
+        # by numpy in the same order the per date .sum() did
+        lengths = position + 1 - first
+        sums = np.zeros(len(position))
+        for length in np.unique(lengths):
+            selected = np.flatnonzero(lengths == length)
+            sums[selected] = increase[first[selected][:, None] + np.arange(length)].sum(axis=1)
+        return sums
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+import pandas as pd
+import schema
+import cube
+import parallel
+
+'''
+Columnar on-disk copy of MASTER_ALL and MASTER_PID.
+
+Every numeric, bool and datetime column is written as its own .npy file and opened with
+mmap_mode='r', so gunicorn workers reading the same store share one page-cache copy and
+startup skips gzip decompression and unpickling. The frames are compacted first (see
+schema), and categorical columns are stored as their codes plus a json list of the
+categories. Other string columns are stored dictionary encoded (int32 codes + a json list
+of the distinct values); each worker rebuilds those as object columns, which only costs a
+pointer per row since the distinct strings are shared.
+
+The PID x Date cube with its derived series is built here too and saved under cube/ (see
+cube.MetricCube.save), so workers map it instead of each building a private copy.
+
+    python datastore.py Data/MASTER_ALL.pkl Data/MASTER_PID.pkl Data/store
+'''
+
+MANIFEST = 'manifest.json'
+
+
+def _write_table(frame, directory):
+    os.makedirs(directory)
+    columns = []
+    if frame.index.name is not None:
+        frame = frame.reset_index()
+        index = frame.columns[0]
+    else:
+        index = None
+    for i, name in enumerate(frame.columns):
+        column = frame[name]
+        entry = {'name': name, 'file': str(i)}
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            np.save(os.path.join(directory, '{}.codes.npy'.format(i)), column.cat.codes.to_numpy())
+            with open(os.path.join(directory, '{}.uniques.json'.format(i)), 'w') as fh:
+                json.dump(list(column.cat.categories), fh)
+            entry['kind'] = 'categorical'
+        elif column.dtype == object:
+            codes, uniques = pd.factorize(column)
+            np.save(os.path.join(directory, '{}.codes.npy'.format(i)), codes.astype(np.int32))
+            with open(os.path.join(directory, '{}.uniques.json'.format(i)), 'w') as fh:
+                json.dump(list(uniques), fh)
+            entry['kind'] = 'strings'
+        else:
+            values = column.to_numpy()
+            # pandas datetimes carry dtype metadata np.save warns about, a plain view drops it
+            np.save(os.path.join(directory, '{}.npy'.format(i)), values.view(np.dtype(values.dtype.str)))
+            entry['kind'] = 'array'
+        entry['dtype'] = str(column.dtype)
+        columns.append(entry)
+    return {'columns': columns, 'index': index, 'length': len(frame)}
+
+
+def ingest(master_all, master_pid, store_dir, version=None, workers=None):
+    '''
+    Write both frames under store_dir. The store is built in a sibling temp dir and moved
+    into place, so a worker never opens a half written store; workers still mapping the
+    old files keep reading them until they reload. The per PID stages run in `workers`
+    processes, COVID_INGEST_WORKERS by default (see parallel).
+    '''
+    workers = parallel.WORKERS if workers is None else workers
+    master_all, master_pid, report = schema.compact_frames(master_all, master_pid, workers)
+    metric_cube = parallel.derive(cube.MetricCube(master_all), workers)
+    parent = os.path.dirname(os.path.abspath(store_dir))
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.store-')
+    manifest = {
+        'version': version or hashlib.sha1(str(time.time()).encode()).hexdigest()[:12],
+        'created': time.time(),
+        'tables': {
+            'all': _write_table(master_all, os.path.join(tmp, 'all')),
+            'pid': _write_table(master_pid, os.path.join(tmp, 'pid'))},
+        'cube': 'cube'}
+    metric_cube.save(os.path.join(tmp, 'cube'))
+    manifest['tables']['all']['report'] = report['all']
+    manifest['tables']['pid']['report'] = report['pid']
+    with open(os.path.join(tmp, MANIFEST), 'w') as fh:
+        json.dump(manifest, fh)
+    if os.path.exists(store_dir):
+        old = tempfile.mkdtemp(dir=parent, prefix='.old-store-')
+        os.rename(store_dir, os.path.join(old, 'store'))
+        os.rename(tmp, store_dir)
+        shutil.rmtree(old)
+    else:
+        os.rename(tmp, store_dir)
+    return manifest
+
+
+def ingest_pickles(all_path, pid_path, store_dir):
+    master_all = pd.read_pickle(all_path, compression='gzip')
+    master_pid = pd.read_pickle(pid_path, compression='gzip')
+    return ingest(master_all, master_pid, store_dir)
+
+
+def read_manifest(store_dir):
+    with open(os.path.join(store_dir, MANIFEST)) as fh:
+        return json.load(fh)
+
+
+def _read_table(table, directory):
+    names = []
+    arrays = []
+    for entry in table['columns']:
+        path = os.path.join(directory, entry['file'])
+        if entry['kind'] == 'strings':
+            codes = np.load(path + '.codes.npy', mmap_mode='r')
+            with open(path + '.uniques.json') as fh:
+                uniques = np.array(json.load(fh) + [np.nan], dtype=object)
+            # code -1 is a missing value and picks the trailing nan
+            arrays.append(uniques[codes])
+        elif entry['kind'] == 'categorical':
+            codes = np.load(path + '.codes.npy', mmap_mode='r')
+            with open(path + '.uniques.json') as fh:
+                arrays.append(pd.Categorical.from_codes(codes, categories=json.load(fh)))
+        else:
+            arrays.append(np.load(path + '.npy', mmap_mode='r'))
+        names.append(entry['name'])
+    # copy=False keeps every column in a block of its own instead of stacking the memory
+    # maps into a private 2-D copy (pandas 1.3 and later)
+    frame = pd.DataFrame(dict(zip(names, arrays)), columns=names, copy=False)
+    if table['index'] is not None:
+        frame.set_index(table['index'], inplace=True)
+    return frame
+
+
+def load(store_dir):
+    '''
+    Returns (MASTER_ALL, MASTER_PID, cube) backed by read-only memory maps, the cube None
+    for a store written without one
+    '''
+    manifest = read_manifest(store_dir)
+    master_all = _read_table(manifest['tables']['all'], os.path.join(store_dir, 'all'))
+    master_pid = _read_table(manifest['tables']['pid'], os.path.join(store_dir, 'pid'))
+    metric_cube = None
+    if 'cube' in manifest:
+        metric_cube = cube.MetricCube.load(os.path.join(store_dir, manifest['cube']))
+    return master_all, master_pid, metric_cube
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 4:
+        print('usage: python datastore.py MASTER_ALL.pkl MASTER_PID.pkl STORE_DIR')
+        sys.exit(1)
+    manifest = ingest_pickles(*sys.argv[1:])
+    print('Wrote store {} version {}'.format(sys.argv[3], manifest['version']))
@@ -0,0 +1,103 @@
+import numpy as np
+import cube
+
+'''
+Series derived from the base metrics of the cube, computed once per data version for all
+PIDs and stored in metric_cube.metrics next to them, NaN where MASTER_ALL has no record:
+
+new_<metric>    - increase since the PID's previous record, NaN on its first. The diff()
+                  of Cases Per Day, the summary cards and the table.
+growth_<metric> - the Growth Rate tab: percent change since the previous record after
+                  carrying the last nonzero value over zeros, 1 where it is undefined.
+week_confirmed  - increase over the trailing cube.WEEK days, the Exponential tab.
+
+They are worked out on the whole PID x Date grid with "previous present column" indexes,
+over the same records and with the same float operations the pandas code did per location,
+so the numbers are the same. Like before, forecasted dates continue each PID's series and
+the cube's forcast flags tell them apart. Per capita rates come with the data.
+tests/test_derived.py compares every series with the pandas code on MASTER_ALL.
+'''
+
+METRICS = ['confirmed', 'deaths']
+
+# Rows per block of the trailing window sums, which gather WEEK + 1 values per cell
+WINDOW_ROWS = 512
+
+
+def last_present(mask):
+    '''Per cell, the column of the closest True cell at or left of it in the row, -1 if none'''
+    return np.maximum.accumulate(np.where(mask, np.arange(mask.shape[1]), -1), axis=1)
+
+
+def previous(mask):
+    '''Per cell, the column of the closest True cell to its left in the row, -1 if none'''
+    last = last_present(mask)
+    before = np.full_like(last, -1)
+    before[:, 1:] = last[:, :-1]
+    return before
+
+
+def take(values, columns):
+    '''values[row, columns[row]] (one column or a row of columns per row), NaN where it is -1'''
+    single = columns.ndim == 1
+    if single:
+        columns = columns[:, None]
+    taken = np.where(columns >= 0, np.take_along_axis(values, np.maximum(columns, 0), axis=1), np.nan)
+    return taken[:, 0] if single else taken
+
+
+def diff(values, present, before):
+    '''diff() over each row's present cells'''
+    with np.errstate(invalid='ignore'):
+        return np.where(present, values - take(values, before), np.nan)
+
+
+def pct_change(values, present, before):
+    '''pct_change() over each row's present cells: pads missing values, NaN on the first'''
+    filled = take(values, last_present(present & ~np.isnan(values)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return filled / take(filled, before) - 1
+
+
+def growth_rate(values, present, before):
+    '''
+    replace(to_replace=0, method='ffill').pct_change()*100 with inf and NaN replaced by 1,
+    over each row's present cells. A zero takes the last value that is not zero (NaN
+    included), zeros before any such value stay.
+    '''
+    carried = last_present(present & (values != 0))
+    replaced = np.where(carried >= 0, take(values, carried), 0)
+    growth = pct_change(replaced, present, before) * 100
+    growth[growth == np.inf] = 1
+    growth[np.isnan(growth)] = 1
+    return np.where(present, growth, np.nan)
+
+
+def week(metric_cube, metric='confirmed'):
+    '''trailing_window's sums over cube.WEEK days for every present cell'''
+    present = metric_cube.present
+    sums = np.full(present.shape, np.nan)
+    for start in range(0, len(present), WINDOW_ROWS):
+        stop = min(start + WINDOW_ROWS, len(present))
+        block = sums[start:stop]
+        block[present[start:stop]] = metric_cube.window_sums(list(range(start, stop)), metric, cube.WEEK)
+    return sums
+
+
+def series(metric_cube):
+    '''The derived series of metric_cube by name. Every row only depends on the same row.'''
+    present = metric_cube.present
+    before = previous(present)
+    found = {}
+    for metric in METRICS:
+        values = metric_cube.metrics[metric]
+        found['new_{}'.format(metric)] = diff(values, present, before)
+        found['growth_{}'.format(metric)] = growth_rate(values, present, before)
+    found['week_confirmed'] = week(metric_cube, 'confirmed')
+    return found
+
+
+def add(metric_cube):
+    '''Store the derived series in metric_cube.metrics'''
+    metric_cube.metrics.update(series(metric_cube))
+    return metric_cube
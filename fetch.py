@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import socket
+import hashlib
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError, URLError
+
+'''Keeps an on-disk copy of every url we read and revalidates it with conditional GETs'''
+
+CACHE_DIR = os.environ.get('COVID_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'covid19_cache'))
+FETCH_TIMEOUT = float(os.environ.get('COVID_FETCH_TIMEOUT', 30))
+FETCH_RETRIES = int(os.environ.get('COVID_FETCH_RETRIES', 3))
+
+# status is one of 'downloaded', 'not_modified' or 'fallback' (fetch failed, serving the cached copy)
+FetchResult = namedtuple('FetchResult', ['url', 'path', 'etag', 'last_modified', 'status'])
+
+
+class CachedFetcher:
+    def __init__(self, cache_dir=CACHE_DIR, timeout=FETCH_TIMEOUT, retries=FETCH_RETRIES, backoff=0.5):
+        self.cache_dir = cache_dir
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        body = os.path.join(self.cache_dir, key)
+        return body, body + '.json'
+
+    def _read_meta(self, url):
+        body, meta = self._paths(url)
+        if not os.path.exists(body) or not os.path.exists(meta):
+            return {}
+        try:
+            with open(meta) as fh:
+                return json.load(fh)
+        except (OSError, ValueError):
+            # Unreadable metadata is a cache miss, the next download rewrites it
+            return {}
+
+    def _replace(self, path, write):
+        '''write(fh) to a temp file moved over path, so other workers never read half a file'''
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                write(fh)
+            os.replace(tmp, path)
+        except BaseException:
+            os.remove(tmp)
+            raise
+
+    def _write(self, url, response):
+        '''Stream the body and then its metadata into place'''
+        body, meta = self._paths(url)
+
+        def write_body(fh):
+            while True:
+                chunk = response.read(1 << 20)
+                if not chunk:
+                    break
+                fh.write(chunk)
+        self._replace(body, write_body)
+        info = {'url': url,
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified')}
+        self._replace(meta, lambda fh: fh.write(json.dumps(info).encode('utf-8')))
+        return info
+
+    def _request(self, request, handle):
+        '''
+        handle(response) of request, retried with backoff on network errors and 5xx. Raises
+        the last error, or an HTTPError below 500 (304 included) right away.
+        '''
+        error = None
+        for attempt in range(self.retries):
+            try:
+                with urlopen(request, timeout=self.timeout) as response:
+                    return handle(response)
+            except HTTPError as e:
+                # A 4xx will not fix itself
+                if e.code < 500:
+                    raise
+                error = e
+            except (URLError, socket.timeout, ConnectionError) as e:
+                error = e
+            if attempt < self.retries - 1:
+                time.sleep(self.backoff * 2 ** attempt)
+        raise error
+
+    def fetch(self, url):
+        body, _ = self._paths(url)
+        meta = self._read_meta(url)
+        headers = {}
+        if meta.get('etag'):
+            headers['If-None-Match'] = meta['etag']
+        if meta.get('last_modified'):
+            headers['If-Modified-Since'] = meta['last_modified']
+
+        try:
+            info = self._request(Request(url, headers=headers), lambda response: self._write(url, response))
+            return FetchResult(url, body, info['etag'], info['last_modified'], 'downloaded')
+        except HTTPError as e:
+            if e.code == 304:
+                return FetchResult(url, body, meta.get('etag'), meta.get('last_modified'), 'not_modified')
+            error = e
+        except (URLError, socket.timeout, ConnectionError) as e:
+            error = e
+
+        if meta:
+            print('Fetching {} failed ({}), using cached copy'.format(url, error))
+            return FetchResult(url, body, meta.get('etag'), meta.get('last_modified'), 'fallback')
+        raise error
+
+    def head(self, url):
+        '''
+        The validators the server has for url now, with a HEAD request so nothing is
+        downloaded. status is 'checked', or 'fallback' with those of the cached copy when
+        the server can't be reached.
+        '''
+        body, _ = self._paths(url)
+        try:
+            headers = self._request(Request(url, method='HEAD'), lambda response: response.headers)
+            return FetchResult(url, body, headers.get('ETag'), headers.get('Last-Modified'), 'checked')
+        except (URLError, socket.timeout, ConnectionError) as error:
+            meta = self._read_meta(url)
+            if not meta:
+                raise
+            print('Checking {} failed ({}), using cached copy'.format(url, error))
+            return FetchResult(url, body, meta.get('etag'), meta.get('last_modified'), 'fallback')
+
+    def _each(self, method, urls):
+        with ThreadPoolExecutor(max_workers=len(urls)) as pool:
+            futures = {key: pool.submit(method, url) for key, url in urls.items()}
+            return {key: future.result() for key, future in futures.items()}
+
+    def fetch_all(self, urls):
+        '''Fetch a dict of urls concurrently, returns a dict of FetchResult with the same keys'''
+        return self._each(self.fetch, urls)
+
+    def head_all(self, urls):
+        '''head() of a dict of urls concurrently'''
+        return self._each(self.head, urls)
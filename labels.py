@@ -0,0 +1,108 @@
+import numpy as np
+
+'''
+Hover text for the map, built from the counts of the rows that are drawn.
+
+MASTER_ALL's Text_Confirmed / Text_Deaths hold "<name><br>Total Cases: 1,234" for every
+(PID, date). split_text keeps the name once as a `label` column (a categorical once
+compacted) and drops each text column only when every stored string is exactly what
+hover_text builds from the label and the count. Data in any other format keeps its text
+column and is used as it was. attach builds the dropped columns back for the rows of one
+map date.
+'''
+
+# Text column -> (count it shows, what the count is called)
+TEXTS = {'Text_Confirmed': ('confirmed', 'Total Cases'),
+         'Text_Deaths': ('deaths', 'Total Deaths')}
+
+
+def format_thousands(values):
+    '''
+    "{:,}".format(int(v)) for each of values. The digits, commas and signs are laid out as
+    bytes in one (values x width) array and read back as strings, so no value is formatted
+    on its own.
+    '''
+    values = np.asarray(values).astype(np.int64)
+    negative = values < 0
+    # -(v + 1) + 1, so the smallest int64 doesn't overflow
+    magnitude = np.where(negative, -(values + 1), values).astype(np.uint64) + negative
+    n_digits = len(str(int(magnitude.max()))) if len(values) else 1
+    width = 1 + n_digits + (n_digits - 1) // 3
+    # Digits most significant first, each in the column after the sign and the commas left of it
+    place = np.arange(n_digits - 1, -1, -1)
+    digits = magnitude[:, None] // (np.uint64(10) ** place.astype(np.uint64)) % np.uint64(10)
+    columns = 1 + np.arange(n_digits) + (n_digits - 1) // 3 - place // 3
+    chars = np.zeros((len(values), width), dtype=np.uint8)
+    chars[:, columns] = digits.astype(np.uint8) + ord('0')
+    chars[:, columns[(place % 3 == 0) & (place > 0)] + 1] = ord(',')
+    # Each row starts at its first nonzero digit (the last one for 0) or the sign before it,
+    # and is shifted left to there; the zero bytes after it end the string
+    first = np.where((digits == 0).all(axis=1), n_digits - 1, (digits != 0).argmax(axis=1))
+    start = columns[first] - negative
+    chars[negative, start[negative]] = ord('-')
+    shifted = start[:, None] + np.arange(width)
+    chars = np.where(shifted < width, np.take_along_axis(chars, np.minimum(shifted, width - 1), axis=1), 0)
+    return np.ascontiguousarray(chars, dtype=np.uint8).view('S{}'.format(width)).ravel().astype(str).astype(object)
+
+
+def hover_text(label, values, total):
+    return np.asarray(label, dtype=object) + '<br>' + total + ': ' + format_thousands(values)
+
+
+def relative_text(frame, name, relative, per_capita):
+    '''
+    "<name><br>Relative Cases: 1 in N" for the rows of frame, after their label or, for data
+    whose text column `name` was kept, the name in it
+    '''
+    inverse = (1 / per_capita).replace(np.inf, 0).astype(int)
+    if 'label' in frame.columns:
+        prefix = frame['label'].to_numpy(dtype=object) + ('<br>' + relative)
+    else:
+        total = TEXTS[name][1]
+        prefix = frame[name].str.split(':').str.get(0).str.replace(total, relative).to_numpy(dtype=object)
+    return prefix + ': 1 in ' + format_thousands(inverse)
+
+
+def _bytes(column):
+    return int(column.memory_usage(deep=True, index=False))
+
+
+def dropped(frame, name):
+    '''Memory report row of text column `name`, before it is dropped'''
+    return {'column': name, 'dtype_before': str(frame[name].dtype),
+            'bytes_before': _bytes(frame[name]), 'dtype_after': None, 'bytes_after': 0}
+
+
+def split_text(frame):
+    '''
+    Replace the text columns of frame (in place) by a label column where they can be built
+    back exactly. Returns (frame, report rows of the dropped columns).
+    '''
+    if 'label' in frame.columns or 'Text_Confirmed' not in frame.columns:
+        return frame, []
+    texts = frame['Text_Confirmed'].to_numpy(dtype=object)
+    if not all(isinstance(t, str) for t in texts):
+        return frame, []
+    label = np.array([t.partition('<br>')[0] for t in texts], dtype=object)
+    report = []
+    for name, (metric, total) in TEXTS.items():
+        if name not in frame.columns:
+            continue
+        values = frame[metric].to_numpy(dtype=float)
+        if not np.isfinite(values).all():
+            continue
+        if (hover_text(label, values, total) == frame[name].to_numpy(dtype=object)).all():
+            report.append(dropped(frame, name))
+            del frame[name]
+    if report:
+        frame['label'] = label
+    return frame, report
+
+
+def attach(frame):
+    '''frame with the text columns split_text dropped built back, for a few rows'''
+    if 'label' not in frame.columns:
+        return frame
+    missing = {name: hover_text(frame['label'].to_numpy(dtype=object), frame[metric].to_numpy(dtype=float), total)
+               for name, (metric, total) in TEXTS.items() if name not in frame.columns}
+    return frame.assign(**missing) if missing else frame
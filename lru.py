@@ -0,0 +1,75 @@
+import threading
+from collections import OrderedDict
+
+'''
+A small thread safe LRU cache with hit/miss counters for the per data version caches.
+Given a sizeof function it also keeps the total size of its values and, with maxbytes,
+evicts to stay under it.
+'''
+
+
+class LRUCache:
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def _size(self, value):
+        return self.sizeof(value) if self.sizeof else 0
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self.bytes -= self._size(self._data[key])
+            self._data[key] = value
+            self.bytes += self._size(value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize or \
+                    (self.maxbytes is not None and self.bytes > self.maxbytes and len(self._data) > 1):
+                _, evicted = self._data.popitem(last=False)
+                self.bytes -= self._size(evicted)
+                self.evictions += 1
+
+    def retain(self, keep):
+        '''Drop the entries for which keep(key, value) is false'''
+        with self._lock:
+            for key, value in list(self._data.items()):
+                if not keep(key, value):
+                    del self._data[key]
+                    self.bytes -= self._size(value)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'size': len(self._data),
+                'maxsize': self.maxsize,
+                'bytes': self.bytes if self.sizeof else None,
+                'maxbytes': self.maxbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / total if total else 0.0}
@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import bisect
+import tempfile
+import functools
+import threading
+import flask
+from dash.exceptions import PreventUpdate
+
+'''
+Latency and payload histograms for every server side Dash callback, served in Prometheus
+text format.
+
+instrument(app) replaces the function Dash dispatches for each callback in
+app.callback_map with one that records wall time, CPU time of the serving thread, request
+body bytes and response bytes. Series are labeled by the callback's function name and by
+the tab and granularity inputs when the callback has them, so the slow or heavy views show
+up on their own. The labels only take known values, which keeps the number of series
+fixed. A call costs a few microseconds, so it stays on unless COVID_METRICS=0.
+
+Every gunicorn worker records what it serves, and a scrape reaches one of them. With
+COVID_METRICS_DIR each worker writes its series to <pid>.json there every
+COVID_METRICS_FLUSH seconds (5) and on each scrape, and the scraped worker serves the sum
+of all the files, so the series cover every worker, at most one flush behind. Files of
+workers that exited are kept so counts never go down; empty the directory on deploy.
+Without it the series are this worker's only and carry a worker label with its pid.
+'''
+
+ENABLED = os.environ.get('COVID_METRICS', '1') != '0'
+DIRECTORY = os.environ.get('COVID_METRICS_DIR')
+FLUSH_INTERVAL = float(os.environ.get('COVID_METRICS_FLUSH', 5))
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+# Input 'id.property' -> (label, values it can take)
+KEY_INPUTS = {
+    'tabs-values.value': ('tab', ('total_cases_graph', 'per_day_cases', 'exponential', 'gr')),
+    'tabs-table-values.value': ('tab', ('conf-tab', 'deaths_tab')),
+    'check-locations.value': ('granularity', ('country', 'province', 'county'))}
+LABELS = ('callback', 'tab', 'granularity')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_string(names, values):
+    return ','.join('{}="{}"'.format(n, _escape(v)) for n, v in zip(names, values))
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets, labels=LABELS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labels = labels
+        # label values -> [count per bucket, +Inf count, sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            return {labels: list(series) for labels, series in self._series.items()}
+
+    @staticmethod
+    def add(samples, labels, series):
+        total = samples.get(labels)
+        samples[labels] = list(series) if total is None else [a + b for a, b in zip(total, series)]
+
+    def render(self, samples, extra=()):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        for labels, series in sorted(samples.items()):
+            label_string = _label_string(self.labels + extra, labels)
+            count = 0
+            for bound, n in zip(self.buckets + ('+Inf',), series[:-1]):
+                count += n
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, label_string, bound, count))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, label_string, series[-1]))
+            lines.append('{}_count{{{}}} {}'.format(self.name, label_string, count))
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation, labels):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def add(samples, labels, value):
+        samples[labels] = samples.get(labels, 0) + value
+
+    def render(self, samples, extra=()):
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        for labels, value in sorted(samples.items()):
+            lines.append('{}{{{}}} {}'.format(self.name, _label_string(self.labels + extra, labels), value))
+        return lines
+
+
+DURATION = Histogram('dash_callback_duration_seconds', 'Wall time of a callback', DURATION_BUCKETS)
+CPU = Histogram('dash_callback_cpu_seconds', 'CPU time of the thread serving a callback', DURATION_BUCKETS)
+REQUEST_BYTES = Histogram('dash_callback_request_bytes', 'Request body of a callback', BYTES_BUCKETS)
+RESPONSE_BYTES = Histogram('dash_callback_response_bytes', 'Serialized output of a callback', BYTES_BUCKETS)
+CALLS = Counter('dash_callback_calls_total', 'Callback calls by outcome (ok, prevented, error)',
+                LABELS + ('status',))
+METRICS = [DURATION, CPU, REQUEST_BYTES, RESPONSE_BYTES, CALLS]
+
+# Pid of the process whose series the flush thread writes, so a forked worker starts its own
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def flush(directory=DIRECTORY):
+    '''Write this process's series to <pid>.json in directory, replacing the last ones'''
+    samples = {metric.name: [[list(labels), value] for labels, value in metric.samples().items()]
+               for metric in METRICS}
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix='.metrics-')
+    try:
+        with os.fdopen(fd, 'w') as fh:
+            json.dump(samples, fh)
+        os.replace(tmp, os.path.join(directory, '{}.json'.format(os.getpid())))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _flush_loop(directory, interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush(directory)
+        except OSError as e:
+            print('Could not write metrics to {}: {}'.format(directory, e))
+
+
+def _start_flusher():
+    global _flusher_pid
+    if DIRECTORY is None or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid == os.getpid():
+            return
+        os.makedirs(DIRECTORY, exist_ok=True)
+        threading.Thread(target=_flush_loop, args=(DIRECTORY, FLUSH_INTERVAL),
+                         name='metrics-flush', daemon=True).start()
+        _flusher_pid = os.getpid()
+
+
+def collect(directory=DIRECTORY):
+    '''
+    Samples per metric name and the extra label names: summed over the files of every worker
+    in directory, or this process's labeled with its pid when there is none
+    '''
+    if directory is None:
+        worker = (str(os.getpid()),)
+        return {metric.name: {labels + worker: value for labels, value in metric.samples().items()}
+                for metric in METRICS}, ('worker',)
+    os.makedirs(directory, exist_ok=True)
+    flush(directory)
+    merged = {metric.name: {} for metric in METRICS}
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as fh:
+                samples = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        for metric in METRICS:
+            for labels, value in samples.get(metric.name, ()):
+                metric.add(merged[metric.name], tuple(labels), value)
+    return merged, ()
+
+
+def _labels(name):
+    '''(callback, tab, granularity) for the request being served, '' where it has none'''
+    found = {}
+    body = flask.request.get_json(silent=True) or {}
+    for item in body.get('inputs', ()):
+        if not isinstance(item, dict):
+            continue
+        key = KEY_INPUTS.get('{}.{}'.format(item.get('id'), item.get('property')))
+        if key is None:
+            continue
+        label, known = key
+        value = item.get('value')
+        if isinstance(value, list):
+            found[label] = '+'.join(v for v in known if v in value)
+        else:
+            found[label] = value if value in known else 'other'
+    return (name, found.get('tab', ''), found.get('granularity', ''))
+
+
+def _timed(func, name):
+    @functools.wraps(func)
+    def timed(*args, **kwargs):
+        _start_flusher()
+        labels = _labels(name)
+        status = 'error'
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            response = func(*args, **kwargs)
+            status = 'ok'
+        except PreventUpdate:
+            status = 'prevented'
+            raise
+        finally:
+            DURATION.observe(labels, time.perf_counter() - start)
+            CPU.observe(labels, time.thread_time() - cpu_start)
+            REQUEST_BYTES.observe(labels, flask.request.content_length or 0)
+            CALLS.inc(labels + (status,))
+        RESPONSE_BYTES.observe(labels, len(response))
+        return response
+    timed.instrumented = True
+    return timed
+
+
+def instrument(app):
+    '''Wrap every server side callback registered on app so far'''
+    if not ENABLED:
+        return
+    for output, entry in app.callback_map.items():
+        func = entry.get('callback')
+        if func is None or getattr(func, 'instrumented', False):
+            continue
+        entry['callback'] = _timed(func, getattr(func, '__name__', output))
+
+
+def render(directory=DIRECTORY):
+    samples, extra = collect(directory)
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render(samples[metric.name], extra))
+    return '\n'.join(lines) + '\n'
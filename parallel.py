@@ -0,0 +1,181 @@
+import os
+import time
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+import pandas as pd
+import labels
+import derived
+
+'''
+The per location work of loading the data, spread over a pool of processes.
+
+Two stages scale with the number of PIDs and only look at one PID at a time: taking the
+labels out of the hover text (labels.split_text) and the derived series (derived.series).
+With COVID_INGEST_WORKERS above 1 (0 for one per core) each is split into shards of
+consecutive PIDs with about the same number of records, and run by that many forked
+processes. They inherit the inputs from the loading process and write their results
+straight into arrays in shared memory, so only shard bounds and a few flags are pickled.
+With 1 (the default) the stages run as before in this process.
+
+Forking a process while other threads run can copy a lock one of them holds (logging, the
+caches, a sqlite connection) into a child that then waits on it forever, so the pool is
+only used by a process with no other thread: datastore.py writing the store and
+benchmarks.bench_ingest. The server loads data on its refresher thread next to the request
+threads and always does these stages in process (see callbacks.prepare_data).
+
+REPORT holds the time of every sharded stage and shard of the last load, for /readyz.
+'''
+
+WORKERS = int(os.environ.get('COVID_INGEST_WORKERS', 1)) or os.cpu_count()
+# Shards per worker, so one slow shard doesn't hold up the stage
+SHARDS_PER_WORKER = 4
+
+REPORT = {'workers': 1, 'stages': []}
+
+# What the forked workers of the running stage read: (function, inputs, output arrays)
+_stage = None
+
+
+def enabled(workers=None):
+    workers = WORKERS if workers is None else workers
+    return workers > 1 and 'fork' in multiprocessing.get_all_start_methods() and threading.active_count() == 1
+
+
+def shard_bounds(weights, n_shards):
+    '''Split range(len(weights)) into at most n_shards runs of about equal total weight'''
+    total = np.cumsum(weights)
+    if not len(total) or total[-1] == 0:
+        return [(0, len(weights))]
+    targets = total[-1] * np.arange(1, n_shards) / n_shards
+    cuts = np.unique(np.concatenate([[0], np.searchsorted(total, targets, side='right'), [len(weights)]]))
+    return list(zip(cuts[:-1].tolist(), cuts[1:].tolist()))
+
+
+class SharedArrays:
+    '''Numpy arrays in shared memory, created before the pool forks so the workers write into them'''
+
+    def __init__(self, specs):
+        self._blocks = []
+        self.arrays = {}
+        for name, (shape, dtype) in specs.items():
+            size = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            block = shared_memory.SharedMemory(create=True, size=size)
+            self._blocks.append(block)
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def collect(self):
+        '''Copies of the arrays in private memory, freeing the shared blocks'''
+        collected = {name: np.array(array) for name, array in self.arrays.items()}
+        self.arrays = {}
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+        return collected
+
+
+def _run_shard(bounds):
+    func, inputs, outputs = _stage
+    start = time.perf_counter()
+    result = func(inputs, outputs, *bounds)
+    return bounds, result, time.perf_counter() - start
+
+
+def run_stage(name, func, inputs, specs, bounds, workers=None):
+    '''
+    func(inputs, outputs, start, stop) for every (start, stop) of bounds in `workers` forked
+    processes. Returns the outputs (specs gives their shapes and dtypes) and the results
+    of func in the order of bounds.
+    '''
+    global _stage
+    workers = WORKERS if workers is None else workers
+    start = time.perf_counter()
+    shared = SharedArrays(specs)
+    _stage = (func, inputs, shared.arrays)
+    try:
+        with multiprocessing.get_context('fork').Pool(min(workers, len(bounds))) as pool:
+            done = pool.map(_run_shard, bounds, chunksize=1)
+    finally:
+        _stage = None
+        outputs = shared.collect()
+    REPORT['workers'] = workers
+    REPORT['stages'].append({
+        'stage': name,
+        'seconds': round(time.perf_counter() - start, 4),
+        'shards': [{'pids': list(b), 'seconds': round(seconds, 4)} for b, _, seconds in done]})
+    return outputs, [result for _, result, _ in done]
+
+
+def start_report(workers=None):
+    REPORT['workers'] = WORKERS if workers is None else workers
+    REPORT['stages'] = []
+
+
+def _split_shard(inputs, outputs, start, stop):
+    '''Labels of the rows of PIDs start:stop as codes into the shard's own uniques'''
+    pid_codes, texts, values = inputs
+    rows = np.flatnonzero((pid_codes >= start) & (pid_codes < stop))
+    confirmed = texts['Text_Confirmed'][rows]
+    if not all(isinstance(t, str) for t in confirmed):
+        return None
+    label = np.array([t.partition('<br>')[0] for t in confirmed], dtype=object)
+    same = {}
+    for name, (metric, total) in labels.TEXTS.items():
+        if name in texts:
+            shard_values = values[metric][rows]
+            same[name] = bool(np.isfinite(shard_values).all() and
+                              (labels.hover_text(label, shard_values, total) == texts[name][rows]).all())
+    codes, uniques = pd.factorize(label)
+    outputs['label'][rows] = codes
+    return uniques.tolist(), same
+
+
+def split_text(frame, workers=None):
+    '''labels.split_text with the rows of each shard of PIDs done by a worker'''
+    if not enabled(workers) or 'label' in frame.columns or 'Text_Confirmed' not in frame.columns:
+        return labels.split_text(frame)
+    workers = WORKERS if workers is None else workers
+    pid_codes, pids = pd.factorize(frame['PID'])
+    bounds = shard_bounds(np.bincount(pid_codes, minlength=len(pids)), workers * SHARDS_PER_WORKER)
+    texts = {name: frame[name].to_numpy(dtype=object) for name in labels.TEXTS if name in frame.columns}
+    values = {labels.TEXTS[name][0]: frame[labels.TEXTS[name][0]].to_numpy(dtype=float) for name in texts}
+    outputs, results = run_stage('labels', _split_shard, (pid_codes, texts, values),
+                                 {'label': ((len(frame),), np.int32)}, bounds, workers)
+    if any(result is None for result in results):
+        return frame, []
+
+    # Shard codes to one array of labels
+    uniques = [u for result in results for u in result[0]]
+    offsets = np.cumsum([0] + [len(result[0]) for result in results])
+    shard_of_row = np.searchsorted([b[0] for b in bounds], pid_codes, side='right') - 1
+    label = np.array(uniques, dtype=object)[offsets[shard_of_row] + outputs['label']]
+
+    report = []
+    for name in texts:
+        if all(result[1][name] for result in results):
+            report.append(labels.dropped(frame, name))
+            del frame[name]
+    if report:
+        frame['label'] = label
+    return frame, report
+
+
+def _derive_shard(inputs, outputs, start, stop):
+    for name, values in derived.series(inputs.shard(start, stop)).items():
+        outputs[name][start:stop] = values
+
+
+def derive(metric_cube, workers=None):
+    '''derived.add with the rows of each shard of PIDs done by a worker'''
+    if not enabled(workers):
+        return derived.add(metric_cube)
+    workers = WORKERS if workers is None else workers
+    bounds = shard_bounds(metric_cube.present.sum(axis=1), workers * SHARDS_PER_WORKER)
+    # The names and dtypes, from the first row
+    sample = derived.series(metric_cube.shard(0, 1))
+    specs = {name: (metric_cube.present.shape, values.dtype) for name, values in sample.items()}
+    outputs, _ = run_stage('derived', _derive_shard, metric_cube, specs, bounds, workers)
+    metric_cube.metrics.update(outputs)
+    return metric_cube
@@ -1,12 +1,23 @@
+import functools
 from plotly import graph_objs as go
 import math
 import numpy as np
 import plotly.colors
+import pandas as pd
+import labels
 from datetime import date, timedelta
 
 
 mapbox_style = 'mapbox://styles/jwillis0720/ck89nznm609pg1ipadkyrelvb'
-mapbox_access_token = open('./.mapbox_token').readlines()[0]
+
+
+@functools.lru_cache(maxsize=None)
+def get_mapbox_token():
+    '''Read on the first map instead of at import, so workers start without the file'''
+    with open('./.mapbox_token') as fh:
+        return fh.readlines()[0]
+
+
 colors = plotly.colors.qualitative.Dark24
 # remove black elment
 colors.remove(colors[5])
@@ -35,13 +46,15 @@ def get_rgb_with_opacity(hex_color, opacity=0.5):
     return 'rgba'+'{}'.format(tuple(list(int(h[i:i+2], 16) for i in (0, 2, 4))+[opacity]))
 
 
-def plot_map(dataframe, metrics, zoom, center, relative_check):
-    data_traces = []
+def map_traces(dataframe, metrics, relative_check):
+    '''
+    Everything about the map that depends only on the data for one date: marker arrays,
+    hover text, sizeref and color range per metric. Returned as plain dicts of arrays so
+    they can be cached and turned into a figure for any zoom/center with map_figure.
+    '''
+    traces = []
     if not metrics or dataframe.empty:
-        data_traces.append(go.Scattermapbox(
-            lon=[],
-            lat=[]
-        ))
+        traces.append(dict(lon=[], lat=[]))
     if 'confirmed' in metrics and not dataframe.empty:
         # First Do Confirmed
         dataframe = dataframe[dataframe['CSize'] > 0]
@@ -49,11 +62,9 @@ def plot_map(dataframe, metrics, zoom, center, relative_check):
         if relative_check:
             sizes = plotting_df['per_capita_confirmed'].to_numpy()
             name = 'Relative Cases'
-            text = plotting_df['Text_Confirmed'].str.split(':').str.get(
-                0).str.replace('Total Cases', 'Relative Cases') + ": 1 in " + (1/plotting_df['per_capita_confirmed']).replace(
-                    np.inf, 0).astype(int).apply(lambda x: "{:,}".format(x))
+            text = labels.relative_text(plotting_df, 'Text_Confirmed', 'Relative Cases',
+                                        plotting_df['per_capita_confirmed'])
             colors = list(plotting_df['per_capita_confirmed'])
-            size_max = max(plotting_df[plotting_df['per_capita_confirmed'] < 0.1]['per_capita_confirmed'])
             size_max = 0.01
             np.place(sizes, sizes > 0.01, [0.01])
             cmax = np.percentile(sizes, 99)
@@ -71,42 +82,28 @@ def plot_map(dataframe, metrics, zoom, center, relative_check):
             cmin = np.percentile(sizes, 25)
             sizeref = 2. * size_max / (100 ** 2)
 
-        colorscale = 'YlOrBr'
-        sizemin = 2
-
-        data = go.Scattermapbox(
-            lon=plotting_df['lon'],
-            lat=plotting_df['lat'],
-            customdata=plotting_df['PID'],
-            text=text,
-            hoverinfo='text',
+        traces.append(dict(
+            lon=plotting_df['lon'].to_numpy(),
+            lat=plotting_df['lat'].to_numpy(),
+            customdata=plotting_df['PID'].to_numpy(),
+            text=np.asarray(text, dtype=object),
             name=name,
-            mode='markers',
             marker=dict(
-                opacity=0.95,
-                sizemin=sizemin,
                 sizeref=sizeref,
-                reversescale=False,
-                colorscale=colorscale,
-                size=sizes,
+                colorscale='YlOrBr',
+                size=np.asarray(sizes),
                 color=colors,
                 cmax=cmax,
                 cmin=cmin,
-                cmid=cmid,
-                sizemode='area'
-            ),
-        )
-        data_traces.append(data)
+                cmid=cmid)))
     if 'deaths' in metrics and not dataframe.empty:
-         # First Do Confirmed
         dataframe = dataframe[dataframe['deaths'] > 0]
         plotting_df = dataframe
         if relative_check:
             sizes = plotting_df['per_capita_deaths'].to_numpy()
             name = 'Relative Deaths'
-            text = plotting_df['Text_Deaths'].str.split(':').str.get(
-                0).str.replace('Total Deaths', 'Relative Deaths') + ": 1 in " + (1/plotting_df['per_capita_deaths']).replace(
-                    np.inf, 0).astype(int).apply(lambda x: "{:,}".format(x))
+            text = labels.relative_text(plotting_df, 'Text_Deaths', 'Relative Deaths',
+                                        plotting_df['per_capita_deaths'])
             colors = list(plotting_df['per_capita_deaths'])
             np.place(sizes, sizes > 0.003, [0.003])
             size_max = max(sizes)
@@ -125,37 +122,29 @@ def plot_map(dataframe, metrics, zoom, center, relative_check):
             cmin = np.percentile(sizes, 10)
             sizeref = 2. * size_max / (100 ** 2)
 
-        colorscale = 'Reds'
-        sizemin = 2
-
-        data = go.Scattermapbox(
-            lon=plotting_df['lon'],
-            lat=plotting_df['lat'],
-            customdata=plotting_df['PID'],
-            text=text,
-            hoverinfo='text',
+        traces.append(dict(
+            lon=plotting_df['lon'].to_numpy(),
+            lat=plotting_df['lat'].to_numpy(),
+            customdata=plotting_df['PID'].to_numpy(),
+            text=np.asarray(text, dtype=object),
             name=name,
-            mode='markers',
             marker=dict(
-                opacity=0.95,
-                sizemin=sizemin,
                 sizeref=sizeref,
-                reversescale=False,
-                colorscale=colorscale,
-                size=sizes,
+                colorscale='Reds',
+                size=np.asarray(sizes),
                 color=colors,
                 cmax=cmax,
                 cmin=cmin,
-                cmid=cmid,
-                sizemode='area'
-            ),
-        )
-        data_traces.append(data)
-    layout = dict(
+                cmid=cmid)))
+    return traces
+
+
+def map_layout(zoom, center):
+    return dict(
         autosize=True,
         showlegend=True,
         mapbox=dict(
-            accesstoken=mapbox_access_token,
+            accesstoken=get_mapbox_token(),
             style=mapbox_style,
             zoom=zoom,
             center=center
@@ -179,15 +168,46 @@ def plot_map(dataframe, metrics, zoom, center, relative_check):
         plot_bgcolor='rgba(0,0,0,0)',
         paper_bgcolor='rgba(0,0,0,0)'
     )
+
+
+def map_figure(traces, zoom, center, viewport=None):
+    data_traces = []
+    for trace in traces:
+        if 'marker' not in trace:
+            data_traces.append(go.Scattermapbox(lon=trace['lon'], lat=trace['lat']))
+            continue
+        data_traces.append(go.Scattermapbox(
+            lon=trace['lon'],
+            lat=trace['lat'],
+            customdata=trace['customdata'],
+            text=trace['text'],
+            hoverinfo='text',
+            name=trace['name'],
+            mode='markers',
+            marker=dict(
+                opacity=0.95,
+                sizemin=2,
+                reversescale=False,
+                sizemode='area',
+                **trace['marker']
+            ),
+        ))
+    layout = map_layout(zoom, center)
+    if viewport is not None:
+        # What was sent, so a pan inside it needs no new figure
+        layout['meta'] = {'viewport': viewport.to_list()}
     return {'data': data_traces, 'layout': layout}
 
 
-def total_confirmed_graph(values, MASTER_DF, KEY_VALUE, log, metric, predict, gs):
+def plot_map(dataframe, metrics, zoom, center, relative_check):
+    return map_figure(map_traces(dataframe, metrics, relative_check), zoom, center)
+
+
+def total_confirmed_graph(values, CUBE, KEY_VALUE, log, metric, predict, gs):
     data_traces = []
-    MASTER_DF = MASTER_DF.reset_index()
-    forcast_date = MASTER_DF.groupby('forcast').tail(1)['Date'].iloc[0]
-    start_date = MASTER_DF['Date'].iloc[0]
-    end_date = MASTER_DF['Date'].iloc[-1]
+    forcast_date = CUBE.forcast_date
+    start_date = CUBE.dates[0]
+    end_date = CUBE.dates[-1]
     if gs:
         x_axis_range = [gs['xaxis.range[0]'], gs['xaxis.range[1]']]
         if 'yaxis.range[1]' in gs:
@@ -203,8 +223,7 @@ def total_confirmed_graph(values, MASTER_DF, KEY_VALUE, log, metric, predict, gs
     for enum_, item in enumerate(values):
         color_ = colors[enum_]
         color_rgba = get_rgb_with_opacity(color_, opacity=0.2)
-        sub_df = MASTER_DF[MASTER_DF['PID'] == item]
-        sub_df = sub_df.set_index('Date')
+        sub_df = CUBE.frame(item, [metric, '{}_upper'.format(metric), '{}_lower'.format(metric)])
         name = KEY_VALUE.loc[item, 'name']
         if metric == 'confirmed':
             hovert = '%{x}<br>Confirmed Cases - %{y:,f}'
@@ -382,17 +401,20 @@ def total_confirmed_graph(values, MASTER_DF, KEY_VALUE, log, metric, predict, gs
     return {'data': data_traces, 'layout': layout}
 
 
-def per_day_confirmed(values, MASTER_DF, KEY_VALUE, log, metric, predict, gs):
+def per_day_confirmed(values, CUBE, KEY_VALUE, log, metric, predict, gs):
     data_traces = []
     if not values:
         data_traces.append(go.Bar(x=[], y=[]))
         y_axis_title = "Select a value"
-    MASTER_DF = MASTER_DF.reset_index()
-    forcast_date = MASTER_DF.reset_index().groupby('forcast').tail(1)['Date'].iloc[0]
-    start_date = MASTER_DF.reset_index()['Date'].iloc[0]
-    end_date = MASTER_DF.reset_index()['Date'].iloc[-1]
-    sorted_values = list(MASTER_DF[(MASTER_DF['PID'].isin(values)) & (
-        MASTER_DF['Date'] == forcast_date)].sort_values('confirmed')[::-1]['PID'])
+    forcast_date = CUBE.forcast_date
+    start_date = CUBE.dates[0]
+    end_date = CUBE.dates[-1]
+    # Locations reported on the last date, largest first
+    last_col = CUBE.forecast_col - 1
+    rows = sorted(CUBE.row[v] for v in set(values) if v in CUBE and CUBE.present[CUBE.row[v], last_col])
+    on_last_date = pd.DataFrame({'PID': CUBE.pids[rows],
+                                 'confirmed': CUBE.metrics['confirmed'][rows, last_col]})
+    sorted_values = list(on_last_date.sort_values('confirmed')[::-1]['PID'])
 
     x_axis_range = 'auto'
     y_axis_range = 'auto'
@@ -415,8 +437,8 @@ def per_day_confirmed(values, MASTER_DF, KEY_VALUE, log, metric, predict, gs):
     for enum_, item in enumerate(sorted_values):
         color_ = colors[enum_]
         color_rgba = get_rgb_with_opacity(color_, opacity=0.2)
-        sub_df = MASTER_DF[MASTER_DF['PID'] == item].reset_index()
-        sub_df = sub_df.set_index('Date')[['confirmed', 'deaths']].diff().fillna(0)
+        sub_df = CUBE.frame(item, ['new_confirmed', 'new_deaths']).fillna(0).rename(
+            columns={'new_confirmed': 'confirmed', 'new_deaths': 'deaths'})
         name = KEY_VALUE.loc[item, 'name']
         if metric == 'confirmed':
             hovert = '%{x}<br>Confirmed Cases - %{y:,f}'
@@ -524,12 +546,10 @@ def per_day_confirmed(values, MASTER_DF, KEY_VALUE, log, metric, predict, gs):
     return {'data': data_traces, 'layout': layout}
 
 
-def plot_exponential(values, MASTER_DF, KEY_VALUE, log, predict, gs):
-    backtrack = 7
+def plot_exponential(values, CUBE, KEY_VALUE, log, predict, gs, backtrack=7):
     fig = go.Figure()
     max_number = 0
     annotations = []
-    MASTER_DF = MASTER_DF.reset_index()
     if gs:
         x_axis_range = [gs['xaxis.range[0]'], gs['xaxis.range[1]']]
         if 'yaxis.range[0]' in gs:
@@ -540,46 +560,21 @@ def plot_exponential(values, MASTER_DF, KEY_VALUE, log, predict, gs):
         x_axis_range = ['auto', 'auto']
         y_axis_range = ['auto', 'auto']
 
+    trailing = CUBE.trailing_window(values, 'confirmed', backtrack)
     for enum_, item in enumerate(values):
         name = KEY_VALUE.loc[item, 'name']
-        full_report = MASTER_DF[MASTER_DF['PID'] == item].set_index(['Date', 'forcast'])[['confirmed', 'deaths']]
-        per_day = full_report.diff()
-        plottable = full_report.join(
-            per_day, lsuffix='_cum', rsuffix='_diff')
-        plottable = plottable.fillna(0)
-        plottable = plottable.reset_index().set_index('Date')
-        # print(plottable)
-        # print(item, plottable)
-
-        xs = []
-        ys = []
-        xs_predict = []
-        ys_predict = []
-        dates = []
-        dates_predict = []
-        indexes = plottable.index
-        # print(plottable)
-        for indexer in range(1, len(indexes)):
-            date = indexes[indexer]
-            x = plottable.loc[date]['confirmed_cum']
-            forcast_bool = plottable.loc[date]['forcast']
-            # print(forcast_bool)
-            if indexer > backtrack:
-                y = plottable.loc[date - timedelta(days=backtrack): date].sum()['confirmed_diff']
-            else:
-                y = plottable.loc[: indexes[indexer]].sum()['confirmed_diff']
-            if x > max_number:
-                max_number = x
-            if y > max_number:
-                max_number = y
-            if forcast_bool:
-                xs_predict.append(x)
-                ys_predict.append(y)
-                dates_predict.append(date.strftime('%m/%d/%Y'))
-            else:
-                xs.append(x)
-                ys.append(y)
-                dates.append(date.strftime('%m/%d/%Y'))
+        # The first record has no increase and is not drawn
+        plottable = trailing[enum_].iloc[1:]
+        if len(plottable):
+            max_number = max(max_number, plottable['cumulative'].max(), plottable['window'].max())
+        reported = plottable[~plottable['forcast']]
+        predicted = plottable[plottable['forcast']]
+        xs = list(reported['cumulative'])
+        ys = list(reported['window'])
+        dates = list(reported.index.strftime('%m/%d/%Y'))
+        xs_predict = list(predicted['cumulative'])
+        ys_predict = list(predicted['window'])
+        dates_predict = list(predicted.index.strftime('%m/%d/%Y'))
         if not predict:
             sl = True
             circle = 'circle'
@@ -742,10 +737,9 @@ def plot_exponential(values, MASTER_DF, KEY_VALUE, log, predict, gs):
     return fig
 
 
-def per_gr(values, MASTER_DF, KEY_VALUE, log, metric, predict, gs):
+def per_gr(values, CUBE, KEY_VALUE, log, metric, predict, gs):
     shapes = []
     data_traces = []
-    MASTER_DF = MASTER_DF.reset_index()
     if gs:
         x_axis_range = [gs['xaxis.range[0]'], gs['xaxis.range[1]']]
         if 'yaxis.range[0]' in gs:
@@ -754,38 +748,23 @@ def per_gr(values, MASTER_DF, KEY_VALUE, log, metric, predict, gs):
             y_axis_range = ['auto', 'auto']
     else:
         if predict:
-            x_axis_range = [MASTER_DF['Date'].iloc[0], MASTER_DF['Date'].iloc[-1]]
+            x_axis_range = [CUBE.dates[0], CUBE.dates[-1]]
         else:
-            x_axis_range = [MASTER_DF['Date'].iloc[0], MASTER_DF.set_index('forcast').loc[False].iloc[-1]['Date']]
+            x_axis_range = [CUBE.dates[0], CUBE.forcast_date]
 
         y_axis_range = ['auto', 'auto']
     for enum_, item in enumerate(values):
         color_ = colors[enum_]
-        sub_df = MASTER_DF[MASTER_DF['PID'] == item]
-        sub_df = sub_df.set_index('Date')
+        sub_df = CUBE.frame(item, ['growth_{}'.format(metric)])
         xs = sub_df[sub_df['forcast'] == False].index
         xs_predict = sub_df[sub_df['forcast'] == True].index
         name = KEY_VALUE.loc[item, 'name']
+        ys = sub_df[sub_df['forcast'] == False]['growth_{}'.format(metric)]
+        ys_predict = sub_df[sub_df['forcast'] == True]['growth_{}'.format(metric)]
         if metric == 'confirmed':
-            sub_df = sub_df.reset_index().set_index(['Date', 'forcast'])
-            sub_df['gr'] = sub_df['confirmed'].replace(
-                to_replace=0, method='ffill').pct_change()*100
-            sub_df['gr'] = sub_df['gr'].replace(np.inf, 1)
-            sub_df['gr'] = sub_df['gr'].fillna(1)
-            sub_df = sub_df.reset_index()
-            ys = sub_df[sub_df['forcast'] == False]['gr']
-            ys_predict = sub_df[sub_df['forcast'] == True]['gr']
             hovert = '%{x}<br>Growth Rate - %{y:.3f}%'
             y_axis_title = 'Confirmed Cases Growth Rate'
         else:
-            sub_df = sub_df.reset_index().set_index(['Date', 'forcast'])
-            sub_df['gr'] = sub_df['deaths'].replace(
-                to_replace=0, method='ffill').pct_change()*100
-            sub_df['gr'] = sub_df['gr'].replace(np.inf, 1)
-            sub_df['gr'] = sub_df['gr'].fillna(1)
-            sub_df = sub_df.reset_index()
-            ys = sub_df[sub_df['forcast'] == False]['gr']
-            ys_predict = sub_df[sub_df['forcast'] == True]['gr']
             hovert = '%{x}<br>Death Rate - %{y:.3f}%'
             y_axis_title = 'Confirmed Deaths Growth Rate'
 
@@ -0,0 +1,225 @@
+import os
+import re
+import sys
+import hmac
+import html
+import json
+import time
+import tempfile
+import itertools
+import functools
+import threading
+import flask
+
+'''
+On-demand sampling profiler for live callbacks.
+
+With COVID_PROFILE_TOKEN set, an admin arms the profiler for the next N callback calls,
+optionally only those whose function name or output id contains a filter (POST
+/_profile/arm with token, count and callback). While an armed call runs, a sampler thread
+reads the serving thread's stack from sys._current_frames() every COVID_PROFILE_INTERVAL
+ms. Each profiled call is written to COVID_PROFILE_DIR as collapsed stacks (for
+flamegraph.pl and friends) and as speedscope json, and listed on /_profile. Calls that
+are not armed only pay for one check of a counter. Without a token none of the routes
+exist.
+
+The token is only taken from the X-Admin-Token header, a POST body or the cookie that
+posting it to /_profile sets, never from the query string, so it stays out of access
+logs, browser history and Referer headers.
+
+    curl -X POST -H 'X-Admin-Token: ...' -d count=3 -d callback=render_tab_content http://host/_profile/arm
+'''
+
+TOKEN = os.environ.get('COVID_PROFILE_TOKEN')
+PROFILE_DIR = os.environ.get('COVID_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'covid-profiles'))
+INTERVAL = float(os.environ.get('COVID_PROFILE_INTERVAL', 5)) / 1000
+COOKIE = 'profile_token'
+
+_lock = threading.Lock()
+# Calls left to profile, and the filter they must match
+_armed = {'remaining': 0, 'callback': ''}
+# Workers share PROFILE_DIR, so file names carry the pid and a sequence number
+_sequence = itertools.count()
+
+
+def arm(count, callback=''):
+    with _lock:
+        _armed['remaining'] = count
+        _armed['callback'] = callback
+
+
+def armed():
+    with _lock:
+        return dict(_armed)
+
+
+def _take(name):
+    '''Whether this call of callback `name` is profiled, using up one armed call if so'''
+    if not _armed['remaining']:
+        return False
+    with _lock:
+        if _armed['remaining'] and _armed['callback'] in name:
+            _armed['remaining'] -= 1
+            return True
+    return False
+
+
+class Sampler:
+    '''Samples the stack of one thread until stopped'''
+
+    def __init__(self, thread_id, interval=INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        # (stack of (function, file, first line) from the root, ms it stands for)
+        self.samples = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is None or self._stop.is_set():
+                break
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                frame = frame.f_back
+            self.samples.append((tuple(reversed(stack)), (now - last) * 1000))
+            last = now
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.samples
+
+
+def collapsed(samples):
+    '''"root;...;leaf count" lines, counting samples'''
+    counts = {}
+    for stack, _ in samples:
+        key = ';'.join('{} ({}:{})'.format(*frame) for frame in stack)
+        counts[key] = counts.get(key, 0) + 1
+    return ''.join('{} {}\n'.format(key, count) for key, count in sorted(counts.items()))
+
+
+def speedscope(samples, name):
+    '''A sampled profile in speedscope's file format, weighted by ms'''
+    frames = {}
+    stacks = []
+    for stack, _ in samples:
+        stacks.append([frames.setdefault(frame, len(frames)) for frame in stack])
+    weights = [ms for _, ms in samples]
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': [{'name': function, 'file': filename, 'line': line}
+                              for function, filename, line in frames]},
+        'profiles': [{'type': 'sampled', 'name': name, 'unit': 'milliseconds', 'startValue': 0,
+                      'endValue': sum(weights), 'samples': stacks, 'weights': weights}],
+        'name': name,
+        'activeProfileIndex': 0,
+        'exporter': 'covid-dashboard profiler'}
+
+
+def _write(name, samples, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stem = '{}-{}-{}-{:.0f}ms-{}'.format(time.strftime('%Y%m%d-%H%M%S'), os.getpid(), next(_sequence),
+                                         elapsed * 1000, re.sub(r'[^\w.-]', '_', name))
+    path = os.path.join(PROFILE_DIR, stem)
+    with open(path + '.collapsed', 'w') as fh:
+        fh.write(collapsed(samples))
+    with open(path + '.speedscope.json', 'w') as fh:
+        json.dump(speedscope(samples, name), fh)
+
+
+def _profiled(func, name):
+    @functools.wraps(func)
+    def profiled(*args, **kwargs):
+        if not _take(name):
+            return func(*args, **kwargs)
+        sampler = Sampler(threading.get_ident()).start()
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start
+            _write(name, sampler.stop(), elapsed)
+    return profiled
+
+
+def _authorized():
+    request = flask.request
+    given = request.headers.get('X-Admin-Token') or request.form.get('token') or request.cookies.get(COOKIE) or ''
+    return hmac.compare_digest(given.encode(), TOKEN.encode())
+
+
+def _profiles():
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    names = [n for n in os.listdir(PROFILE_DIR) if n.endswith(('.collapsed', '.speedscope.json'))]
+    return sorted(names, reverse=True)
+
+
+LOGIN = ('<html><body><h3>Profiler</h3><form method="post" action="/_profile">'
+         'Token <input name="token" type="password"> <input type="submit" value="Sign in">'
+         '</form></body></html>')
+
+
+def admin_page():
+    if not _authorized():
+        return LOGIN, 403
+    state = armed()
+    rows = ''.join('<li><a href="/_profile/files/{0}">{0}</a> ({1:,} bytes)</li>'.format(
+        html.escape(n), os.path.getsize(os.path.join(PROFILE_DIR, n))) for n in _profiles())
+    response = flask.make_response(
+        ('<html><body><h3>Profiler</h3>'
+         '<p>Armed for {} more calls matching "{}". Samples every {:g} ms, written to {}.</p>'
+         '<form method="post" action="/_profile/arm">'
+         'Calls <input name="count" value="1" size="3"> '
+         'callback filter <input name="callback" placeholder="e.g. render_tab_content"> '
+         '<input type="submit" value="Arm"></form>'
+         '<ul>{}</ul></body></html>').format(
+            state['remaining'], html.escape(state['callback']), INTERVAL * 1000, html.escape(PROFILE_DIR), rows))
+    if 'token' in flask.request.form:
+        # Signed in from the form: later links and the arm form carry the token in a cookie
+        response.set_cookie(COOKIE, flask.request.form['token'], path='/_profile', httponly=True,
+                            samesite='Strict', secure=flask.request.is_secure)
+    return response
+
+
+def arm_route():
+    if not _authorized():
+        flask.abort(403)
+    try:
+        count = int(flask.request.form.get('count', 1))
+    except ValueError:
+        flask.abort(400)
+    arm(max(count, 0), flask.request.form.get('callback', ''))
+    return flask.jsonify(armed())
+
+
+def profile_file(name):
+    if not _authorized():
+        flask.abort(403)
+    if name not in _profiles():
+        flask.abort(404)
+    return flask.send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
+
+def register(app):
+    '''Admin routes and the hook around every callback registered so far; off without a token'''
+    if not TOKEN:
+        return
+    app.server.add_url_rule('/_profile', 'profile_admin', admin_page, methods=['GET', 'POST'])
+    app.server.add_url_rule('/_profile/arm', 'profile_arm', arm_route, methods=['POST'])
+    app.server.add_url_rule('/_profile/files/<name>', 'profile_file', profile_file)
+    for output, entry in app.callback_map.items():
+        func = entry.get('callback')
+        if func is not None:
+            entry['callback'] = _profiled(func, '{} {}'.format(getattr(func, '__name__', ''), output))
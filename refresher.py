@@ -0,0 +1,176 @@
+import os
+import hashlib
+import threading
+import pandas as pd
+import callbacks
+import fetch
+import datastore
+import startup
+import snapshot
+
+'''Keeps the data snapshot (see snapshot) fresh from a background thread instead of on every page load'''
+
+# Seconds between checks of the source. Override with COVID_REFRESH_TTL
+REFRESH_TTL = float(os.environ.get('COVID_REFRESH_TTL', 600))
+# Seconds between attempts while nothing is loaded yet
+RETRY_INTERVAL = 5
+
+# Where the pickles come from: 's3' (default), 'local' for the Data/ folder,
+# store:<dir> for a columnar store written by datastore.py,
+# or any base url serving MASTER_ALL.pkl and MASTER_PID.pkl (e.g. standin_server.py)
+DATA_SOURCE = os.environ.get('COVID_DATA_SOURCE', 's3')
+
+
+class FileSource:
+    '''Gzip pickles on disk, versioned by modification time and size'''
+
+    def __init__(self, paths):
+        self.paths = paths
+
+    def version(self):
+        stats = [os.stat(self.paths[key]) for key in ('all', 'pid')]
+        return tuple((s.st_mtime_ns, s.st_size) for s in stats)
+
+    def load(self):
+        master_all = pd.read_pickle(self.paths['all'], compression='gzip')
+        master_pid = pd.read_pickle(self.paths['pid'], compression='gzip')
+        return master_all, master_pid
+
+
+class URLSource:
+    '''
+    Gzip pickles served over HTTP. version() asks for the validators (ETag,
+    Last-Modified) with HEAD requests, so an unchanged version costs no download. load()
+    revalidates the on-disk copies with conditional GETs, downloading only what changed,
+    and reads them. Without the server both use the cached copies.
+    '''
+
+    def __init__(self, urls, fetcher=None):
+        self.urls = urls
+        self.fetcher = fetcher or fetch.CachedFetcher()
+
+    def version(self):
+        results = self.fetcher.head_all(self.urls)
+        return tuple((results[key].etag, results[key].last_modified) for key in ('all', 'pid'))
+
+    def load(self):
+        results = self.fetcher.fetch_all(self.urls)
+        print('Loading {}'.format(', '.join(
+            '{} ({})'.format(r.url, r.status) for r in results.values())))
+        master_all = pd.read_pickle(results['all'].path, compression='gzip')
+        master_pid = pd.read_pickle(results['pid'].path, compression='gzip')
+        return master_all, master_pid
+
+
+class StoreSource:
+    '''Columnar store written by datastore.ingest, versioned by its manifest'''
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+
+    def version(self):
+        return datastore.read_manifest(self.store_dir)['version']
+
+    def load(self):
+        return datastore.load(self.store_dir)
+
+
+def get_source(source=DATA_SOURCE):
+    if source == 's3':
+        return URLSource(callbacks.S3_URLS)
+    if source == 'local':
+        return FileSource(callbacks.LOCAL_PATHS)
+    if source.startswith('store:'):
+        return StoreSource(source[len('store:'):])
+    base = source.rstrip('/')
+    return URLSource({'all': base + '/MASTER_ALL.pkl',
+                      'pid': base + '/MASTER_PID.pkl'})
+
+
+def version_id(version):
+    return hashlib.sha1(repr(version).encode()).hexdigest()[:12]
+
+
+class DataRefresher:
+    '''
+    Polls a source every ttl seconds and only reloads when its version changed.
+    The prepared frames are published as one snapshot by callbacks.set_data, which is
+    also held in self.current. Before loading another version it evicts older ones and
+    waits for the requests still holding them to finish (see snapshot.make_room), so at
+    most COVID_RETAINED_VERSIONS (2) are in memory counting the one it loads.
+    '''
+
+    def __init__(self, source, ttl=REFRESH_TTL):
+        self.source = source
+        self.ttl = ttl
+        self.version = None
+        self.current = None
+        self.last_error = None
+        # Phases of the latest load, and seconds from worker boot until the first one
+        self.timings = None
+        self.ready_after = None
+        self.loaded = threading.Event()
+        self._stop = threading.Event()
+        self._lock = threading.RLock()
+        self._thread = None
+
+    def check(self):
+        '''Returns True if a new version was loaded and published'''
+        with self._lock:
+            timings = startup.Phases()
+            version = self.source.version()
+            if version == self.version:
+                return False
+            snapshot.make_room()
+            if not snapshot.wait_retired():
+                print('Loading data {} while requests still hold an older version: {}'.format(
+                    version_id(version), snapshot.stats()['retired']))
+            timings.mark('version')
+            frames = self.source.load()
+            timings.mark('load')
+            data = callbacks.prepare_data(*frames)
+            timings.mark('prepare')
+            self.current = callbacks.set_data(*data, version=version_id(version))
+            timings.mark('publish')
+            self.version = version
+            self.timings = timings
+            if not self.loaded.is_set():
+                self.ready_after = startup.BOOT.elapsed()
+                self.loaded.set()
+            print('Loaded data {}: {}'.format(version_id(version), timings))
+            return True
+
+    def _run(self):
+        while not self._stop.wait(self.ttl if self.loaded.is_set() else 0):
+            try:
+                self.check()
+                self.last_error = None
+            except Exception as e:
+                # Keep serving the snapshot we have
+                self.last_error = e
+                print('Data refresh failed: {}'.format(e))
+                if not self.loaded.is_set():
+                    self._stop.wait(RETRY_INTERVAL)
+
+    def start(self, background=False):
+        '''
+        Load synchronously the first time (or in the polling thread when background),
+        then keep polling in a daemon thread. Does nothing while that thread runs, and
+        starts it again in a forked worker, which inherits the object but not the thread.
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if not background and not self.loaded.is_set():
+                self.check()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='data-refresher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas as pd
+import parallel
+
+'''
+Compact dtypes for MASTER_ALL and MASTER_PID.
+
+compact keeps only the columns the app reads, turns strings with few distinct values into
+categoricals and float64 columns into int32 or float32 when every value survives the round
+trip (same value, NaN and sign of zero), and reports the bytes per column before and after.
+The graphs read from the cube, which converts back to float64. The map reads MASTER_ALL rows
+directly, so widen turns the rows of one date back into float64 and object columns before
+they become traces, which keeps the figures byte for byte the same.
+'''
+
+# Columns a callback, the cube or the county grid reads
+MASTER_ALL_COLUMNS = ['PID', 'Date', 'forcast', 'country', 'granularity', 'confirmed', 'deaths',
+                      'confirmed_upper', 'confirmed_lower', 'deaths_upper', 'deaths_lower',
+                      'per_capita_confirmed', 'per_capita_deaths', 'lat', 'lon', 'CSize',
+                      'Text_Confirmed', 'Text_Deaths', 'label']
+MASTER_PID_COLUMNS = ['location', 'confirmed', 'Text_Confirmed']
+
+# PID is the key everything joins on and keeps its dtype
+KEEP_DTYPE = ['PID']
+
+# Strings become categoricals when at most this share of the rows are distinct values
+CATEGORY_RATIO = 0.5
+
+INT32 = np.iinfo(np.int32)
+
+
+def _same(a, b):
+    return bool(((a == b) & (np.signbit(a) == np.signbit(b)) | (np.isnan(a) & np.isnan(b))).all())
+
+
+def _compact_floats(values):
+    '''values as int32 or float32 when that is lossless, else None'''
+    if len(values) == 0:
+        return None
+    finite = np.isfinite(values)
+    if finite.all() and values.min() >= INT32.min and values.max() <= INT32.max:
+        as_int = values.astype(np.int32)
+        if _same(as_int.astype(np.float64), values):
+            return as_int
+    as_float = values.astype(np.float32)
+    if _same(as_float.astype(np.float64), values):
+        return as_float
+    return None
+
+
+def _bytes(column):
+    return int(column.memory_usage(deep=True, index=False))
+
+
+def compact(frame, columns, downcast=True):
+    '''
+    Compact frame in place and return (frame, report). Converting column by column frees
+    each original as soon as it is replaced, instead of holding two copies of the data.
+    Numeric columns are only downcast with `downcast`; the report has a row per column of
+    the input, with 0 bytes after for dropped ones.
+    '''
+    report = []
+    for name in list(frame.columns):
+        column = frame[name]
+        row = {'column': name, 'dtype_before': str(column.dtype), 'bytes_before': _bytes(column)}
+        if name not in columns:
+            del frame[name]
+            report.append(dict(row, dtype_after=None, bytes_after=0))
+            continue
+        if column.dtype == object and column.nunique(dropna=False) <= len(column) * CATEGORY_RATIO:
+            frame[name] = column.astype('category')
+        elif downcast and column.dtype == np.float64 and name not in KEEP_DTYPE:
+            values = _compact_floats(column.to_numpy())
+            if values is not None:
+                frame[name] = values
+        after = frame[name]
+        del column
+        report.append(dict(row, dtype_after=str(after.dtype),
+                           bytes_after=row['bytes_before'] if str(after.dtype) == row['dtype_before'] else _bytes(after)))
+    return frame, report
+
+
+def widen(frame):
+    '''The rows with float64 values and object strings, as the uncompacted data had them'''
+    changes = {}
+    for name, dtype in frame.dtypes.items():
+        if name in KEEP_DTYPE:
+            continue
+        if dtype in (np.int32, np.float32):
+            changes[name] = np.float64
+        elif isinstance(dtype, pd.CategoricalDtype):
+            changes[name] = object
+    return frame.astype(changes) if changes else frame
+
+
+def summarize(report):
+    return {'bytes_before': sum(r['bytes_before'] for r in report),
+            'bytes_after': sum(r['bytes_after'] for r in report),
+            'columns': report}
+
+
+def compact_frames(master_all, master_pid, workers=1):
+    '''
+    Both frames compacted in place, MASTER_ALL's hover text replaced by labels where it can
+    be built back (see labels) by `workers` processes, and the memory report of both
+    '''
+    master_all, text_report = parallel.split_text(master_all, workers)
+    master_all, all_report = compact(master_all, MASTER_ALL_COLUMNS)
+    master_pid, pid_report = compact(master_pid, MASTER_PID_COLUMNS, downcast=False)
+    return master_all, master_pid, {'all': summarize(all_report + text_report), 'pid': summarize(pid_report)}
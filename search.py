@@ -0,0 +1,58 @@
+import os
+import re
+import bisect
+import numpy as np
+
+'''
+Typeahead search over the location names of the dropdown.
+
+LocationIndex is built once per data version from the dropdown options, ranked by
+confirmed cases. Every word of a name is a key, sorted with the rank of its location, so
+the locations whose words start with a typed word are one bisect away. A query of several
+words keeps the locations matching all of them. search returns the best COVID_SEARCH_LIMIT
+of those, plus the options of the selected values, which the dropdown needs to show them.
+'''
+
+LIMIT = int(os.environ.get('COVID_SEARCH_LIMIT', 25))
+
+
+def words(text):
+    return re.findall(r'\w+', str(text).lower())
+
+
+class LocationIndex:
+    def __init__(self, options):
+        '''options: [{'label', 'value'}], the most relevant first'''
+        self.options = options
+        self.rank = {option['value']: rank for rank, option in enumerate(options)}
+        keys = sorted((word, rank) for rank, option in enumerate(options) for word in set(words(option['label'])))
+        self.words = [word for word, _ in keys]
+        self.ranks = np.array([rank for _, rank in keys], dtype=np.int64)
+
+    def _ranks(self, prefix):
+        '''Ranks of the locations with a word starting with prefix'''
+        start = bisect.bisect_left(self.words, prefix)
+        stop = bisect.bisect_left(self.words, prefix + '\uffff', lo=start)
+        return np.unique(self.ranks[start:stop])
+
+    def selected(self, values):
+        '''Options of values (a value or a list of them), in that order'''
+        if values is None:
+            return []
+        if not isinstance(values, list):
+            values = [values]
+        return [self.options[self.rank[v]] for v in values if v in self.rank]
+
+    def search(self, query, selected=None, limit=LIMIT):
+        '''The best `limit` matches of query (the top locations when it is empty) and the selected options'''
+        prefixes = words(query or '')
+        if prefixes:
+            ranks = self._ranks(prefixes[0])
+            for prefix in prefixes[1:]:
+                ranks = np.intersect1d(ranks, self._ranks(prefix), assume_unique=True)
+            ranks = ranks[:limit].tolist()
+        else:
+            ranks = range(min(limit, len(self.options)))
+        options = [self.options[rank] for rank in ranks]
+        shown = set(ranks)
+        return options + [option for option in self.selected(selected) if self.rank[option['value']] not in shown]
@@ -0,0 +1,174 @@
+import os
+import abc
+import time
+import sqlite3
+import hashlib
+import threading
+import lru
+
+'''
+Cache for rendered callback outputs (serialized figures and tables).
+
+A backend stores bytes under string keys that start with the data version, with a TTL, and
+evicts least recently used entries to stay under a size budget. MemoryBackend keeps them in
+the process, one cache per gunicorn worker. SQLiteBackend keeps them in a SQLite file that
+every worker on the machine opens, so an output rendered by one worker is a hit for all of
+them. Another store (e.g. a Redis server) only needs the methods of CacheBackend.
+
+When a worker loads new data it drops the entries of the versions it no longer retains from
+its memory backend. The SQLite file is shared with workers that may still retain them, so
+there old versions only go by TTL and size, like any entry nobody asks for.
+
+    COVID_OUTPUT_CACHE        memory (default) or sqlite:<path>
+    COVID_OUTPUT_CACHE_BYTES  size budget (default 64MB)
+    COVID_OUTPUT_CACHE_SIZE   entries kept by the memory backend (default 256)
+    COVID_OUTPUT_CACHE_TTL    seconds an entry lives (default 3600)
+'''
+
+OUTPUT_CACHE = os.environ.get('COVID_OUTPUT_CACHE', 'memory')
+MAXBYTES = int(os.environ.get('COVID_OUTPUT_CACHE_BYTES', 64 * 2 ** 20))
+MAXSIZE = int(os.environ.get('COVID_OUTPUT_CACHE_SIZE', 256))
+TTL = float(os.environ.get('COVID_OUTPUT_CACHE_TTL', 3600))
+
+
+def make_key(version, *parts):
+    return '{}:{}'.format(version, hashlib.sha1(repr(parts).encode('utf-8')).hexdigest())
+
+
+class CacheBackend(abc.ABC):
+    @abc.abstractmethod
+    def get(self, key):
+        '''The bytes stored under key, None when missing or expired'''
+
+    @abc.abstractmethod
+    def set(self, key, value, version=None):
+        pass
+
+    @abc.abstractmethod
+    def retain(self, versions):
+        '''This process only serves the data versions in versions now'''
+
+    @abc.abstractmethod
+    def clear(self):
+        '''This process can't tell the entries of its earlier data from the new one'''
+
+    @abc.abstractmethod
+    def stats(self):
+        pass
+
+
+class MemoryBackend(CacheBackend):
+    def __init__(self, maxsize=MAXSIZE, maxbytes=MAXBYTES, ttl=TTL):
+        self.ttl = ttl
+        # entries are (value, version, expires)
+        self._cache = lru.LRUCache(maxsize=maxsize, maxbytes=maxbytes, sizeof=lambda entry: len(entry[0]))
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None or entry[2] < time.time():
+            return None
+        return entry[0]
+
+    def set(self, key, value, version=None):
+        self._cache.put(key, (value, version, time.time() + self.ttl))
+
+    def retain(self, versions):
+        versions = set(versions)
+        self._cache.retain(lambda key, entry: entry[1] in versions)
+
+    def clear(self):
+        self._cache.clear()
+
+    def stats(self):
+        return dict(self._cache.stats(), backend='memory')
+
+
+class SQLiteBackend(CacheBackend):
+    def __init__(self, path, maxbytes=MAXBYTES, ttl=TTL):
+        self.path = path
+        self.maxbytes = maxbytes
+        self.ttl = ttl
+        # Counters are for this process
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._local = threading.local()
+        db = self._db()
+        db.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, version TEXT, '
+                   'value BLOB, size INTEGER, expires REAL, used REAL)')
+        db.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+
+    def _db(self):
+        # One connection per thread, and new ones after a fork
+        if getattr(self._local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return self._local.db
+
+    def get(self, key):
+        db = self._db()
+        now = time.time()
+        row = db.execute('SELECT value, expires, used FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None or row[1] < now:
+            self.misses += 1
+            return None
+        # Recency only needs to be roughly right, don't write on every hit
+        if now - row[2] > 1:
+            db.execute('UPDATE entries SET used = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return bytes(row[0])
+
+    def set(self, key, value, version=None):
+        db = self._db()
+        now = time.time()
+        db.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)',
+                   (key, str(version), sqlite3.Binary(value), len(value), now + self.ttl, now))
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total > self.maxbytes:
+            self._evict(db, total, now)
+
+    def _evict(self, db, total, now):
+        freed = db.execute('SELECT COALESCE(SUM(size), 0) FROM entries WHERE expires < ?', (now,)).fetchone()[0]
+        db.execute('DELETE FROM entries WHERE expires < ?', (now,))
+        total -= freed
+        victims = []
+        # Down to 90% so the next few sets don't evict again
+        for key, size in db.execute('SELECT key, size FROM entries ORDER BY used'):
+            if total <= self.maxbytes * 0.9:
+                break
+            victims.append((key,))
+            total -= size
+        db.executemany('DELETE FROM entries WHERE key = ?', victims)
+        self.evictions += len(victims)
+
+    def retain(self, versions):
+        # Other workers may still serve the versions this one evicted, only drop what expired
+        self._db().execute('DELETE FROM entries WHERE expires < ?', (time.time(),))
+
+    def clear(self):
+        # Unversioned entries can't be told apart between loads, whichever worker wrote them
+        self._db().execute('DELETE FROM entries WHERE version = ?', (str(None),))
+
+    def stats(self):
+        size, total = self._db().execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        requests = self.hits + self.misses
+        return {'backend': 'sqlite',
+                'path': self.path,
+                'size': size,
+                'bytes': total,
+                'maxbytes': self.maxbytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / requests if requests else 0.0}
+
+
+def get_backend(spec=OUTPUT_CACHE):
+    if spec.startswith('sqlite:'):
+        return SQLiteBackend(spec[len('sqlite:'):])
+    if spec == 'memory':
+        return MemoryBackend()
+    raise ValueError('Unknown COVID_OUTPUT_CACHE {!r}'.format(spec))
@@ -0,0 +1,197 @@
+import os
+import threading
+from collections import OrderedDict
+import flask
+
+'''
+The loaded data as one immutable snapshot per version, swapped in atomically.
+
+A DataSnapshot holds every table of a version and what is built from them (the cube, the
+county grid, the summary, the table and the search index) with its version id, and is not
+changed once built. publish() makes it the current one with a single reference swap, so a
+reader gets either the old or the new version as a whole, never a mix.
+
+The last COVID_RETAINED_VERSIONS versions (2, the current one included) stay loaded, least
+recently used first out, so a page keeps the dates and positions it was loaded with after
+a refresh: the page records its version and get(version) returns that snapshot while it is
+retained, and the current one after that.
+
+Code serving a request takes its snapshot once with get(): the first call of a request
+pins the snapshot and every later call of that request returns the same one until the
+request ends, even if a refresh publishes another in between. Outside of a request get()
+does not pin.
+
+An evicted snapshot is retired and only referenced by the requests still holding it, so
+it is freed when the last of them ends. Before the refresher loads the next version,
+make_room() evicts the least recently used versions but the current one until the retained,
+the retired and the one being loaded come to COVID_RETAINED_VERSIONS, and wait_retired()
+waits for the retired ones to be freed. So with the default of 2 the current and the next
+version are the only ones in memory during a refresh, and the two stay retained after it.
+The current version is never evicted early, so with 1 there are still two while loading.
+'''
+
+RETAIN = max(int(os.environ.get('COVID_RETAINED_VERSIONS', 2)), 1)
+
+# Seconds the refresher waits for requests holding a retired version before loading anyway
+DRAIN_TIMEOUT = float(os.environ.get('COVID_SNAPSHOT_DRAIN_TIMEOUT', 30))
+
+_lock = threading.Lock()
+_drained = threading.Condition(_lock)
+_current = None
+# Retained snapshots by version, least recently used first
+_versions = OrderedDict()
+# Requests holding each snapshot in use, by id
+_holders = {}
+# Evicted snapshots still held by requests
+_retired = []
+
+
+class DataSnapshot:
+    '''Every table of one data version and the indexes built from them. Read only.'''
+
+    def __init__(self, version, master_all, master_pid, date_mapper, key_value, cube,
+                 county_grid, summary, table, search, memory_report=None):
+        self.version = version
+        self.master_all = master_all
+        self.master_pid = master_pid
+        self.date_mapper = date_mapper
+        self.key_value = key_value
+        self.cube = cube
+        self.county_grid = county_grid
+        self.summary = summary
+        self.table = table
+        self.search = search
+        self.memory_report = memory_report
+        self._frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('DataSnapshot {} is read only'.format(self.version))
+        object.__setattr__(self, name, value)
+
+    def __repr__(self):
+        return '<DataSnapshot {}>'.format(self.version)
+
+
+def current():
+    '''The latest published snapshot, None before the first load'''
+    return _current
+
+
+def _retire(snapshot):
+    if _holders.get(id(snapshot)):
+        _retired.append(snapshot)
+
+
+def publish(snapshot):
+    '''
+    Make snapshot the current one and evict the least recently used beyond RETAIN.
+    Returns the versions retained.
+    '''
+    global _current
+    with _lock:
+        replaced = _versions.pop(snapshot.version, None)
+        if replaced is not None and replaced is not snapshot:
+            _retire(replaced)
+        _current = snapshot
+        _versions[snapshot.version] = snapshot
+        while len(_versions) > RETAIN:
+            _retire(_versions.popitem(last=False)[1])
+        return list(_versions)
+
+
+def make_room():
+    '''
+    Evict retained versions other than the current one, least recently used first, until
+    one more fits within RETAIN, counting the retired ones. Returns the versions evicted.
+    '''
+    evicted = []
+    with _lock:
+        for version, snapshot in list(_versions.items()):
+            if len(_versions) + len(_retired) < RETAIN:
+                break
+            if snapshot is not _current:
+                del _versions[version]
+                _retire(snapshot)
+                evicted.append(version)
+    return evicted
+
+
+def _lookup(version):
+    if version is not None and version in _versions:
+        _versions.move_to_end(version)
+        return _versions[version]
+    return _current
+
+
+def find(version=None):
+    '''The retained snapshot of version, the current one when it is None or evicted'''
+    with _lock:
+        return _lookup(version)
+
+
+def versions():
+    with _lock:
+        return list(_versions)
+
+
+def acquire(version=None):
+    '''find(version), held until release()'''
+    with _lock:
+        snapshot = _lookup(version)
+        if snapshot is not None:
+            _holders[id(snapshot)] = _holders.get(id(snapshot), 0) + 1
+        return snapshot
+
+
+def release(snapshot):
+    with _lock:
+        holders = _holders[id(snapshot)] - 1
+        if holders:
+            _holders[id(snapshot)] = holders
+            return
+        del _holders[id(snapshot)]
+        if snapshot in _retired:
+            _retired.remove(snapshot)
+            _drained.notify_all()
+
+
+def wait_retired(timeout=DRAIN_TIMEOUT):
+    '''Wait until no request holds a retired snapshot. False if some still do after timeout.'''
+    with _drained:
+        return _drained.wait_for(lambda: not _retired, timeout)
+
+
+def get(version=None):
+    '''
+    The snapshot of the running request: find(version) pinned on the first call, the same
+    one after that. Compare its version with the one asked for to tell a fallback.
+    '''
+    if not flask.has_request_context():
+        return find(version)
+    snapshot = flask.g.get('data_snapshot')
+    if snapshot is None:
+        snapshot = acquire(version)
+        if snapshot is not None:
+            flask.g.data_snapshot = snapshot
+    return snapshot
+
+
+def _release_request(exc=None):
+    snapshot = flask.g.pop('data_snapshot', None)
+    if snapshot is not None:
+        release(snapshot)
+
+
+def stats():
+    '''Requests in flight on the retained (least recently used first) and the retired snapshots'''
+    with _lock:
+        return {'current': None if _current is None else _current.version,
+                'retain': RETAIN,
+                'retained': [{'version': s.version, 'requests': _holders.get(id(s), 0)} for s in _versions.values()],
+                'retired': [{'version': s.version, 'requests': _holders.get(id(s), 0)} for s in _retired]}
+
+
+def register(server):
+    '''Release each request's snapshot when it ends'''
+    server.teardown_request(_release_request)
@@ -0,0 +1,150 @@
+import math
+import numpy as np
+
+'''
+Viewport culling for the map.
+
+Viewport reads the visible lon/lat box from the map's relayoutData (mapbox._derived when
+plotly.js sends it, else estimated from center and zoom), padded by MARGIN of its size on
+every side so small pans are still covered by what was sent. GridIndex buckets the points
+of one map trace into CELL_DEG cells so a viewport query only looks at the cells it
+overlaps; cull applies it to cached map traces.
+'''
+
+# Assumed size of the map in pixels when plotly.js does not send the corners
+VIEW_PX = (1400, 900)
+MARGIN = 0.5
+CELL_DEG = 5
+
+
+def _mercator_y(lat):
+    lat = max(min(lat, 85.0511), -85.0511)
+    return math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+
+
+def _mercator_lat(y):
+    return math.degrees(2 * math.atan(math.exp(y)) - math.pi / 2)
+
+
+class Viewport:
+    def __init__(self, west, south, east, north):
+        self.west = west
+        self.south = south
+        self.east = east
+        self.north = north
+
+    @classmethod
+    def from_relayout(cls, relayout):
+        '''The visible box, or None when relayoutData says nothing about it'''
+        if not relayout:
+            return None
+        derived = relayout.get('mapbox._derived')
+        if derived and derived.get('coordinates'):
+            lons = [c[0] for c in derived['coordinates']]
+            lats = [c[1] for c in derived['coordinates']]
+            return cls(min(lons), min(lats), max(lons), max(lats))
+        if 'mapbox.center' not in relayout or 'mapbox.zoom' not in relayout:
+            return None
+        center = relayout['mapbox.center']
+        world_px = 512 * 2 ** relayout['mapbox.zoom']
+        half_lon = VIEW_PX[0] / 2 * 360 / world_px
+        half_y = VIEW_PX[1] / 2 * 2 * math.pi / world_px
+        y = _mercator_y(center['lat'])
+        return cls(center['lon'] - half_lon, _mercator_lat(y - half_y),
+                   center['lon'] + half_lon, _mercator_lat(y + half_y))
+
+    @classmethod
+    def from_list(cls, bounds):
+        return cls(*bounds) if bounds else None
+
+    def to_list(self):
+        return [self.west, self.south, self.east, self.north]
+
+    @property
+    def whole_world(self):
+        return self.east - self.west >= 360 and self.south <= -90 and self.north >= 90
+
+    def padded(self, margin=MARGIN):
+        width = self.east - self.west
+        height = self.north - self.south
+        return Viewport(self.west - width * margin, max(self.south - height * margin, -90),
+                        self.east + width * margin, min(self.north + height * margin, 90))
+
+    def covers(self, other):
+        if other is None:
+            return self.whole_world
+        if other.south < self.south or other.north > self.north:
+            return False
+        width = self.east - self.west
+        if width >= 360:
+            return True
+        return (other.west - self.west) % 360 + (other.east - other.west) <= width
+
+    def contains(self, lat, lon):
+        '''Boolean mask of the points inside, across the antimeridian too'''
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        inside = (lat >= self.south) & (lat <= self.north)
+        if self.east - self.west < 360:
+            inside &= (lon - self.west) % 360 <= self.east - self.west
+        return inside
+
+
+class GridIndex:
+    def __init__(self, lat, lon, cell=CELL_DEG):
+        self.cell = cell
+        self.lat = np.asarray(lat, dtype=float)
+        self.lon = np.asarray(lon, dtype=float)
+        self.n_cols = int(math.ceil(360 / cell))
+        self.n_rows = int(math.ceil(180 / cell))
+        buckets = self._bucket(self.lat, self.lon)
+        self.order = np.argsort(buckets, kind='mergesort')
+        self.starts = np.searchsorted(buckets[self.order], np.arange(self.n_rows * self.n_cols + 1))
+
+    def _bucket(self, lat, lon):
+        rows = np.clip(np.floor((lat + 90) / self.cell), 0, self.n_rows - 1).astype(np.int64)
+        cols = np.floor(((lon + 180) % 360) / self.cell).astype(np.int64) % self.n_cols
+        return rows * self.n_cols + cols
+
+    def query(self, viewport):
+        '''Sorted positions of the points inside viewport'''
+        if viewport.whole_world:
+            return np.arange(len(self.lat))
+        row_min = int(np.clip(math.floor((viewport.south + 90) / self.cell), 0, self.n_rows - 1))
+        row_max = int(np.clip(math.floor((viewport.north + 90) / self.cell), 0, self.n_rows - 1))
+        width = viewport.east - viewport.west
+        if width >= 360:
+            cols = np.arange(self.n_cols)
+        else:
+            first = math.floor(((viewport.west + 180) % 360) / self.cell)
+            cols = np.arange(first, first + int(math.ceil(width / self.cell)) + 1) % self.n_cols
+            cols = np.unique(cols)
+        candidates = [self.order[self.starts[b]:self.starts[b + 1]]
+                      for r in range(row_min, row_max + 1) for b in r * self.n_cols + cols]
+        if not candidates:
+            return np.arange(0)
+        candidates = np.concatenate(candidates)
+        inside = viewport.contains(self.lat[candidates], self.lon[candidates])
+        return np.sort(candidates[inside])
+
+
+def cull(traces, indexes, viewport):
+    '''
+    The traces with only the points inside viewport. Color range and sizeref stay those
+    of the whole map so markers keep their look while panning.
+    '''
+    if viewport is None or viewport.whole_world:
+        return traces
+    culled = []
+    for trace, index in zip(traces, indexes):
+        if index is None:
+            culled.append(trace)
+            continue
+        keep = index.query(viewport)
+        marker = dict(trace['marker'])
+        for key in ('size', 'color'):
+            marker[key] = np.asarray(marker[key])[keep]
+        culled.append(dict(trace, lon=np.asarray(trace['lon'])[keep], lat=np.asarray(trace['lat'])[keep],
+                           customdata=np.asarray(trace['customdata'])[keep],
+                           text=np.asarray(trace['text'])[keep], marker=marker))
+    return culled
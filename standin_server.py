@@ -0,0 +1,107 @@
+import os
+import sys
+import time
+import hashlib
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+'''
+A tiny stand-in for the S3 bucket so the fetch and refresh paths can be exercised offline.
+Serves the files of one directory with ETag/Last-Modified, answers conditional requests
+with 304 and can be told to fail or stall.
+
+    python standin_server.py Data 8000
+    COVID_DATA_SOURCE=http://localhost:8000 python application.py
+'''
+
+
+def _etag(path):
+    stat = os.stat(path)
+    return '"{}"'.format(hashlib.md5('{}-{}'.format(stat.st_mtime_ns, stat.st_size).encode()).hexdigest())
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _send(self, include_body):
+        server = self.server
+        server.requests.append((self.command, self.path))
+        if server.delay:
+            time.sleep(server.delay)
+        if server.fail:
+            self.send_error(503)
+            return
+        path = os.path.join(server.directory, os.path.basename(self.path.split('?')[0]))
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        etag = _etag(path)
+        mtime = int(os.stat(path).st_mtime)
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        since = self.headers.get('If-Modified-Since')
+        if since and 'If-None-Match' not in self.headers:
+            try:
+                if mtime <= parsedate_to_datetime(since).timestamp():
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+            except (TypeError, ValueError):
+                pass
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(os.path.getsize(path)))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', formatdate(mtime, usegmt=True))
+        self.end_headers()
+        if include_body:
+            with open(path, 'rb') as fh:
+                self.wfile.write(fh.read())
+
+    def do_GET(self):
+        self._send(True)
+
+    def do_HEAD(self):
+        self._send(False)
+
+
+class StandInServer(ThreadingHTTPServer):
+    '''Set .fail to answer 503, .delay to stall every request; .requests records what was asked'''
+
+    daemon_threads = True
+
+    def __init__(self, directory, port=0, verbose=False):
+        ThreadingHTTPServer.__init__(self, ('127.0.0.1', port), StandInHandler)
+        self.directory = directory
+        self.verbose = verbose
+        self.fail = False
+        self.delay = 0
+        self.requests = []
+        self._thread = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+if __name__ == '__main__':
+    directory = sys.argv[1] if len(sys.argv) > 1 else 'Data'
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 8000
+    server = StandInServer(directory, port, verbose=True)
+    print('Serving {} on {}'.format(directory, server.url))
+    server.serve_forever()
@@ -0,0 +1,41 @@
+import os
+import time
+
+'''
+Startup phases of a worker and the background load mode.
+
+With COVID_BACKGROUND_LOAD=1 a worker answers requests as soon as the app is built and
+loads the data in a thread, instead of on the first page view. Page loads wait up to
+COVID_READY_TIMEOUT seconds for it. /healthz says the worker is up, /readyz whether the
+data is loaded (503 until then), each with the time spent in every phase so far.
+'''
+
+BACKGROUND = os.environ.get('COVID_BACKGROUND_LOAD', '0') == '1'
+READY_TIMEOUT = float(os.environ.get('COVID_READY_TIMEOUT', 30))
+
+
+class Phases:
+    '''Seconds between consecutive marks, named by the mark that ends them'''
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self._last = self.started
+
+    def mark(self, name):
+        now = time.perf_counter()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def as_list(self):
+        return [{'phase': name, 'seconds': round(seconds, 4)} for name, seconds in self.phases]
+
+    def __str__(self):
+        return ', '.join('{} {:.2f}s'.format(name, seconds) for name, seconds in self.phases)
+
+
+# From the moment application starts importing
+BOOT = Phases()
@@ -0,0 +1,143 @@
+import collections
+import numpy as np
+from derived import previous, take, pct_change
+
+'''
+Summary card and comparison table numbers for every PID, computed once per data version
+from the cube and its derived series (see derived).
+
+The cards compare a location's last reported date with the one before it and with the
+first forecasted date, on the dates MASTER_ALL has for that location. Summary works that
+out for all rows of the cube at once with a "previous present column" index, so it gives
+the same numbers as the diff()/pct_change() over the worldwide rows the cards used to do.
+Table does the same for the columns of the comparison table.
+'''
+
+Card = collections.namedtuple('Card', [
+    'total_confirmed', 'change_confirmed', 'forecast_confirmed',
+    'total_deaths', 'change_deaths', 'forecast_deaths',
+    'mortality_rate', 'mortality_change', 'mortality_forecast_change',
+    'growth_rate', 'growth_change', 'growth_forecast_change',
+    'per_capita', 'per_capita_yesterday', 'per_capita_forecast'])
+
+
+class Summary:
+    def __init__(self, metric_cube):
+        self.row = metric_cube.row
+        present = metric_cube.present
+        observed = present & ~metric_cube.forcast[None, :]
+        forecast = present & metric_cube.forcast[None, :]
+        n_dates = present.shape[1]
+        before = previous(present)
+
+        # Last reported, the reported date before it and first forecasted column per row
+        last = np.where(observed.any(axis=1), n_dates - 1 - np.argmax(observed[:, ::-1], axis=1), -1)
+        before_last = np.take_along_axis(before, np.maximum(last, 0)[:, None], axis=1)[:, 0]
+        before_last[last < 0] = -1
+        first_forecast = np.where(forecast.any(axis=1), np.argmax(forecast, axis=1), -1)
+
+        confirmed = metric_cube.metrics['confirmed']
+        deaths = metric_cube.metrics['deaths']
+        per_capita = metric_cube.metrics['per_capita_confirmed']
+        diff_confirmed = metric_cube.metrics['new_confirmed']
+        diff_deaths = metric_cube.metrics['new_deaths']
+        growth = pct_change(confirmed, present, before) * 100
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mortality = deaths / confirmed * 100
+            diff_growth = growth - take(growth, before)
+
+        self.values = {
+            'total_confirmed': np.nansum(np.where(observed, diff_confirmed, np.nan), axis=1),
+            'change_confirmed': take(diff_confirmed, last),
+            'forecast_confirmed': take(diff_confirmed, first_forecast),
+            'total_deaths': np.nansum(np.where(observed, diff_deaths, np.nan), axis=1),
+            'change_deaths': take(diff_deaths, last),
+            'forecast_deaths': take(diff_deaths, first_forecast),
+            'mortality_rate': take(mortality, last),
+            'mortality_change': take(mortality, last) - take(mortality, before_last),
+            'mortality_forecast_change': take(mortality, last) - take(mortality, first_forecast),
+            'growth_rate': take(growth, last),
+            'growth_change': take(diff_growth, last),
+            'growth_forecast_change': take(diff_growth, first_forecast),
+            'per_capita': take(per_capita, last),
+            'per_capita_yesterday': take(per_capita, before_last),
+            'per_capita_forecast': take(per_capita, first_forecast)}
+        for values in self.values.values():
+            values.flags.writeable = False
+
+        worldwide = []
+        if metric_cube.countries is not None:
+            worldwide = np.flatnonzero(metric_cube.countries == 'worldwide')
+        self.worldwide = self._card(worldwide[0]) if len(worldwide) else None
+
+    def _card(self, row):
+        # numpy scalars, so round() in the card builders rounds the way it did on pandas values
+        return Card(*(self.values[field][row] for field in Card._fields))
+
+    def card(self, pid):
+        return self._card(self.row[pid])
+
+
+class Table:
+    '''
+    Per metric ('confirmed' and 'deaths') and PID, the raw numbers of the comparison table
+    on the last reported date: current value, new since the previous record, forecasted
+    increase for the next day and summed over the last reported date and the 7 days after
+    it, per capita value, and growth rate today and 7 days out. NaN where the old table
+    would have found no record.
+    '''
+
+    def __init__(self, metric_cube):
+        self.row = metric_cube.row
+        self.labels = metric_cube.labels
+        self.last_date = metric_cube.forcast_date
+        present = metric_cube.present
+        before = previous(present)
+        dates = metric_cube.dates
+        last = metric_cube.forecast_col - 1
+
+        def column(date):
+            col = dates.searchsorted(date)
+            return col if col < len(dates) and dates[col] == date else None
+
+        tomorrow = column(self.last_date + np.timedelta64(1, 'D'))
+        seven = column(self.last_date + np.timedelta64(7, 'D'))
+        week_end = dates.searchsorted(self.last_date + np.timedelta64(7, 'D'), side='right')
+
+        self.columns = {}
+        for metric in ('confirmed', 'deaths'):
+            values = metric_cube.metrics[metric]
+            per_capita = metric_cube.metrics['per_capita_{}'.format(metric)]
+            diff = metric_cube.metrics['new_{}'.format(metric)]
+            growth = pct_change(values, present, before)
+
+            def at(array, col):
+                if col is None:
+                    return np.full(len(array), np.nan)
+                return np.where(present[:, col], array[:, col], np.nan)
+
+            # Series.sum() over the records in the week: NaN counts as 0, absent dates are skipped
+            week = np.where(np.isnan(diff[:, last:week_end]), 0, diff[:, last:week_end])
+            week_present = present[:, last:week_end]
+            week_sum = week.sum(axis=1)
+            for row in np.flatnonzero(~week_present.all(axis=1)):
+                week_sum[row] = week[row][week_present[row]].sum()
+
+            self.columns[metric] = {
+                'current': at(values, last),
+                'new': at(diff, last),
+                'tomorrow': at(diff, tomorrow),
+                'seven_days': week_sum,
+                'per_capita': at(per_capita, last),
+                'growth_rate': at(growth, last),
+                'growth_rate_seven': at(growth, seven)}
+            for array in self.columns[metric].values():
+                array.flags.writeable = False
+
+    def rows(self, pids, metric):
+        '''The numbers for each of pids, as dicts of numpy scalars plus the location label'''
+        index = [self.row[pid] for pid in pids]
+        columns = {name: array[index] for name, array in self.columns[metric].items()}
+        labels = self.labels[index]
+        return [dict({name: values[i] for name, values in columns.items()}, label=labels[i])
+                for i in range(len(index))]
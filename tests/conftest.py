@@ -0,0 +1,31 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from standin_server import StandInServer  # noqa: E402
+
+
+@pytest.fixture
+def standin(tmp_path):
+    '''A StandInServer serving tmp_path/served'''
+    directory = tmp_path / 'served'
+    directory.mkdir()
+    server = StandInServer(str(directory))
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture(scope='session')
+def application():
+    '''The application module, imported from the repo root like gunicorn does. Loads no data.'''
+    cwd = os.getcwd()
+    os.chdir(ROOT)
+    try:
+        import application
+    finally:
+        os.chdir(cwd)
+    return application
@@ -0,0 +1,54 @@
+import os
+import pytest
+import animation
+import callbacks
+import refresher
+import snapshot
+from benchmarks import synthetic
+
+
+@pytest.fixture(scope='module')
+def client(application, tmp_path_factory):
+    '''A test client of the app serving synthetic pickles, and the data version it serves'''
+    directory = str(tmp_path_factory.mktemp('data'))
+    synthetic.write_pickles(directory, n_pids=40, n_days=10)
+    data_refresher = application.data_refresher
+    data_refresher.source = refresher.FileSource({'all': os.path.join(directory, 'MASTER_ALL.pkl'),
+                                                  'pid': os.path.join(directory, 'MASTER_PID.pkl')})
+    data_refresher.check()
+    yield application.application.test_client(), snapshot.current().version
+    data_refresher.stop()
+
+
+@pytest.mark.parametrize('inputs', [
+    (['country'], ['confirmed'], []),
+    (['county', 'country', 'province', 'state'], ['deaths', 'confirmed'], ['relative']),
+    ([], [], [])])
+def test_parse_view_round_trips(inputs):
+    view = animation.view_key(*inputs)
+    assert animation.view_key(*animation.parse_view(view)) == view
+
+
+@pytest.mark.parametrize('view', [
+    'foo', 'country_confirmed', 'country_confirmed_total_x', 'country_confirmed_absolute',
+    'city_confirmed_total', 'country_recovered_total', 'county-country_confirmed_total',
+    'country-country_confirmed_total', 'country_deaths-confirmed_total', '_confirmed_total',
+    'none-country_confirmed_total'])
+def test_parse_view_rejects(view):
+    with pytest.raises(ValueError):
+        animation.parse_view(view)
+
+
+def test_unknown_views_are_not_found(client):
+    client, version = client
+    for view in ('foo', 'county-country_confirmed_total', 'city_confirmed_total'):
+        assert client.get('/_map-frames/{}/{}.json'.format(version, view)).status_code == 404
+
+
+def test_frames_leave_the_map_cache_alone(client):
+    client, version = client
+    callbacks.MAP_CACHE.clear()
+    response = client.get('/_map-frames/{}/country_confirmed_total.json'.format(version))
+    assert response.status_code == 200
+    assert len(response.get_json()['dates']) == 10 + 14
+    assert callbacks.MAP_CACHE.stats()['size'] == 0
@@ -0,0 +1,15 @@
+import sys
+import subprocess
+from conftest import ROOT
+
+
+def test_import():
+    '''`import application` in a fresh interpreter, the way gunicorn and the benchmarks start it'''
+    done = subprocess.run([sys.executable, '-c', 'import application'], cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert done.returncode == 0, done.stderr
+
+
+def test_app_is_built(application):
+    assert application.application is application.app.server
+    assert '/metrics' in {rule.rule for rule in application.application.url_map.iter_rules()}
@@ -0,0 +1,95 @@
+import os
+from datetime import timedelta
+import numpy as np
+import pytest
+import callbacks
+import datastore
+import derived
+from benchmarks import synthetic
+
+# PIDs whose trailing week is checked against the slow per date .loc loop
+WEEK_PIDS = 25
+
+
+def perturb(master_all, seed=1):
+    '''Drop 2% of the records, blank 1% of the counts and zero another 1%'''
+    rng = np.random.RandomState(seed)
+    keep = rng.uniform(size=len(master_all)) > 0.02
+    keep[master_all['PID'].to_numpy() == 0] = True
+    master_all = master_all[keep].reset_index(drop=True)
+    for metric in ('confirmed', 'deaths'):
+        values = master_all[metric].to_numpy(dtype=float).copy()
+        draw = rng.uniform(size=len(values))
+        values[draw < 0.01] = np.nan
+        values[(draw >= 0.01) & (draw < 0.02)] = 0
+        master_all[metric] = values
+    return master_all
+
+
+def reference_new(sub_df, metric):
+    '''per_day_confirmed before derived, without the fillna(0) it applied after'''
+    return sub_df.set_index('Date')[[metric]].diff()[metric].to_numpy()
+
+
+def reference_growth(sub_df, metric):
+    '''per_gr before derived'''
+    sub_df = sub_df.reset_index().set_index(['Date', 'forcast'])
+    gr = sub_df[metric].replace(to_replace=0, method='ffill').pct_change() * 100
+    return gr.replace(np.inf, 1).fillna(1).to_numpy()
+
+
+def reference_week(sub_df, backtrack=7):
+    '''The y of plot_exponential before derived, for every record after the first'''
+    full_report = sub_df.set_index(['Date', 'forcast'])[['confirmed', 'deaths']]
+    plottable = full_report.join(full_report.diff(), lsuffix='_cum', rsuffix='_diff')
+    plottable = plottable.fillna(0).reset_index().set_index('Date')
+    indexes = plottable.index
+    ys = []
+    for indexer in range(1, len(indexes)):
+        date = indexes[indexer]
+        if indexer > backtrack:
+            ys.append(plottable.loc[date - timedelta(days=backtrack): date].sum()['confirmed_diff'])
+        else:
+            ys.append(plottable.loc[: indexes[indexer]].sum()['confirmed_diff'])
+    return np.array(ys)
+
+
+def same(a, b):
+    a = np.asarray(a, dtype=float)
+    b = np.asarray(b, dtype=float)
+    return a.shape == b.shape and np.array_equal(np.isnan(a), np.isnan(b)) and \
+        np.array_equal(a[~np.isnan(a)], b[~np.isnan(b)])
+
+
+@pytest.fixture(scope='module')
+def master_all():
+    master_all, _ = synthetic.make_frames(n_pids=120, n_days=60)
+    return perturb(master_all)
+
+
+@pytest.fixture(scope='module', params=['frames', 'store', 'store-2-workers'])
+def metric_cube(request, master_all, tmp_path_factory):
+    '''The cube with its derived series as the server loads it from pickles or from a store'''
+    _, master_pid = synthetic.make_frames(n_pids=120, n_days=60)
+    if request.param == 'frames':
+        return callbacks.prepare_data(master_all.copy(), master_pid)[4]
+    store = os.path.join(str(tmp_path_factory.mktemp('store')), 'store')
+    datastore.ingest(master_all.copy(), master_pid, store, workers=2 if request.param == 'store-2-workers' else 1)
+    return datastore.load(store)[2]
+
+
+def test_new_and_growth(master_all, metric_cube):
+    assert len(metric_cube.pids) == master_all['PID'].nunique()
+    for pid, sub_df in master_all.groupby('PID', sort=False):
+        for metric in derived.METRICS:
+            found = metric_cube.frame(pid, ['new_' + metric, 'growth_' + metric])
+            assert same(reference_new(sub_df, metric), found['new_' + metric]), (pid, metric)
+            assert same(reference_growth(sub_df, metric), found['growth_' + metric]), (pid, metric)
+
+
+def test_week(master_all, metric_cube):
+    pids = master_all['PID'].unique()[:WEEK_PIDS]
+    for pid in pids:
+        sub_df = master_all[master_all['PID'] == pid]
+        found = metric_cube.frame(pid, ['week_confirmed'])['week_confirmed'].to_numpy()[1:]
+        assert same(reference_week(sub_df), found), pid
@@ -0,0 +1,98 @@
+import os
+from urllib.error import HTTPError
+import pytest
+import fetch
+
+
+def fetcher(tmp_path, **kwargs):
+    kwargs.setdefault('retries', 2)
+    kwargs.setdefault('backoff', 0)
+    return fetch.CachedFetcher(cache_dir=str(tmp_path / 'cache'), **kwargs)
+
+
+def serve(standin, name, data):
+    with open(os.path.join(standin.directory, name), 'wb') as fh:
+        fh.write(data)
+    return standin.url + '/' + name
+
+
+def read(path):
+    with open(path, 'rb') as fh:
+        return fh.read()
+
+
+def test_download_then_not_modified(tmp_path, standin):
+    url = serve(standin, 'a.pkl', b'first')
+    client = fetcher(tmp_path)
+    result = client.fetch(url)
+    assert result.status == 'downloaded'
+    assert read(result.path) == b'first'
+    assert result.etag
+
+    again = client.fetch(url)
+    assert again.status == 'not_modified'
+    assert again.path == result.path and again.etag == result.etag
+    assert read(again.path) == b'first'
+
+
+def test_changed_file_is_downloaded_again(tmp_path, standin):
+    url = serve(standin, 'a.pkl', b'first')
+    client = fetcher(tmp_path)
+    client.fetch(url)
+    path = os.path.join(standin.directory, 'a.pkl')
+    serve(standin, 'a.pkl', b'second!')
+    os.utime(path, ns=(os.stat(path).st_atime_ns, os.stat(path).st_mtime_ns + 10 ** 9))
+    result = client.fetch(url)
+    assert result.status == 'downloaded'
+    assert read(result.path) == b'second!'
+
+
+def test_falls_back_to_cached_copy_after_503s(tmp_path, standin):
+    url = serve(standin, 'a.pkl', b'first')
+    client = fetcher(tmp_path)
+    client.fetch(url)
+    standin.fail = True
+    before = len(standin.requests)
+    result = client.fetch(url)
+    assert result.status == 'fallback'
+    assert read(result.path) == b'first'
+    # Every attempt was made before falling back
+    assert len(standin.requests) - before == client.retries
+
+
+def test_falls_back_when_the_server_stalls(tmp_path, standin):
+    url = serve(standin, 'a.pkl', b'first')
+    client = fetcher(tmp_path, timeout=0.2, retries=1)
+    client.fetch(url)
+    standin.delay = 1
+    assert client.fetch(url).status == 'fallback'
+
+
+def test_failure_without_a_cached_copy_raises(tmp_path, standin):
+    url = serve(standin, 'a.pkl', b'first')
+    standin.fail = True
+    with pytest.raises(HTTPError):
+        fetcher(tmp_path).fetch(url)
+
+
+def test_unreadable_meta_is_a_cache_miss(tmp_path, standin):
+    url = serve(standin, 'a.pkl', b'first')
+    client = fetcher(tmp_path)
+    client.fetch(url)
+    _, meta = client._paths(url)
+    # As left by a worker that died half way through writing it
+    with open(meta, 'w') as fh:
+        fh.write('{"url": "ht')
+    assert client._read_meta(url) == {}
+    result = client.fetch(url)
+    assert result.status == 'downloaded'
+    assert client._read_meta(url)['etag'] == result.etag
+
+
+def test_no_temp_files_are_left_behind(tmp_path, standin):
+    url = serve(standin, 'a.pkl', b'first')
+    client = fetcher(tmp_path)
+    client.fetch(url)
+    client.fetch(url)
+    body, meta = client._paths(url)
+    assert sorted(os.listdir(client.cache_dir)) == sorted([os.path.basename(body), os.path.basename(meta)])
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+import aggregate
+import callbacks
+import labels
+import plots
+from benchmarks import synthetic
+
+METRICS = ['confirmed', 'deaths']
+
+
+@pytest.fixture(scope='module')
+def loaded():
+    master_all, master_pid = synthetic.make_frames(n_pids=120, n_days=20)
+    data = callbacks.set_data(*callbacks.prepare_data(master_all.copy(), master_pid.copy()), version='labels')
+    return master_all, data
+
+
+def original_traces(master_all, data, date_value, relative_check, level):
+    '''The map traces of one date from the frame as it comes, with its text columns'''
+    date = data.date_mapper.iloc[date_value]['Date']
+    rows = master_all[(master_all['Date'] == date) & (master_all['country'] != 'worldwide')]
+    rows = rows[rows['granularity'].isin(['country', 'state', 'county'])]
+    rows = aggregate.cluster_counties(rows, data.county_grid, level)
+    return rows, plots.map_traces(rows, METRICS, relative_check)
+
+
+def test_format_thousands():
+    values = np.array([0, 7, -7, 999, 1000, -1000, 123456789, 10 ** 15 + 1,
+                       np.iinfo(np.int64).max, np.iinfo(np.int64).min])
+    assert list(labels.format_thousands(values)) == ['{:,}'.format(v) for v in values.tolist()]
+    assert list(labels.format_thousands([2.9, 1234.5])) == ['2', '1,234']
+    assert len(labels.format_thousands([])) == 0
+
+
+@pytest.mark.parametrize('relative_check', [[], ['relative']])
+@pytest.mark.parametrize('clustered', [False, True])
+def test_map_hover_text(loaded, relative_check, clustered):
+    master_all, data = loaded
+    level = max(data.county_grid.levels) if clustered else None
+    date_value = len(data.date_mapper) // 2
+    _, expected = original_traces(master_all, data, date_value, relative_check, level)
+    traces = callbacks.get_map_traces(data, date_value, ['country', 'state', 'county'], METRICS,
+                                      relative_check, level=level)
+    assert [t['name'] for t in traces] == [t['name'] for t in expected]
+    for trace, want in zip(traces, expected):
+        assert list(trace['text']) == list(want['text'])
+
+
+@pytest.mark.parametrize('name, metric, total, relative', [
+    ('Text_Confirmed', 'confirmed', 'Total Cases', 'Relative Cases'),
+    ('Text_Deaths', 'deaths', 'Total Deaths', 'Relative Deaths')])
+def test_relative_text_without_labels(loaded, name, metric, total, relative):
+    master_all, data = loaded
+    rows, _ = original_traces(master_all, data, len(data.date_mapper) - 1, ['relative'], None)
+    per_capita = rows['per_capita_' + metric]
+    inverse = (1 / per_capita).replace(np.inf, 0).astype(int)
+    expected = (rows[name].str.split(':').str.get(0).str.replace(total, relative) + ': 1 in ' +
+                pd.Series(['{:,}'.format(v) for v in inverse.tolist()], index=rows.index))
+    assert list(labels.relative_text(rows, name, relative, per_capita)) == list(expected)
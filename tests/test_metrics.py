@@ -0,0 +1,63 @@
+import os
+import json
+import metrics
+
+LABELS = ('test_callback', 'exponential', 'county')
+CALL = 'dash_callback_calls_total{callback="test_callback",tab="exponential",granularity="county",status="ok"}'
+
+
+def other_worker(directory, calls, duration):
+    '''What another worker flushed: `calls` ok calls of one `duration` each'''
+    histogram = [0] * (len(metrics.DURATION_BUCKETS) + 1) + [0.0]
+    histogram[0] = calls
+    histogram[-1] = calls * duration
+    with open(os.path.join(directory, '999999999.json'), 'w') as fh:
+        json.dump({metrics.CALLS.name: [[list(LABELS) + ['ok'], calls]],
+                   metrics.DURATION.name: [[list(LABELS), histogram]]}, fh)
+
+
+def test_render_sums_the_workers(tmp_path):
+    directory = str(tmp_path)
+    other_worker(directory, 3, 0.001)
+    metrics.CALLS.inc(LABELS + ('ok',), 2)
+    metrics.DURATION.observe(LABELS, 0.001)
+    lines = metrics.render(directory).splitlines()
+    assert CALL + ' 5' in lines
+    bucket = ('dash_callback_duration_seconds_bucket{callback="test_callback",tab="exponential",'
+              'granularity="county",le="0.005"}')
+    assert bucket + ' 4' in lines
+    assert '{}.json'.format(os.getpid()) in os.listdir(directory)
+    # Scraping again doesn't count twice
+    assert CALL + ' 5' in metrics.render(directory).splitlines()
+
+
+def test_unreadable_worker_file_is_skipped(tmp_path):
+    directory = str(tmp_path)
+    with open(os.path.join(directory, '999999998.json'), 'w') as fh:
+        fh.write('{"dash_callback')
+    assert metrics.render(directory).startswith('# HELP')
+
+
+def test_without_directory_series_name_the_worker():
+    metrics.CALLS.inc(LABELS + ('ok',))
+    call = CALL[:-1] + ',worker="{}"}}'.format(os.getpid())
+    assert any(line.startswith(call + ' ') for line in metrics.render(None).splitlines())
+
+
+def labels_for(application, component_id, value):
+    body = {'inputs': [{'id': component_id, 'property': 'value', 'value': value}]}
+    with application.application.test_request_context('/_dash-update-component', method='POST', json=body):
+        return metrics._labels('test_callback')
+
+
+def test_labels_take_the_layout_tab_values(application):
+    for container in (application.get_tabs_container({}), application.get_table_tabs_container({})):
+        for tab in container.children:
+            assert labels_for(application, container.id, tab.value)[1] == tab.value
+
+
+def test_labels_take_the_layout_granularities(application):
+    dials = application.get_map_dials({})
+    checklist = next(c for c in dials if getattr(c, 'id', None) == 'check-locations')
+    values = [option['value'] for option in checklist.options]
+    assert labels_for(application, 'check-locations', values)[2] == '+'.join(values)
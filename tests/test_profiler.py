@@ -0,0 +1,49 @@
+import flask
+import pytest
+import profiler
+
+
+class App:
+    def __init__(self):
+        self.server = flask.Flask(__name__)
+        self.callback_map = {}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler, 'TOKEN', 'secret')
+    monkeypatch.setattr(profiler, 'PROFILE_DIR', str(tmp_path))
+    (tmp_path / 'call.collapsed').write_text('main 1\n')
+    app = App()
+    profiler.register(app)
+    yield app.server.test_client()
+    profiler.arm(0)
+
+
+def test_token_is_not_taken_from_the_query_string(client):
+    assert client.get('/_profile?token=secret').status_code == 403
+    assert client.get('/_profile/files/call.collapsed?token=secret').status_code == 403
+    assert client.post('/_profile/arm?token=secret&count=2').status_code == 403
+    assert profiler.armed()['remaining'] == 0
+
+
+def test_header(client):
+    response = client.post('/_profile/arm', data={'count': 2}, headers={'X-Admin-Token': 'secret'})
+    assert response.get_json()['remaining'] == 2
+
+
+def test_sign_in_sets_a_cookie_and_links_leave_the_token_out(client):
+    response = client.post('/_profile', data={'token': 'secret'})
+    assert response.status_code == 200
+    page = response.get_data(as_text=True)
+    assert 'secret' not in page
+    assert 'href="/_profile/files/call.collapsed"' in page
+    assert 'HttpOnly' in response.headers['Set-Cookie']
+    # The test client keeps the cookie for the links and the arm form
+    assert client.get('/_profile/files/call.collapsed').status_code == 200
+    assert client.post('/_profile/arm', data={'count': 1}).get_json()['remaining'] == 1
+
+
+def test_wrong_token(client):
+    assert client.post('/_profile', data={'token': 'wrong'}).status_code == 403
+    assert 'Set-Cookie' not in client.post('/_profile', data={'token': 'wrong'}).headers
@@ -0,0 +1,153 @@
+import os
+import time
+import pytest
+import fetch
+import refresher
+import snapshot
+from benchmarks import synthetic
+
+
+def write_data(directory, n_days, bump=0):
+    '''Synthetic pickles with n_days dates, their mtime moved `bump` seconds on'''
+    synthetic.write_pickles(str(directory), n_pids=20, n_days=n_days)
+    for name in ('MASTER_ALL.pkl', 'MASTER_PID.pkl'):
+        path = os.path.join(str(directory), name)
+        stat = os.stat(path)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + bump * 10 ** 9))
+
+
+class Counting:
+    '''A source that counts its loads'''
+
+    def __init__(self, source):
+        self.source = source
+        self.loads = 0
+
+    def version(self):
+        return self.source.version()
+
+    def load(self):
+        self.loads += 1
+        return self.source.load()
+
+
+def n_dates():
+    return len(snapshot.current().date_mapper)
+
+
+@pytest.fixture
+def file_source(tmp_path):
+    write_data(tmp_path, 10)
+    return Counting(refresher.FileSource({'all': str(tmp_path / 'MASTER_ALL.pkl'),
+                                          'pid': str(tmp_path / 'MASTER_PID.pkl')}))
+
+
+def test_unchanged_file_version_is_not_reloaded(file_source):
+    data_refresher = refresher.DataRefresher(file_source)
+    assert data_refresher.check()
+    loaded = snapshot.current()
+    assert loaded is data_refresher.current
+    assert not data_refresher.check()
+    assert file_source.loads == 1
+    assert snapshot.current() is loaded
+
+
+def test_changed_file_is_reloaded(tmp_path, file_source):
+    data_refresher = refresher.DataRefresher(file_source)
+    data_refresher.check()
+    before = n_dates()
+    write_data(tmp_path, 12, bump=5)
+    assert data_refresher.check()
+    assert file_source.loads == 2
+    assert n_dates() == before + 2
+
+
+def test_failed_refresh_keeps_serving_the_old_snapshot(tmp_path, file_source):
+    data_refresher = refresher.DataRefresher(file_source, ttl=0.05)
+    data_refresher.start()
+    loaded = snapshot.current()
+    os.remove(str(tmp_path / 'MASTER_ALL.pkl'))
+    try:
+        deadline = time.time() + 10
+        while data_refresher.last_error is None and time.time() < deadline:
+            time.sleep(0.02)
+    finally:
+        data_refresher.stop()
+    assert isinstance(data_refresher.last_error, OSError)
+    assert data_refresher.loaded.is_set()
+    assert snapshot.current() is loaded
+
+
+@pytest.fixture
+def url_source(tmp_path, standin):
+    write_data(standin.directory, 10)
+    fetcher = fetch.CachedFetcher(cache_dir=str(tmp_path / 'cache'), retries=2, backoff=0)
+    return refresher.URLSource({'all': standin.url + '/MASTER_ALL.pkl',
+                                'pid': standin.url + '/MASTER_PID.pkl'}, fetcher)
+
+
+def gets(standin, since):
+    return [path for method, path in standin.requests[since:] if method == 'GET']
+
+
+def test_unchanged_url_version_is_checked_without_downloading(url_source, standin):
+    data_refresher = refresher.DataRefresher(url_source)
+    assert data_refresher.check()
+    assert sorted(gets(standin, 0)) == ['/MASTER_ALL.pkl', '/MASTER_PID.pkl']
+    since = len(standin.requests)
+    assert not data_refresher.check()
+    assert [method for method, _ in standin.requests[since:]] == ['HEAD', 'HEAD']
+
+
+def test_changed_url_is_downloaded_and_reloaded(url_source, standin):
+    data_refresher = refresher.DataRefresher(url_source)
+    data_refresher.check()
+    before = n_dates()
+    write_data(standin.directory, 12, bump=5)
+    since = len(standin.requests)
+    assert data_refresher.check()
+    assert sorted(gets(standin, since)) == ['/MASTER_ALL.pkl', '/MASTER_PID.pkl']
+    assert n_dates() == before + 2
+
+
+def test_unreachable_url_keeps_serving_the_old_snapshot(url_source, standin):
+    data_refresher = refresher.DataRefresher(url_source)
+    data_refresher.check()
+    loaded = snapshot.current()
+    standin.fail = True
+    # The cached validators are those of the loaded version
+    assert not data_refresher.check()
+    assert snapshot.current() is loaded
+
+
+def test_first_load_from_the_cache_when_the_server_is_down(tmp_path, url_source, standin):
+    refresher.DataRefresher(url_source).check()
+    standin.fail = True
+    # A new worker on the same cache directory
+    data_refresher = refresher.DataRefresher(url_source)
+    assert data_refresher.check()
+    assert data_refresher.loaded.is_set()
+
+
+def test_first_load_without_server_or_cache_fails(url_source, standin):
+    standin.fail = True
+    with pytest.raises(OSError):
+        refresher.DataRefresher(url_source).check()
+
+
+def test_two_versions_in_memory_while_loading(tmp_path, file_source):
+    seen = []
+
+    class Watching(Counting):
+        def load(self):
+            seen.append(len(snapshot.versions()) + len(snapshot.stats()['retired']))
+            return Counting.load(self)
+
+    source = Watching(file_source.source)
+    data_refresher = refresher.DataRefresher(source)
+    for days in (10, 11, 12, 13):
+        write_data(tmp_path, days, bump=days)
+        data_refresher.check()
+    # The one being loaded makes RETAIN, and the current one always stays
+    assert seen and all(n <= max(snapshot.RETAIN - 1, 1) for n in seen)
+    assert len(snapshot.versions()) == snapshot.RETAIN
@@ -0,0 +1,50 @@
+import os
+import pytest
+import sharedcache
+
+
+@pytest.fixture
+def workers(tmp_path):
+    '''Two workers sharing one SQLite file'''
+    path = os.path.join(str(tmp_path), 'cache.db')
+    return sharedcache.SQLiteBackend(path), sharedcache.SQLiteBackend(path)
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        sharedcache.CacheBackend()
+
+
+def test_retain_keeps_versions_other_workers_serve(workers):
+    first, second = workers
+    second.set('v1:a', b'old', version='v1')
+    first.set('v2:a', b'new', version='v2')
+    first.retain(['v2'])
+    assert second.get('v1:a') == b'old'
+    assert first.get('v2:a') == b'new'
+
+
+def test_retain_drops_expired(workers):
+    first, second = workers
+    second.ttl = -1
+    second.set('v1:a', b'old', version='v1')
+    first.retain(['v2'])
+    assert first.stats()['size'] == 0
+
+
+def test_clear_only_drops_unversioned(workers):
+    first, second = workers
+    second.set('v1:a', b'old', version='v1')
+    second.set('None:a', b'unversioned')
+    first.clear()
+    assert second.get('v1:a') == b'old'
+    assert second.get('None:a') is None
+
+
+def test_memory_backend_retain():
+    backend = sharedcache.MemoryBackend()
+    backend.set('v1:a', b'old', version='v1')
+    backend.set('v2:a', b'new', version='v2')
+    backend.retain(['v2'])
+    assert backend.get('v1:a') is None
+    assert backend.get('v2:a') == b'new'
@@ -0,0 +1,52 @@
+from collections import OrderedDict
+import pytest
+import snapshot
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    '''Empty module state, retaining two versions'''
+    monkeypatch.setattr(snapshot, 'RETAIN', 2)
+    monkeypatch.setattr(snapshot, '_current', None)
+    monkeypatch.setattr(snapshot, '_versions', OrderedDict())
+    monkeypatch.setattr(snapshot, '_holders', {})
+    monkeypatch.setattr(snapshot, '_retired', [])
+
+
+def make(version):
+    return snapshot.DataSnapshot(version, *[None] * 9)
+
+
+def in_memory():
+    return len(snapshot.versions()) + len(snapshot.stats()['retired'])
+
+
+def test_make_room_keeps_the_current_version():
+    snapshot.publish(make('a'))
+    snapshot.publish(make('b'))
+    assert snapshot.make_room() == ['a']
+    assert snapshot.versions() == ['b']
+    snapshot.publish(make('c'))
+    assert snapshot.versions() == ['b', 'c']
+
+
+def test_make_room_counts_retired_versions():
+    snapshot.publish(make('a'))
+    held = snapshot.acquire('a')
+    snapshot.publish(make('b'))
+    snapshot.publish(make('c'))
+    # a is retired and held, so b goes too and only c is left
+    assert snapshot.make_room() == ['b']
+    assert snapshot.versions() == ['c']
+    assert in_memory() == 2
+    assert not snapshot.wait_retired(0)
+    snapshot.release(held)
+    assert snapshot.wait_retired(0)
+    assert in_memory() == 1
+
+
+def test_make_room_with_one_version_retained(monkeypatch):
+    monkeypatch.setattr(snapshot, 'RETAIN', 1)
+    snapshot.publish(make('a'))
+    assert snapshot.make_room() == []
+    assert snapshot.versions() == ['a']